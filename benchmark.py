@@ -0,0 +1,376 @@
+"""
+Benchmarks each stage of the pipeline on synthetic data of increasing size.
+
+Run from the repository folder, e.g.
+    python benchmark.py --sizes 10000 1000000 10000000
+The time and peak memory of every stage are saved to a json report, and two
+reports can be compared with
+    python benchmark.py --compare old.json new.json
+and clensing in shards can be checked against clensing all at once with
+    python benchmark.py --check-shards --sizes 10000
+"""
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import argparse
+import inspect
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from synthetic_data import write_synthetic_data
+from utils import parse_datetime_columns
+from vocabulary import encode_columns
+import data_cleaning_and_transformation as cleaning
+import main_data_cleaning_function
+import pathway_definitions as pathways
+import process_durations as durations
+import config
+
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+#Stages being measured, innermost last, so memory peaks of nested stages are
+#also counted in the stages around them.
+open_stages = []
+
+
+@contextmanager
+def measure(results, stage, trace_memory):
+    """
+    Args:
+        results (dict[str, dict]): the results of each stage, added to.
+        stage (str): name of the stage.
+        trace_memory (bool): flag to record the peak memory of the stage.
+    """
+    if trace_memory:
+        start_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    open_stages.append({"peak": 0})
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        inner = open_stages.pop()
+        peak = None
+        if trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], inner["peak"])
+            if open_stages:
+                open_stages[-1]["peak"] = max(open_stages[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            peak = (peak - start_memory) / 2**20
+        result = results.setdefault(stage, {"seconds": 0.0, "calls": 0,
+                                            "peak_memory_mb": peak})
+        result["seconds"] += seconds
+        result["calls"] += 1
+        if peak is not None:
+            result["peak_memory_mb"] = max(result["peak_memory_mb"], peak)
+
+
+@contextmanager
+def measure_functions(results, prefix, module, names, trace_memory):
+    """
+    Args:
+        results (dict[str, dict]): the results of each stage, added to.
+        prefix (str): prefix of the stage names.
+        module (module): module the functions are called through.
+        names (list[str]): names of the functions to measure every call of.
+        trace_memory (bool): flag to record peak memory.
+    """
+    originals = {name: getattr(module, name) for name in names}
+
+    def measured(name, function):
+        """
+        Args:
+            name (str): name of the function.
+            function (Callable): function to measure.
+
+        Returns:
+            Callable: the function, measured every time it is called.
+        """
+        @wraps(function)
+        def measured_function(*args, **kwargs):
+            with measure(results, f"{prefix}/{name}", trace_memory):
+                return function(*args, **kwargs)
+        return measured_function
+
+    for name, function in originals.items():
+        setattr(module, name, measured(name, function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(module, name, function)
+
+
+def benchmark_pipeline(data_path, trace_memory=True):
+    """
+    Args:
+        data_path (Path): folder with the raw data csvs.
+        trace_memory (bool, optional): flag to record peak memory. Defaults to
+        True.
+
+    Returns:
+        dict[str, dict]: the seconds, number of calls and peak memory of each
+        stage.
+    """
+    results = {}
+
+    with measure(results, "load_data", trace_memory):
+        events_raw = parse_datetime_columns(
+                     pd.read_csv(data_path / "FN_Events.csv"), ["EventTime"])
+        adm_status_raw = pd.read_csv(data_path / "FN_AdmissionStatus.csv")
+        obs_raw = parse_datetime_columns(pd.read_csv(data_path / "FN_Obs.csv"),
+                                         ["ChartDateTime"])
+        diagnostics_raw = parse_datetime_columns(
+                          pd.read_csv(data_path / "FN_Diagnostics.csv"),
+                          ["Request DateTime"])
+
+    with measure(results, "rename_columns_and_collapse_data_diagnostics",
+                 trace_memory):
+        diagnostics_quality = cleaning.rename_columns_and_collapse_data_diagnostics(
+                              pd.Timedelta("5m"), diagnostics_raw)
+    with measure(results, "rename_columns_and_change_events_to_obs",
+                 trace_memory):
+        obs_quality = cleaning.rename_columns_and_change_events_to_obs(obs_raw)
+
+    if config.use_categorical_vocabulary:
+        with measure(results, "encode_columns", trace_memory):
+            events_raw = encode_columns(events_raw)
+            adm_status_raw = encode_columns(adm_status_raw, ["Adm"])
+            obs_quality = encode_columns(obs_quality)
+            diagnostics_quality = encode_columns(diagnostics_quality)
+
+    with measure(results, "drop_duplicates_and_anomaly_times_events_data",
+                 trace_memory):
+        events_quality = cleaning.drop_duplicates_and_anomaly_times_events_data(
+                         events_raw, config.repeat_time_threshold,
+                         config.remove_duplicate_staffid,
+                         config.remove_duplicate_location)
+
+    #Measure every step of the clensing, as called through each module.
+    cleaning_steps = [name for name, function
+                      in inspect.getmembers(cleaning, inspect.isfunction)
+                      if function.__module__ == cleaning.__name__]
+    utils_steps = ["sort_events", "insert_events_in_order", "update_encoding"]
+    with (measure_functions(results, "cleanse_and_transform_data", cleaning,
+                            cleaning_steps, trace_memory),
+          measure_functions(results, "cleanse_and_transform_data",
+                            main_data_cleaning_function, utils_steps,
+                            trace_memory),
+          measure(results, "cleanse_and_transform_data", trace_memory)):
+        events_quality = main_data_cleaning_function.cleanse_and_transform_data(
+                         events_quality, adm_status_raw, obs_quality,
+                         diagnostics_quality, config.excluded_event_names,
+                         config.locations_to_drop,
+                         config.natural_order_for_processes,
+                         config.include_spawn_end_events,
+                         config.locations_pathway_map,
+                         config.keep_last_location)
+
+    with measure(results, "add_reset_transitions", trace_memory):
+        transitions = pathways.add_reset_transitions(events_quality)
+
+    with measure(results, "get_dfg", trace_memory):
+        pathways.get_directly_follows_graphs(transitions, "EventName",
+                                             "Pathway")
+
+    with measure(results, "add_difference_in_minutes_to_durations",
+                 trace_memory):
+        event_diffs = durations.add_difference_in_minutes_to_durations(
+                      events_quality)
+
+    with measure(results, "fit_log_normals", trace_memory):
+        durations.fit_log_normals(event_diffs)
+
+    results["rows"] = {"events_raw": len(events_raw),
+                       "events_quality": len(events_quality),
+                       "transitions": len(transitions)}
+    return results
+
+
+def get_commit():
+    """
+    Returns:
+        Optional[str]: the git commit of the code being benchmarked, with a
+        "+" if there are uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).parent).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain",
+                                  "--untracked-files=no"],
+                                 capture_output=True, text=True, check=True,
+                                 cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if changes else "")
+
+
+def run_benchmarks(sizes, work_path, seed=0, trace_memory=True):
+    """
+    Args:
+        sizes (list[int]): numbers of rows of events data to benchmark.
+        work_path (Path): folder to keep the synthetic data in. Data already
+        generated for a size and seed is reused.
+        seed (int, optional): seed of the synthetic data. Defaults to 0.
+        trace_memory (bool, optional): flag to record peak memory. Defaults to
+        True.
+
+    Returns:
+        dict: the benchmark report.
+    """
+    report = {"commit": get_commit(),
+              "date": pd.Timestamp.now().isoformat(timespec="seconds"),
+              "machine": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "python": platform.python_version(),
+              "pandas": pd.__version__, "numpy": np.__version__,
+              "seed": seed, "trace_memory": trace_memory,
+              "results": []}
+    for size in sizes:
+        size_path = Path(work_path) / f"{size} rows seed {seed}"
+        data_path = size_path / "Events Data"
+        if not (data_path / "FN_Events.csv").exists():
+            print(f"Generating {size} rows of synthetic data")
+            write_synthetic_data(data_path, size, seed)
+
+        #Run from the size's folder so the raw data cache is kept with its
+        #data.
+        working_directory = Path.cwd()
+        os.chdir(size_path)
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            print(f"Benchmarking {size} rows")
+            results = benchmark_pipeline(Path("Events Data"), trace_memory)
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            os.chdir(working_directory)
+
+        rows = results.pop("rows")
+        report["results"].append({
+            "size": size, "rows": rows,
+            "stages": [{"stage": stage, **result}
+                       for stage, result in results.items()]})
+        for stage, result in results.items():
+            print(f"    {stage}: {result['seconds']:.3f}s")
+    return report
+
+
+def check_sharded_cleansing(data_path, number_of_workers=4):
+    """
+    Args:
+        data_path (Path): folder with the raw data csvs.
+        number_of_workers (int, optional): number of shards to clense the
+        data in. Defaults to 4.
+
+    Returns:
+        bool: whether clensing the data in shards gives the same events, in
+        the same order, as clensing it all at once. One admission status row
+        has its AttendanceID blanked, so its ids are read as floats while the
+        events' are ints, as happens with real extracts.
+    """
+    events_raw = parse_datetime_columns(
+                 pd.read_csv(data_path / "FN_Events.csv"), ["EventTime"])
+    adm_status_raw = pd.read_csv(data_path / "FN_AdmissionStatus.csv")
+    adm_status_raw.loc[adm_status_raw.index[-1], "AttendanceID"] = np.nan
+    events_quality = cleaning.drop_duplicates_and_anomaly_times_events_data(
+                     events_raw, config.repeat_time_threshold,
+                     config.remove_duplicate_staffid,
+                     config.remove_duplicate_location)
+    cleansing_arguments = (events_quality, adm_status_raw, None, None,
+                           config.excluded_event_names,
+                           config.locations_to_drop,
+                           config.natural_order_for_processes,
+                           config.include_spawn_end_events,
+                           config.locations_pathway_map,
+                           config.keep_last_location)
+    serial = main_data_cleaning_function.cleanse_and_transform_data(
+             *cleansing_arguments)
+    sharded = main_data_cleaning_function.cleanse_and_transform_data_in_shards(
+              *cleansing_arguments, number_of_workers)
+    return serial.reset_index(drop=True).equals(
+           sharded.reset_index(drop=True))
+
+
+def compare_reports(old_report_path, new_report_path):
+    """
+    Args:
+        old_report_path (Path): benchmark report to compare against.
+        new_report_path (Path): benchmark report to compare.
+
+    Returns:
+        pd.DataFrame: the seconds and peak memory of each stage and size in
+        both reports, and the ratio of new to old.
+    """
+    reports = []
+    for label, path in (("old", old_report_path), ("new", new_report_path)):
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+        reports.append(pd.DataFrame([{"size": result["size"], **stage}
+                                     for result in report["results"]
+                                     for stage in result["stages"]])
+                       .set_index(["size", "stage"])
+                       [["seconds", "peak_memory_mb"]]
+                       .add_prefix(f"{label}_"))
+    comparison = reports[0].join(reports[1], how="outer")
+    comparison["seconds_ratio"] = (comparison["new_seconds"]
+                                   / comparison["old_seconds"])
+    comparison["memory_ratio"] = (comparison["new_peak_memory_mb"]
+                                  / comparison["old_peak_memory_mb"])
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="rows of events data to benchmark")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the synthetic data")
+    parser.add_argument("--work-path", type=Path,
+                        default=Path("Outputs/Benchmarks/Data"),
+                        help="folder to keep the synthetic data in")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="json report to save, defaults to "
+                             "Outputs/Benchmarks/<commit>.json")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="don't record peak memory, which slows the "
+                             "stages down")
+    parser.add_argument("--check-shards", action="store_true",
+                        help="check clensing the smallest size in shards "
+                             "gives the same events as clensing it at once")
+    parser.add_argument("--compare", type=Path, nargs=2,
+                        metavar=("OLD", "NEW"),
+                        help="compare two reports instead of benchmarking")
+    args = parser.parse_args()
+
+    if args.check_shards:
+        data_path = (args.work_path.resolve()
+                     / f"{min(args.sizes)} rows seed {args.seed}" / "Events Data")
+        if not (data_path / "FN_Events.csv").exists():
+            write_synthetic_data(data_path, min(args.sizes), args.seed)
+        os.chdir(data_path.parent)
+        same = check_sharded_cleansing(Path("Events Data"))
+        print("Sharded clensing matches serial clensing" if same
+              else "Sharded clensing differs from serial clensing")
+    elif args.compare:
+        with pd.option_context("display.max_rows", None,
+                               "display.width", 200):
+            print(compare_reports(*args.compare).round(3))
+    else:
+        report = run_benchmarks(args.sizes, args.work_path.resolve(),
+                                args.seed, not args.no_memory)
+        output = args.output or (Path("Outputs/Benchmarks")
+                                 / f"{report['commit'] or 'benchmark'}.json")
+        output.parent.mkdir(exist_ok=True, parents=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved report to {output}")
@@ -20,6 +20,30 @@ duration_processes_quantile_threshold = 1
 MAX_DIFF_MINUTES_FOR_DURATIONS = 840
 collapse_diagnostics_rows_within_time_of = pd.Timedelta("5m")
 repeat_time_threshold = 10
+#Percentages to report the visits kept when excluding visits with a transition
+#below each of them
+visit_exclusion_sweep_thresholds = [threshold / 2 for threshold in range(1, 21)]
+#Percentages to prune the pathway definition's transitions at or below
+pathway_pruning_sweep_thresholds = [threshold / 10 for threshold in range(1, 51)]
+number_of_visit_partitions = 16
+#Folder to write the visit partitions of a streamed events file to, e.g. a
+#disk with room for a copy of it. None uses the system temporary folder.
+partition_path = None
+events_read_chunksize = 1_000_000
+number_of_cleansing_workers = 1
+number_of_duration_workers = 4
+number_of_scenario_workers = 4
+number_of_render_workers = 4
+number_of_csv_writer_workers = 1
+#Threads to write outputs with while the pipeline carries on (0 writes them
+#straight away), and the most MB of tables that can be waiting to be written
+number_of_writer_threads = 2
+max_pending_write_mb = 512
+#Window of the day used by the daytime durations, inclusive
+daytime_start_time = "08:00:00"
+daytime_end_time = "20:00:00"
+weekend_daytime_start_time = "08:00:00"
+weekend_daytime_end_time = "20:00:00"
 
 #######################STRINGS#######################
 #Nodes
@@ -38,6 +62,11 @@ ENP = "ENP"
 ACP = "ACP"
 #Other
 PROCESS_REQUIREMENTS_COLUMN = "Event (Pathway)"
+#Format of the events data and event log outputs, "csv" or "parquet", and the
+#column to partition parquet outputs into a folder per value by (e.g.
+#"Pathway"), or None
+output_format = "csv"
+output_partition_column = None
 
 #######################BOOLS#######################
 remove_duplicate_staffid = False
@@ -47,9 +76,16 @@ include_diag_data = False
 include_admission_data = True
 export_event_log_csv = False
 export_log_to_csv_after_using_log_converter = False
+export_pruned_pathway_definitions = False
 keep_last_location = True
 include_spawn_end_events = False
 plots = False
+cache_raw_data = True
+hash_raw_data_for_cache = False
+stream_events_data = False
+incremental_update = False
+use_categorical_vocabulary = True
+profile_pipeline = False
 
 #######################LISTS/DICTS#######################
 event_names_to_exclude_for_repetition = ["Triaged", "Discharged", "Booked In",
@@ -1,8 +1,13 @@
-from utils import sort_events
+from profiling import profiled
+from utils import (insert_events_in_order, parse_timestamps,
+                   find_duplicates_within_window, get_sort_codes)
+from vocabulary import map_values, map_strings, constant_like, is_encoded
 from config import WALK_IN, SPAWN, REMOVED, WAITING_FOR_BED, admitted_map
+import numpy as np
 import pandas as pd
 
 #-----------------------------------initial cleaning functions on raw data
+@profiled
 def drop_duplicates_and_anomaly_times_events_data(events_raw,
                                                   repeat_time_threshold,
                                                   remove_duplicate_staffid,
@@ -22,51 +27,30 @@ def drop_duplicates_and_anomaly_times_events_data(events_raw,
         pd.DataFrame: version of events df with duplicates removed.
     """
 
-    #Remove fully duplicated entries, format datetime column and remove
-    #any data from before 2018-04-01
-    events_quality = events_raw.copy().drop_duplicates()
-    events_quality["EventTime"] = pd.to_datetime(events_quality["EventTime"],
-                                                 format="%d/%m/%Y %H:%M")
-    events_quality = events_quality.dropna(subset=["EventTime"])
-
-    events_quality = events_quality.loc[~(events_quality["EventTime"]
-                                        < pd.to_datetime("2018-04-01"))].copy()
-
-    #Add diff column of the time between duplicate events for the same VisitId.
-    #Fill in NaT with the threshold+1 so these don't get filtered out.
-    events_quality = events_quality.sort_values(by=['VisitId', 'EventName',
-                                                    'EventTime'])
-    events_quality['diff'] = ((events_quality.groupby(['VisitId', 'EventName'])
-                              ['EventTime'].diff().infer_objects(copy=False)
-                              .fillna(pd.Timedelta('NaT')).dt.seconds / 60)
-                              .fillna(repeat_time_threshold+1))
-    #Empty list of flag cols, populate if any of the flags are True
-    flagcols = []
+    #Format datetime column and remove any data without a time or from
+    #before 2018-04-01
+    events_quality = events_raw[['VisitId', 'EventName', 'EventTime',
+                                 'EventStaffId', 'EventLocation']].copy()
+    events_quality["EventTime"] = parse_timestamps(events_quality["EventTime"])
+    events_quality = events_quality.loc[events_quality["EventTime"]
+                                        >= pd.to_datetime("2018-04-01")]
+
+    #Remove fully duplicated entries, and events within n minutes of the
+    #previous event of the same name for the same VisitId. If any of the flags
+    #are True, the staff member and/or location must be the same too.
+    match_columns = []
     if remove_duplicate_staffid:
-        events_quality['DuplicateStaffId'] = (events_quality['EventStaffId']
-                                    == events_quality['EventStaffId'].shift(1))
-        flagcols.append('DuplicateStaffId')
-
+        match_columns.append('EventStaffId')
     if remove_duplicate_location:
-        events_quality['DuplicateLocation'] = (events_quality['EventLocation']
-                                    == events_quality['EventLocation'].shift(1))
-        flagcols.append('DuplicateLocation')
-
-    #if there are flags set to true, add the filter for these into the mask to
-    #drop duplicate events
-    if flagcols:
-        mask = ~((events_quality['diff'] < repeat_time_threshold)
-                 & (events_quality[flagcols].all(axis=1)))
-    else:
-        mask = ~(events_quality['diff'] < repeat_time_threshold)
-
-    #use mask to remove duplicate events within n minutes of each other
-    events_quality = events_quality.loc[mask, ['VisitId', 'EventName',
-                                               'EventTime', 'EventStaffId',
-                                               'EventLocation']].copy()
-    return events_quality
+        match_columns.append('EventLocation')
+    order, duplicated = find_duplicates_within_window(
+                        events_quality, ['VisitId', 'EventName'],
+                        pd.Timedelta(minutes=repeat_time_threshold),
+                        match_columns, ['EventStaffId', 'EventLocation'])
+    return events_quality.iloc[order[~duplicated]]
 
 
+@profiled
 def rename_columns_and_collapse_data_diagnostics(
         collapse_diagnostics_rows_within_time_of, diagnostics_raw):
     """
@@ -85,19 +69,23 @@ def rename_columns_and_collapse_data_diagnostics(
                                             "ItemMasterCategory": "EventName",
                                             "Request DateTime": "EventTime",
                                             "VisitID": "VisitId"})
-    diagnostics_quality["EventTime"] = pd.to_datetime(
-                    diagnostics_quality["EventTime"], format="%d/%m/%Y %H:%M")
+    diagnostics_quality["EventTime"] = parse_timestamps(
+                                       diagnostics_quality["EventTime"])
 
     # collapse similar rows within a short time for a patient to one row
-    mask = (diagnostics_quality.sort_values(by=["VisitId", "EventTime"])
-            .groupby("VisitId")["EventTime"].diff()
-            .lt(collapse_diagnostics_rows_within_time_of).sort_index())
-
-    # index the df with this mask to remove the duplicates
+    order, duplicated = find_duplicates_within_window(
+                        diagnostics_quality, ["VisitId"],
+                        collapse_diagnostics_rows_within_time_of)
+
+    # index the df with this mask to remove the duplicates, keeping the rows
+    # in their original order
+    mask = np.zeros(len(diagnostics_quality), dtype=bool)
+    mask[order[duplicated]] = True
     diagnostics_quality = diagnostics_quality.loc[~mask].copy()
     return diagnostics_quality
 
 
+@profiled
 def rename_columns_and_change_events_to_obs(obs_raw):
     """
     Args:
@@ -110,12 +98,12 @@ def rename_columns_and_change_events_to_obs(obs_raw):
     obs_quality = obs_raw.rename(columns={"ChartType": "EventName",
                                           "ChartDateTime": "EventTime",
                                           "VisitID": "VisitId"})
-    obs_quality["EventTime"] = pd.to_datetime(obs_quality["EventTime"],
-                                              format="%d/%m/%Y %H:%M")
+    obs_quality["EventTime"] = parse_timestamps(obs_quality["EventTime"])
     obs_quality["EventName"] = "Observations"
     return obs_quality
 
 #------------------------Cleaning functions used in main cleaning function
+@profiled
 def remove_repeats_of_events_that_should_not_be_repeated(events_quality,
                                         event_name_to_exclude_for_repetition):
     """
@@ -139,15 +127,16 @@ def remove_repeats_of_events_that_should_not_be_repeated(events_quality,
     return events_quality
 
 
+@profiled
 def remove_events_after_discharged(events_quality):
     """
     Args:
-        events_quality (pd.DataFrame): clensed events data frame.
+        events_quality (pd.DataFrame): clensed events data frame, sorted by
+        sort_events.
 
     Returns:
         pd.DataFrame: events data frame with any events after discharge removed.
     """
-    events_quality = events_quality.sort_values(by=["VisitId", "EventTime"])
     target_event = "Discharged"
     events_quality["target_event"] = events_quality["EventName"] == target_event
     events_quality["after_target_event"] = (events_quality.groupby("VisitId")
@@ -159,6 +148,7 @@ def remove_events_after_discharged(events_quality):
     return events_quality
 
 
+@profiled
 def augmenting_admittance_data(adm_status_raw, events_quality):
 
     """_summary_
@@ -182,6 +172,7 @@ def augmenting_admittance_data(adm_status_raw, events_quality):
     return events_quality
 
 
+@profiled
 def merge_data(events_quality, diagnostics_quality, obs_quality):
     """
     Args:
@@ -198,11 +189,11 @@ def merge_data(events_quality, diagnostics_quality, obs_quality):
         events_quality = pd.concat([events_quality, obs_quality])
     if diagnostics_quality is not None:
         events_quality = pd.concat([events_quality, diagnostics_quality])
-    events_quality["EventTime"] = pd.to_datetime(events_quality["EventTime"],
-                                                  format="%d/%m/%Y %H:%M")
+    events_quality["EventTime"] = parse_timestamps(events_quality["EventTime"])
     return events_quality
 
 
+@profiled
 def remove_excluded_events_and_locations(events_quality, excluded_event_names,
                                          locations_to_drop):
     """
@@ -228,6 +219,7 @@ def remove_excluded_events_and_locations(events_quality, excluded_event_names,
     return events_quality
 
 
+@profiled
 def set_location_for_ambulance_arrival(events_quality):
     """
     Args:
@@ -244,20 +236,57 @@ def set_location_for_ambulance_arrival(events_quality):
     return events_quality
 
 
-def forward_fill_on_locations(events_quality):
+def get_location_fill_order(events_quality):
+    """
+    Args:
+        events_quality (pd.DataFrame): clensed events dataframe.
+
+    Returns:
+        np.ndarray: positions of the events sorted by VisitId, EventTime then
+        EventName, the order their locations have always been forward filled
+        in. Events in the same minute are in name order rather than natural
+        order, so which of them a missing location is filled from is the same.
+    """
+    names = events_quality["EventName"]
+    if is_encoded(names):
+        #The vocabulary is in the order names were first seen, so rank its
+        #names alphabetically, with missing names last.
+        categories = names.cat.categories.to_numpy(dtype=str)
+        name_ranks = np.append(np.argsort(np.argsort(categories)),
+                               len(categories))
+        name_codes = name_ranks[names.cat.codes.to_numpy()]
+    else:
+        name_codes = get_sort_codes(names)[0]
+    return np.lexsort((name_codes,
+                       get_sort_codes(events_quality["EventTime"])[0],
+                       get_sort_codes(events_quality["VisitId"])[0]))
+
+
+@profiled
+def forward_fill_on_locations(events_quality, fill_order=None):
     """
     Args:
         events_quality (pd.DataFrame): clensed events dataframe.
+        fill_order (Optional[np.ndarray], optional): positions of every event
+        in the order to fill their locations in. Defaults to None, the order
+        of the dataframe.
     Returns:
         pd.DataFrame: clensed events dataframe with missing event locations
         filled in.
     """
-    events_quality["EventLocation"] = (events_quality.groupby("VisitId")
-                                       ["EventLocation"].ffill())
+    if fill_order is None:
+        events_quality["EventLocation"] = (events_quality.groupby("VisitId")
+                                           ["EventLocation"].ffill())
+        return events_quality
+
+    filled = (events_quality.iloc[fill_order].groupby("VisitId")
+              ["EventLocation"].ffill())
+    events_quality["EventLocation"] = filled.iloc[np.argsort(fill_order)].array
 
     return events_quality
 
 
+@profiled
 def mapping_of_natural_order(events_quality, natural_order_for_processes):
     """
     Args:
@@ -268,17 +297,29 @@ def mapping_of_natural_order(events_quality, natural_order_for_processes):
     Returns:
         pd.DataFrame: clensed dataframe with an order number assigned to events.
     """
-
-    events_quality["natural_order"] = (events_quality["EventName"]
-                                       .map(natural_order_for_processes))
+    #Admitted events take the order of the event they are renamed to in
+    #add_wait_for_beds_for_admitted_patients, so they are already in the
+    #right place when the events are sorted.
+    natural_order_for_processes = {
+        **{event: natural_order_for_processes[admitted]
+           for event, admitted in admitted_map.items()
+           if admitted in natural_order_for_processes},
+        **natural_order_for_processes}
+    events_quality["natural_order"] = map_values(events_quality["EventName"],
+                                                 natural_order_for_processes)
 
     return events_quality
 
 
-def add_walk_in_for_non_ambulance_arrivals(events_quality):
+@profiled
+def add_walk_in_for_non_ambulance_arrivals(events_quality,
+                                           natural_order_for_processes):
     """
     Args:
-        events_quality (pd.DataFrame): clensed events dataframe.
+        events_quality (pd.DataFrame): clensed events dataframe, sorted by
+        sort_events.
+        natural_order_for_processes (dict[str, int]): dictionary of the ideal
+        order of processes.
 
     Returns:
         pd.DataFrame: clensed events dataframe with walkin for non ambulance
@@ -298,24 +339,33 @@ def add_walk_in_for_non_ambulance_arrivals(events_quality):
                                  [["EventTime"]].min())
 
     # copy df and add the walk in event
-    only_walk_ins_first_event["EventName"] = WALK_IN
-    # add back to main df
-    events_quality = pd.concat([events_quality, only_walk_ins_first_event])
+    only_walk_ins_first_event["EventName"] = constant_like(WALK_IN,
+                                             events_quality["EventName"],
+                                             only_walk_ins_first_event.index)
+    only_walk_ins_first_event = mapping_of_natural_order(
+                                only_walk_ins_first_event,
+                                natural_order_for_processes)
+    # add back to main df in order
+    events_quality = insert_events_in_order(events_quality,
+                                            only_walk_ins_first_event)
 
     return events_quality
 
 
-def add_wait_for_beds_for_admitted_patients(events_quality):
+@profiled
+def add_wait_for_beds_for_admitted_patients(events_quality,
+                                            natural_order_for_processes):
     """
     Args:
-        events_quality (pd.DataFrame): clensed events dataframe.
+        events_quality (pd.DataFrame): clensed events dataframe, sorted by
+        sort_events.
+        natural_order_for_processes (dict[str, int]): dictionary of the ideal
+        order of processes.
 
     Returns:
         pd.DataFrame: clensed events dataframe with wait for bed as an event for
         admitted patients.
     """
-
-    events_quality = sort_events(events_quality)
     #Get last event for each patient
     lastevent_filter_groupby = (events_quality
                                  .groupby("VisitId", as_index=False)
@@ -325,43 +375,59 @@ def add_wait_for_beds_for_admitted_patients(events_quality):
                                  lastevent_filter_groupby["EventName"]
                                  != "Discharged"].copy()
     #Add in the extra wait for bed event
-    admitted_patients["EventName"] = (WAITING_FOR_BED + " - "
-                                      + admitted_patients["EventName"] + "")
+    admitted_patients["EventName"] = map_strings(
+                                     lambda name: f"{WAITING_FOR_BED} - {name}",
+                                     admitted_patients["EventName"])
+    admitted_patients = mapping_of_natural_order(admitted_patients,
+                                                 natural_order_for_processes)
     #rename admitted events to just admitted
-    events_quality['EventName'] = (events_quality['EventName']
-                                   .replace(admitted_map))
+    events_quality['EventName'] = map_strings(
+                                  lambda name: admitted_map.get(name, name),
+                                  events_quality['EventName'])
 
-    events_quality = pd.concat([events_quality, admitted_patients])
+    events_quality = insert_events_in_order(events_quality, admitted_patients)
 
     return events_quality
 
 
+@profiled
 def add_spawn_end_events(events_quality, natural_order_for_processes):
     """
     Args:
-        events_quality (pd.DataFrame): clensed events dataframe.
+        events_quality (pd.DataFrame): clensed events dataframe, sorted by
+        sort_events.
+        natural_order_for_processes (dict[str, int]): dictionary of the ideal
+        order of processes.
 
     Returns:
         pd.DataFrame: clensed events dataframe with spawned and removed events.
     """
     # groupby to get min values - spawn
     min_df = events_quality.groupby("VisitId", as_index=False)["EventTime"].first()
-    min_df["EventName"] = SPAWN
+    min_df["EventName"] = constant_like(SPAWN, events_quality["EventName"],
+                                        min_df.index)
     min_df["natural_order"] = natural_order_for_processes[SPAWN]
 
     # groupby to get max values - end
     max_df = events_quality.groupby("VisitId", as_index=False)["EventTime"].max()
-    max_df["EventName"] = REMOVED
+    max_df["EventName"] = constant_like(REMOVED, events_quality["EventName"],
+                                        max_df.index)
     max_df["natural_order"] = natural_order_for_processes[REMOVED]
 
-    # concat these to main dataframe
-    events_quality = pd.concat([events_quality, min_df, max_df])
-    events_quality = sort_events(events_quality)
-    events_quality["EventLocation"] = events_quality["EventLocation"].ffill()
+    # add these to main dataframe in order
+    events_quality = insert_events_in_order(events_quality,
+                                            pd.concat([min_df, max_df]))
+    #Fill the location of the new events from within the same visit, so a
+    #spawn event never picks up the location of the previous patient.
+    events_quality["EventLocation"] = (events_quality.groupby("VisitId")
+                                       ["EventLocation"].ffill())
+    events_quality["EventLocation"] = (events_quality.groupby("VisitId")
+                                       ["EventLocation"].bfill())
 
     return events_quality
 
 
+@profiled
 def keep_last_location_of_patient(events_quality):
     """
     Args:
@@ -375,6 +441,7 @@ def keep_last_location_of_patient(events_quality):
     return events_quality
 
 
+@profiled
 def map_locations_to_triage_category_and_create_pathway_column(events_quality,
                                                          locations_pathway_map):
     """
@@ -389,11 +456,12 @@ def map_locations_to_triage_category_and_create_pathway_column(events_quality,
         pd.DataFrame: clensed events quality dataframe woth pathway addded.
     """
     #Map the pathways to the event locations
-    events_quality["Pathway"] = (events_quality["EventLocation"]
-                                 .map(locations_pathway_map))
+    events_quality["Pathway"] = map_strings(locations_pathway_map.get,
+                                            events_quality["EventLocation"])
     #Create a column of the event name and pathway
-    events_quality["Event (Pathway)"] = (events_quality["EventName"]
-                                       + " (" + events_quality["Pathway"] + ")")
-    events_quality = sort_events(events_quality)
+    events_quality["Event (Pathway)"] = map_strings(
+                                        lambda name, pathway: f"{name} ({pathway})",
+                                        events_quality["EventName"],
+                                        events_quality["Pathway"])
 
     return events_quality
@@ -1,5 +1,145 @@
+from functools import partial
+import hashlib
+import weakref
 from config import REMOVED, SPAWN
 import pandas as pd
+import numpy as np
+
+NANOSECONDS_IN_DAY = 24 * 60 * 60 * 10**9
+
+#The filter factories below return partials of module level functions rather
+#than closures, so the filters can be sent to scenario worker processes. Each
+#filter also has a mask function, which apply_filters uses to combine a list
+#of filters into one selection of the rows.
+
+#Quantile thresholds already worked out for a selection of rows, so scenarios
+#that filter the same rows by the same quantile only group them once.
+quantile_threshold_cache = {}
+#The lowest transition percentage of each visit of a transitions dataframe,
+#so excluding visits below any threshold is one comparison.
+visit_minimum_percentage_cache = {}
+
+
+def get_cached(cache, dataframe, key, compute):
+    """
+    Args:
+        cache (dict): cache of values worked out from dataframes.
+        dataframe (pd.DataFrame): dataframe the value is worked out from. It
+        mustn't be changed in place while it is cached.
+        key (tuple): what else the value is worked out from.
+        compute (Callable[[], Any]): function to work out the value.
+
+    Returns:
+        Any: the value, worked out once per dataframe and key. Entries hold a
+        weak reference to their dataframe and are removed when it is garbage
+        collected, so a new dataframe given the id of an old one never gets
+        the old one's values.
+    """
+    cache_key = (id(dataframe), *key)
+    entry = cache.get(cache_key)
+    if entry is not None and entry[0]() is dataframe:
+        return entry[1]
+    value = compute()
+    if len(cache) >= 16:
+        cache.clear()
+    cache[cache_key] = (weakref.ref(dataframe,
+                                    lambda _: cache.pop(cache_key, None)),
+                        value)
+    return value
+
+
+def select_all(dataframe):
+    """
+    Args:
+        dataframe (pd.DataFrame): dataframe to filter.
+
+    Returns:
+        np.ndarray: mask selecting every row.
+    """
+    return np.ones(len(dataframe), dtype=bool)
+
+
+def in_window(time_of_day, window):
+    """
+    Args:
+        time_of_day (np.ndarray): nanoseconds since midnight of each event.
+        window (tuple[int, int]): start and end of the window in nanoseconds
+        since midnight.
+
+    Returns:
+        np.ndarray: mask of the events within the window.
+    """
+    start, end = window
+    if start <= end:
+        return (time_of_day >= start) & (time_of_day <= end)
+    return (time_of_day >= start) | (time_of_day <= end)
+
+
+def time_of_day_mask(dataframe, selected, weekday_window, weekend_window):
+    """
+    Args:
+        dataframe (pd.DataFrame): Dataframe of events.
+        selected (np.ndarray): mask of the rows selected so far.
+        weekday_window (tuple[int, int]): start and end of the window on
+        weekdays in nanoseconds since midnight.
+        weekend_window (tuple[int, int]): start and end of the window on
+        Saturdays and Sundays in nanoseconds since midnight.
+
+    Returns:
+        np.ndarray: mask of the selected events within the window of the day.
+    """
+    #Work on the integer timestamps so the mask is a few array operations.
+    event_times = dataframe["EventTime"].to_numpy(dtype="datetime64[ns]")
+    nanoseconds = event_times.view(np.int64)
+    time_of_day = nanoseconds % NANOSECONDS_IN_DAY
+    mask = in_window(time_of_day, weekday_window)
+    if weekend_window != weekday_window:
+        #Days are counted from Thursday 1970-01-01, so days 2 and 3 of each
+        #week are the Saturday and Sunday.
+        day_of_week = (nanoseconds // NANOSECONDS_IN_DAY) % 7
+        weekend = (day_of_week == 2) | (day_of_week == 3)
+        mask = np.where(weekend, in_window(time_of_day, weekend_window), mask)
+    return selected & mask & ~np.isnat(event_times)
+
+
+def keep_events_within_time_of_day(dataframe, weekday_window, weekend_window):
+    """
+    Args:
+        dataframe (pd.DataFrame): Dataframe of events.
+        weekday_window (tuple[int, int]): start and end of the window on
+        weekdays in nanoseconds since midnight.
+        weekend_window (tuple[int, int]): start and end of the window on
+        Saturdays and Sundays in nanoseconds since midnight.
+
+    Returns:
+        pd.DataFrame: dataframe of only events within the window of the day.
+    """
+    result = dataframe.loc[time_of_day_mask(dataframe, select_all(dataframe),
+                                            weekday_window,
+                                            weekend_window)].copy()
+    return result
+
+
+def within_time_of_day(start_time, end_time, weekend_start_time=None,
+                       weekend_end_time=None):
+    """
+    Args:
+        start_time (str): start of the window of the day to keep events in
+        (e.g. "08:00:00").
+        end_time (str): end of the window, inclusive. If it is before
+        start_time the window runs over midnight.
+        weekend_start_time (Optional[str], optional): start of the window on
+        Saturdays and Sundays. Defaults to start_time.
+        weekend_end_time (Optional[str], optional): end of the window on
+        Saturdays and Sundays. Defaults to end_time.
+    """
+    weekday_window = (pd.Timedelta(start_time).value,
+                      pd.Timedelta(end_time).value)
+    weekend_window = (pd.Timedelta(weekend_start_time or start_time).value,
+                      pd.Timedelta(weekend_end_time or end_time).value)
+    return partial(keep_events_within_time_of_day,
+                   weekday_window=weekday_window,
+                   weekend_window=weekend_window)
 
 
 def only_daytime_events(dataframe):
@@ -10,12 +150,40 @@ def only_daytime_events(dataframe):
     Returns:
         pd.DataFrame: dataframe of only daytime events.
     """
-    eight_am_to_10_pm = dataframe.copy()
-    eight_am_to_10_pm.index = dataframe["EventTime"]
-    eight_am_to_10_pm = eight_am_to_10_pm.between_time("08:00:00", "20:00:00")
-    result = dataframe.loc[dataframe["EventTime"]
-                           .isin(eight_am_to_10_pm.index)].copy()
+    return within_time_of_day("08:00:00", "20:00:00")(dataframe)
+
 
+def diff_under_threshold_mask(dataframe, selected,
+                              max_diff_minutes_for_durations):
+    """
+    Args:
+        dataframe (pd.DataFrame): events dataframe
+        selected (np.ndarray): mask of the rows selected so far.
+        max_diff_minutes_for_durations (float): number of minutes to use to
+        filter out the periods between events.
+
+    Returns:
+        np.ndarray: mask of the selected events with differences under the
+        threshold.
+    """
+    return selected & (dataframe["diffMinutes"].to_numpy(dtype=float)
+                       < max_diff_minutes_for_durations)
+
+
+def remove_data_under_certain_hours(dataframe, max_diff_minutes_for_durations):
+    """
+    Args:
+        dataframe (pd.DataFrame): events dataframe
+        max_diff_minutes_for_durations (float): number of minutes to use to
+        filter out the periods between events.
+
+    Returns:
+        pd.DataFrame: events dataframe with differences between events
+        over the threshold removed.
+    """
+    result = dataframe.loc[diff_under_threshold_mask(
+                           dataframe, select_all(dataframe),
+                           max_diff_minutes_for_durations)].copy()
     return result
 
 
@@ -25,50 +193,102 @@ def within_threshold_diff(max_diff_minutes_for_durations):
         max_diff_minutes_for_durations (float): number of minutes to use to
         filter out the periods between events.
     """
-    def remove_data_under_certain_hours(dataframe):
-        """
-        Args:
-            dataframe (pd.DataFrame): events dataframe
+    return partial(remove_data_under_certain_hours,
+                   max_diff_minutes_for_durations=max_diff_minutes_for_durations)
+
 
+def get_quantile_thresholds(dataframe, selected,
+                            duration_processes_quantile_threshold):
+    """
+    Args:
+        dataframe (pd.DataFrame): processed events dataframe.
+        selected (np.ndarray): mask of the rows selected so far.
+        duration_processes_quantile_threshold (float): the quantiles/percentage
+        of process duration legth to keep.
+
+    Returns:
+        np.ndarray: the quantile of the selected durations of each row's
+        event, NaN for rows that aren't selected.
+    """
+    def compute_thresholds():
+        """
         Returns:
-            pd.DataFrame: events dataframe with differences between events
-            over the threshold removed.
+            np.ndarray: the quantile of the selected durations of each row's
+            event, worked out for every event in one grouped pass.
         """
-        result = dataframe.loc[dataframe["diffMinutes"]
-                               < max_diff_minutes_for_durations].copy()
-        return result
+        selected_rows = dataframe.loc[selected]
+        thresholds = np.full(len(dataframe), np.nan)
+        thresholds[selected] = (selected_rows.groupby("EventName", observed=True)
+                                ["diffMinutes"]
+                                .transform("quantile",
+                                           duration_processes_quantile_threshold)
+                                .to_numpy(dtype=float))
+        return thresholds
 
-    return remove_data_under_certain_hours
+    return get_cached(quantile_threshold_cache, dataframe,
+                      (hashlib.sha1(np.packbits(selected)).hexdigest(),
+                       duration_processes_quantile_threshold),
+                      compute_thresholds)
 
 
-def within_diff_quantile(duration_processes_quantile_threshold):
+def diff_under_quantile_mask(dataframe, selected,
+                             duration_processes_quantile_threshold):
     """
     Args:
+        dataframe (pd.DataFrame): processed events dataframe.
+        selected (np.ndarray): mask of the rows selected so far.
         duration_processes_quantile_threshold (float): the quantiles/percentage
         of process duration legth to keep.
+
+    Returns:
+        np.ndarray: mask of the selected events with durations under the
+        quantile of the selected durations of their event.
     """
-    def remove_data_under_quantile_for_each_event(dataframe):
-        """
-        Args:
-            dataframe (pd.DataFrame): processed events dataframe.
+    thresholds = get_quantile_thresholds(dataframe, selected,
+                                         duration_processes_quantile_threshold)
+    return selected & (dataframe["diffMinutes"].to_numpy(dtype=float)
+                       < thresholds)
 
-        Returns:
-            pd.DataFrame: processed events dataframe with extreme timings
-            removed.
-        """
 
-        end_data_frame = pd.DataFrame()
-        for event in dataframe["EventName"].unique():
-            event_data = dataframe.loc[dataframe["EventName"] == event].copy()
-            quantile_threshold = (event_data["diffMinutes"]
-                               .quantile(duration_processes_quantile_threshold))
-            result = event_data.loc[event_data["diffMinutes"]
-                                    < quantile_threshold].copy()
-            end_data_frame = pd.concat([end_data_frame, result])
+def remove_data_under_quantile_for_each_event(dataframe,
+                                        duration_processes_quantile_threshold):
+    """
+    Args:
+        dataframe (pd.DataFrame): processed events dataframe.
+        duration_processes_quantile_threshold (float): the quantiles/percentage
+        of process duration legth to keep.
+
+    Returns:
+        pd.DataFrame: processed events dataframe with extreme timings
+        removed, in the original row order.
+    """
+    result = dataframe.loc[diff_under_quantile_mask(
+                           dataframe, select_all(dataframe),
+                           duration_processes_quantile_threshold)].copy()
+    return result
 
-        return end_data_frame
 
-    return remove_data_under_quantile_for_each_event
+def within_diff_quantile(duration_processes_quantile_threshold):
+    """
+    Args:
+        duration_processes_quantile_threshold (float): the quantiles/percentage
+        of process duration legth to keep.
+    """
+    return partial(remove_data_under_quantile_for_each_event,
+                   duration_processes_quantile_threshold=
+                   duration_processes_quantile_threshold)
+
+
+def known_staff_mask(dataframe, selected):
+    """
+    Args:
+        dataframe (pd.DataFrame): dataframe with EventStaffId column.
+        selected (np.ndarray): mask of the rows selected so far.
+
+    Returns:
+        np.ndarray: mask of the selected rows without staff Id 1.
+    """
+    return selected & (dataframe["EventStaffId"] != 1).to_numpy()
 
 
 def exclude_unknown_staff(dataframe):
@@ -79,32 +299,197 @@ def exclude_unknown_staff(dataframe):
     Returns:
         pd.DataFrame: dataframe with staff Id 1 removed.
     """
-    result = dataframe.loc[dataframe["EventStaffId"] != 1].copy()
+    result = dataframe.loc[known_staff_mask(dataframe,
+                                            select_all(dataframe))].copy()
     return result
 
 
-def exclude_patients_with_uncommon_transitions_below_threshold(threshold):
+def get_visit_minimum_percentages(dataframe):
     """
     Args:
-        threshold (float): percentage threshold to filter out transitions.
+        dataframe (pd.DataFrame): clensed events dataframe with transition
+        percentages (see pathway_definitions.add_reset_transitions).
+
+    Returns:
+        visit_codes (np.ndarray): the visit of each row, as a position in
+        minimum_percentages.
+        minimum_percentages (np.ndarray): the lowest percentage of the
+        transitions of each visit, other than from spawn and removed events.
+        inf for visits without any.
     """
-    def exclude_uncommon_transitions(dataframe):
+    def compute_minimum_percentages():
+        """
+        Returns:
+            tuple[np.ndarray, np.ndarray]: the visit codes and minimum
+            percentages, worked out in one pass over the rows.
+        """
+        visit_codes, visit_ids = pd.factorize(dataframe["VisitId"])
+        #Rows without a visit id are grouped together, as isin matches them.
+        visit_codes[visit_codes < 0] = len(visit_ids)
+        counted = ((dataframe["EventName"] != SPAWN).to_numpy()
+                   & (dataframe["EventName"] != REMOVED).to_numpy()
+                   & dataframe["Next Event (Pathway)"].notnull().to_numpy())
+        minimum_percentages = np.full(len(visit_ids) + 1, np.inf)
+        np.fmin.at(minimum_percentages, visit_codes[counted],
+                   dataframe["Percentage"].to_numpy(dtype=float)[counted])
+        return visit_codes, minimum_percentages
+
+    return get_cached(visit_minimum_percentage_cache, dataframe, (),
+                      compute_minimum_percentages)
+
+
+def sweep_visit_exclusion_thresholds(dataframe, thresholds):
+    """
+    Args:
+        dataframe (pd.DataFrame): clensed events dataframe with transition
+        percentages.
+        thresholds (list[float]): percentage thresholds to exclude visits with
+        transitions below.
+
+    Returns:
+        pd.DataFrame: the number of visits, events and transitions kept by
+        exclude_uncommon_transitions at each threshold.
+    """
+    visit_codes, minimum_percentages = get_visit_minimum_percentages(dataframe)
+    has_next_event = dataframe["Next Event (Pathway)"].notnull().to_numpy()
+    events = np.bincount(visit_codes, minlength=len(minimum_percentages))
+    transitions = np.bincount(visit_codes, weights=has_next_event,
+                              minlength=len(minimum_percentages))
+    #Sort the visits by their lowest percentage, so the visits excluded at a
+    #threshold are the first ones, and sum each count along them.
+    order = np.argsort(minimum_percentages, kind="stable")
+    visits_excluded = np.searchsorted(minimum_percentages[order], thresholds,
+                                      side="left")
+
+    def kept(counts):
         """
         Args:
-            dataframe (pd.DataFrame): clensed events dataframe.
+            counts (np.ndarray): count of each visit.
 
         Returns:
-            pd.DataFrame: filtered dataframe with transfers below the threshold
-            removed.
+            np.ndarray: the total count of the visits kept at each threshold.
         """
-        indexes_to_exclude = dataframe.loc[(dataframe["EventName"] != SPAWN)
-                                           & (dataframe["EventName"] != REMOVED)
-                                           & (dataframe["Percentage"] < threshold)
-                                           & (dataframe["Next Event (Pathway)"]
-                                              .notnull())].copy()
-        visit_ids_to_exclude = indexes_to_exclude["VisitId"].unique()
-        result = dataframe.loc[~dataframe["VisitId"]
-                               .isin(visit_ids_to_exclude)].copy()
-        return result
-
-    return exclude_uncommon_transitions
+        excluded = np.concatenate([[0], np.cumsum(counts[order])])
+        return (excluded[-1] - excluded[visits_excluded]).astype(np.int64)
+
+    return pd.DataFrame({"Threshold": thresholds,
+                         "Visits Kept": kept(events > 0),
+                         "Events Kept": kept(events),
+                         "Transitions Kept": kept(transitions)})
+
+
+def common_transitions_mask(dataframe, selected, threshold):
+    """
+    Args:
+        dataframe (pd.DataFrame): clensed events dataframe.
+        selected (np.ndarray): mask of the rows selected so far.
+        threshold (float): percentage threshold to filter out transitions.
+
+    Returns:
+        np.ndarray: mask of the selected rows of visits without any selected
+        transitions below the threshold.
+    """
+    if selected.all():
+        visit_codes, minimum_percentages = get_visit_minimum_percentages(
+                                           dataframe)
+        return ~(minimum_percentages[visit_codes] < threshold)
+    uncommon = (selected
+                & (dataframe["EventName"] != SPAWN).to_numpy()
+                & (dataframe["EventName"] != REMOVED).to_numpy()
+                & (dataframe["Percentage"] < threshold).to_numpy()
+                & dataframe["Next Event (Pathway)"].notnull().to_numpy())
+    visit_ids_to_exclude = dataframe["VisitId"].to_numpy()[uncommon]
+    return selected & ~dataframe["VisitId"].isin(visit_ids_to_exclude).to_numpy()
+
+
+def exclude_uncommon_transitions(dataframe, threshold):
+    """
+    Args:
+        dataframe (pd.DataFrame): clensed events dataframe.
+        threshold (float): percentage threshold to filter out transitions.
+
+    Returns:
+        pd.DataFrame: filtered dataframe with transfers below the threshold
+        removed.
+    """
+    result = dataframe.loc[common_transitions_mask(dataframe,
+                                                   select_all(dataframe),
+                                                   threshold)].copy()
+    return result
+
+
+def exclude_patients_with_uncommon_transitions_below_threshold(threshold):
+    """
+    Args:
+        threshold (float): percentage threshold to filter out transitions.
+    """
+    return partial(exclude_uncommon_transitions, threshold=threshold)
+
+
+def only_daytime_events_mask(dataframe, selected):
+    """
+    Args:
+        dataframe (pd.DataFrame): Dataframe of events.
+        selected (np.ndarray): mask of the rows selected so far.
+
+    Returns:
+        np.ndarray: mask of the selected daytime events.
+    """
+    return time_of_day_mask(dataframe, selected,
+                            **within_time_of_day("08:00:00", "20:00:00").keywords)
+
+
+#Mask function of each filter function. Partials of the filters pass their
+#keyword arguments on to the mask function.
+FILTER_MASKS = {keep_events_within_time_of_day: time_of_day_mask,
+                only_daytime_events: only_daytime_events_mask,
+                remove_data_under_certain_hours: diff_under_threshold_mask,
+                remove_data_under_quantile_for_each_event:
+                diff_under_quantile_mask,
+                exclude_unknown_staff: known_staff_mask,
+                exclude_uncommon_transitions: common_transitions_mask}
+
+
+def get_filter_mask(filter):
+    """
+    Args:
+        filter (Callable): filter function, or a partial of one.
+
+    Returns:
+        Optional[Callable]: the filter's mask function, called as
+        mask_function(dataframe, selected), or None if it is any other
+        function.
+    """
+    if isinstance(filter, partial):
+        if filter.args or filter.func not in FILTER_MASKS:
+            return None
+        return partial(FILTER_MASKS[filter.func], **filter.keywords)
+    return FILTER_MASKS.get(filter)
+
+
+def apply_filters(dataframe, filters):
+    """
+    Args:
+        dataframe (pd.DataFrame): dataframe to filter.
+        filters (Optional[list[Callable]]): filters to apply in order. Filters
+        made by the factories in this module are combined as masks, and only
+        the rows selected by all of them are copied. Any other function is
+        applied to the rows selected so far.
+
+    Returns:
+        pd.DataFrame: the filtered dataframe, the same as applying each filter
+        in turn. The dataframe itself if there are no filters.
+    """
+    if not filters:
+        return dataframe
+    selected = select_all(dataframe)
+    for filter in filters:
+        mask_function = get_filter_mask(filter)
+        if mask_function is not None:
+            selected = mask_function(dataframe, selected)
+        else:
+            if not selected.all():
+                dataframe = dataframe.loc[selected].copy()
+            dataframe = filter(dataframe)
+            selected = select_all(dataframe)
+    return dataframe.loc[selected].copy()
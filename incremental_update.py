@@ -0,0 +1,243 @@
+from pathlib import Path
+import json
+import os
+import pandas as pd
+from utils import sort_events
+from vocabulary import update_encoding
+from profiling import profiled
+from main_data_cleaning_function import cleanse_and_transform_data
+import data_cleaning_and_transformation as cleaning
+import pathway_definitions as pathways
+
+STATE_FILES = {"events": "Clensed Events.pkl",
+               "fingerprints": "Visit Fingerprints.pkl",
+               "event_pairs": "Transition Counts.pkl",
+               "events_totals": "Transition Totals.pkl"}
+SETTINGS_FILE = "Settings.json"
+
+
+def get_visit_fingerprints(data, visit_column):
+    """
+    Args:
+        data (Optional[pd.DataFrame]): raw data with a visit id column.
+        visit_column (str): column name of the visit ids.
+
+    Returns:
+        Optional[pd.Series]: a hash of all of the rows of each visit, indexed
+        by visit id. The hash doesn't depend on the order of the rows.
+    """
+    if data is None:
+        return None
+    row_hashes = pd.util.hash_pandas_object(data, index=False)
+    return row_hashes.groupby(data[visit_column].to_numpy()).sum()
+
+
+def update_transition_counts(stored_counts, stale_counts, fresh_counts, keys,
+                             column):
+    """
+    Args:
+        stored_counts (Optional[pd.DataFrame]): counts from the last run.
+        stale_counts (pd.DataFrame): counts from the visits being replaced.
+        fresh_counts (pd.DataFrame): counts from the newly clensed visits.
+        keys (list[str]): columns the counts are grouped by.
+        column (str): column name of the counts.
+
+    Returns:
+        pd.DataFrame: the stored counts with the stale visits taken off and the
+        fresh visits added on.
+    """
+    counts = [fresh_counts]
+    if stored_counts is not None:
+        counts += [stored_counts,
+                   stale_counts.assign(**{column: -stale_counts[column]})]
+    counts = (pd.concat([update_encoding(i[keys + [column]]) for i in counts])
+              .groupby(keys, as_index=False, observed=True)[column].sum())
+    return counts.loc[counts[column] > 0].reset_index(drop=True)
+
+
+def load_state(state_path, settings):
+    """
+    Args:
+        state_path (Path): folder of the stored state.
+        settings (str): the clensing settings of this run.
+
+    Returns:
+        Optional[dict[str, pd.DataFrame | pd.Series]]: the stored state, or
+        None if there isn't one or it was made with different settings.
+    """
+    settings_file = state_path / SETTINGS_FILE
+    if not settings_file.exists():
+        return None
+    with open(settings_file, encoding="utf-8") as f:
+        if f.read() != settings:
+            return None
+    return {name: pd.read_pickle(state_path / file)
+            for name, file in STATE_FILES.items()}
+
+
+def save_state(state_path, settings, state):
+    """
+    Args:
+        state_path (Path): folder to store the state in.
+        settings (str): the clensing settings of this run.
+        state (dict[str, pd.DataFrame | pd.Series]): the state to store.
+    """
+    state_path.mkdir(exist_ok=True, parents=True)
+    #Remove the settings first so a run that fails part way through writing
+    #the state causes a full rebuild next time.
+    (state_path / SETTINGS_FILE).unlink(missing_ok=True)
+    for name, file in STATE_FILES.items():
+        state[name].to_pickle(state_path / f"{file}.tmp")
+        os.replace(state_path / f"{file}.tmp", state_path / file)
+    with open(state_path / SETTINGS_FILE, "w", encoding="utf-8") as f:
+        f.write(settings)
+
+
+@profiled
+def update_clensed_events_and_transitions(state_path, events_raw,
+                               adm_status_raw, obs_quality, diagnostics_quality,
+                               repeat_time_threshold, remove_duplicate_staffid,
+                               remove_duplicate_location, excluded_event_names,
+                               locations_to_drop, natural_order_for_processes,
+                               include_spawn_end_events, locations_pathway_map,
+                               keep_last_location):
+    """
+    Incremental version of drop_duplicates_and_anomaly_times_events_data,
+    cleanse_and_transform_data and add_reset_transitions. The clensed events
+    and transition counts of the last run are kept in state_path along with a
+    fingerprint of each visit's raw data. Only visits that are new or whose
+    raw data has changed are clensed again, and the transition counts are
+    updated by the difference. Changing any of the clensing settings causes
+    a full rebuild.
+
+    Args:
+        state_path (Path): folder to keep the state between runs in.
+        events_raw (pd.DataFrame): raw events data frame.
+        adm_status_raw (Optional[pd.DataFrame]): raw admission status data frame.
+        obs_quality (Optional[pd.DataFrame]): clensed obs dataframe.
+        diagnostics_quality (Optional[pd.DataFrame]): clensed diagnostics
+        dataframe.
+        repeat_time_threshold (int): the number of minutes that should be used
+        to filter out repeated events.
+        remove_duplicate_staffid (bool): Flag to consider if duplicate events
+        should be removed if done by the same staff member.
+        remove_duplicate_location (bool): Flag to consider if duplicate events
+        should be removed if done in the same location.
+        excluded_event_names (list[str]): list of event names to exclude.
+        locations_to_drop (list[str]): list of locations to exclude
+        natural_order_for_processes (dict[str, int]): dictionary of order of
+        processes.
+        include_spawn_end_events (bool): flag to include or exclude spawn end
+        events.
+        locations_pathway_map (dict[str, str]): dictionary to map locations to
+        their pathway.
+        keep_last_location (bool): flag to include last location.
+
+    Returns:
+        events_quality (pd.DataFrame): a clensed events dataframe after
+        applying all of the clensing steps.
+        transitions (pd.DataFrame): clensed events dataframe with the count and
+        perctage of each transition.
+    """
+    state_path = Path(state_path)
+    settings = json.dumps({"repeat_time_threshold": repeat_time_threshold,
+                           "remove_duplicate_staffid": remove_duplicate_staffid,
+                           "remove_duplicate_location": remove_duplicate_location,
+                           "excluded_event_names": excluded_event_names,
+                           "locations_to_drop": locations_to_drop,
+                           "natural_order_for_processes": natural_order_for_processes,
+                           "include_spawn_end_events": include_spawn_end_events,
+                           "locations_pathway_map": locations_pathway_map,
+                           "keep_last_location": keep_last_location,
+                           "include_admission_data": adm_status_raw is not None,
+                           "include_obs_data": obs_quality is not None,
+                           "include_diag_data": diagnostics_quality is not None},
+                          sort_keys=True, default=str)
+    state = load_state(state_path, settings)
+
+    #Fingerprint every visit across all of the data that feeds into it.
+    fingerprints = [get_visit_fingerprints(events_raw, "VisitId"),
+                    get_visit_fingerprints(adm_status_raw, "AttendanceID"),
+                    get_visit_fingerprints(obs_quality, "VisitId"),
+                    get_visit_fingerprints(diagnostics_quality, "VisitId")]
+    fingerprints = (pd.concat([i for i in fingerprints if i is not None])
+                    .groupby(level=0).sum())
+
+    #Find the visits that are unchanged since the last run. Everything else
+    #in the store is stale, and everything else in the raw data needs
+    #clensing.
+    if state is None:
+        unchanged = fingerprints.index[:0]
+        stored_events = None
+    else:
+        common = fingerprints.index.intersection(state["fingerprints"].index)
+        unchanged = common[fingerprints[common].to_numpy()
+                           == state["fingerprints"][common].to_numpy()]
+        stale_mask = ~state["events"]["VisitId"].isin(unchanged)
+        stale_events = state["events"].loc[stale_mask]
+        stored_events = state["events"].loc[~stale_mask]
+    changed = fingerprints.index.difference(unchanged)
+
+    #Clense only the new and changed visits.
+    def rows_for_visits(data, visit_column):
+        """
+        Args:
+            data (Optional[pd.DataFrame]): data to filter.
+            visit_column (str): column name of the visit ids in data.
+
+        Returns:
+            Optional[pd.DataFrame]: data for only the changed visits.
+        """
+        if data is None:
+            return None
+        return data.loc[data[visit_column].isin(changed)]
+
+    if len(changed) == 0:
+        events_quality = stored_events.iloc[:0].drop(
+                         columns=["Next Event (Pathway)"])
+    else:
+        events_quality = cleaning.drop_duplicates_and_anomaly_times_events_data(
+                         rows_for_visits(events_raw, "VisitId"),
+                         repeat_time_threshold, remove_duplicate_staffid,
+                         remove_duplicate_location)
+        events_quality = cleanse_and_transform_data(events_quality,
+                         rows_for_visits(adm_status_raw, "AttendanceID"),
+                         rows_for_visits(obs_quality, "VisitId"),
+                         rows_for_visits(diagnostics_quality, "VisitId"),
+                         excluded_event_names, locations_to_drop,
+                         natural_order_for_processes, include_spawn_end_events,
+                         locations_pathway_map, keep_last_location)
+    fresh_events = pathways.add_next_events(events_quality)
+
+    #Update the transition counts by the difference between the stale and
+    #fresh visits, then merge the fresh visits into the store.
+    fresh_event_pairs, fresh_events_totals = pathways.count_transitions(
+                                             fresh_events)
+    if state is None:
+        event_pairs = update_transition_counts(None, None, fresh_event_pairs,
+                      ["Event (Pathway)", "Next Event (Pathway)"], "Count")
+        events_totals = update_transition_counts(None, None,
+                        fresh_events_totals, ["Event (Pathway)"], "Total")
+        events_with_next = fresh_events
+    else:
+        stale_event_pairs, stale_events_totals = pathways.count_transitions(
+                                                 stale_events)
+        event_pairs = update_transition_counts(state["event_pairs"],
+                      stale_event_pairs, fresh_event_pairs,
+                      ["Event (Pathway)", "Next Event (Pathway)"], "Count")
+        events_totals = update_transition_counts(state["events_totals"],
+                        stale_events_totals, fresh_events_totals,
+                        ["Event (Pathway)"], "Total")
+        #The vocabulary may have grown since the state was stored.
+        events_with_next = sort_events(pd.concat([update_encoding(stored_events),
+                                                  update_encoding(fresh_events)]))
+
+    save_state(state_path, settings, {"events": events_with_next,
+                                      "fingerprints": fingerprints,
+                                      "event_pairs": event_pairs,
+                                      "events_totals": events_totals})
+
+    transitions = pathways.merge_transition_counts(events_with_next, event_pairs,
+                                                   events_totals)
+    events_quality = events_with_next.drop(columns=["Next Event (Pathway)"])
+    return events_quality, transitions
@@ -1,14 +1,23 @@
+from functools import partial
 from pathlib import Path
 from utils import load_data
+from vocabulary import encode_columns, save_vocabulary
 from event_filtering_functions import (
     exclude_patients_with_uncommon_transitions_below_threshold,
+    sweep_visit_exclusion_thresholds,
     within_diff_quantile,
     within_threshold_diff,
-    only_daytime_events)
-from main_data_cleaning_function import cleanse_and_transform_data
+    within_time_of_day)
+from main_data_cleaning_function import (cleanse_and_transform_data_in_shards,
+                                         cleanse_and_transform_data_in_partitions)
 import data_cleaning_and_transformation as cleaning
 import pathway_definitions as pathways
+from incremental_update import update_clensed_events_and_transitions
 import process_durations as durations
+from scenario_runner import run_scenarios
+from rendering import render_figures
+from profiling import enable_profiling, write_profile
+from outputs import start_background_writes, flush_writes
 import config
 import pandas as pd
 
@@ -16,112 +25,233 @@ if __name__ == "__main__":
 
     output_path = Path(r"./Outputs")
     path_to_read_data = Path(r"./Events Data")
+    # Time each step of the run and save the profile to the outputs.
+    enable_profiling(config.profile_pipeline)
+    # Write outputs in the background so the pipeline isn't held up on disk.
+    start_background_writes(config.number_of_writer_threads,
+                            config.max_pending_write_mb)
     # ---------------------- Read in and clense raw data
-    # ---------------------- Events data
-    events_raw = load_data("FN_Events.csv")
-    events_quality = cleaning.drop_duplicates_and_anomaly_times_events_data(
-        events_raw, config.repeat_time_threshold,
-        config.remove_duplicate_staffid, config.remove_duplicate_location)
-
     # ---------------------- Diagnostics data
     if config.include_diag_data:
-        diagnostics_raw = load_data("FN_Diagnostics.csv")
+        diagnostics_raw = load_data("FN_Diagnostics.csv", ["Request DateTime"],
+                                    config.cache_raw_data,
+                                    config.hash_raw_data_for_cache)
         diagnostics_quality = cleaning.rename_columns_and_collapse_data_diagnostics(
             pd.Timedelta("5m"), diagnostics_raw)
+        if config.use_categorical_vocabulary:
+            diagnostics_quality = encode_columns(diagnostics_quality)
     else:
         diagnostics_quality = None
 
     # ---------------------- Obs data
     obs_quality = None
     if config.include_obs_data:
-        obs_raw = load_data("FN_Obs.csv")
+        obs_raw = load_data("FN_Obs.csv", ["ChartDateTime"],
+                            config.cache_raw_data, config.hash_raw_data_for_cache)
         if obs_raw is not None:
             obs_quality = cleaning.rename_columns_and_change_events_to_obs(obs_raw)
+            if config.use_categorical_vocabulary:
+                obs_quality = encode_columns(obs_quality)
 
     # --------------------- Admission data
     adm_status_raw = None
     if config.include_admission_data:
-        adm_status_raw = load_data("FN_AdmissionStatus.csv")
-
-    # ---------------------- Clense data
-    events_quality = cleanse_and_transform_data(events_quality, adm_status_raw,
-                                                obs_quality, diagnostics_quality,
-                                                config.excluded_event_names,
-                                                config.locations_to_drop,
-                                                config.natural_order_for_processes,
-                                                config.include_spawn_end_events,
-                                                config.locations_pathway_map,
-                                                config.keep_last_location)
+        adm_status_raw = load_data("FN_AdmissionStatus.csv", None,
+                                   config.cache_raw_data,
+                                   config.hash_raw_data_for_cache)
+        if config.use_categorical_vocabulary:
+            adm_status_raw = encode_columns(adm_status_raw, ["Adm"])
+
+    # ---------------------- Events data and clense data
+    if config.incremental_update:
+        # Only clense visits that are new or changed since the last run, and
+        # update the transition counts from the stored ones.
+        events_raw = load_data("FN_Events.csv", ["EventTime"],
+                               config.cache_raw_data,
+                               config.hash_raw_data_for_cache)
+        if config.use_categorical_vocabulary:
+            events_raw = encode_columns(events_raw)
+        events_quality, transitions = update_clensed_events_and_transitions(
+            output_path / "State", events_raw, adm_status_raw, obs_quality,
+            diagnostics_quality, config.repeat_time_threshold,
+            config.remove_duplicate_staffid, config.remove_duplicate_location,
+            config.excluded_event_names, config.locations_to_drop,
+            config.natural_order_for_processes,
+            config.include_spawn_end_events, config.locations_pathway_map,
+            config.keep_last_location)
+    elif config.stream_events_data:
+        # Read, deduplicate and clense the events file one partition of
+        # visits at a time.
+        events_quality = cleanse_and_transform_data_in_partitions(
+            "FN_Events.csv", config.number_of_visit_partitions,
+            config.events_read_chunksize, config.repeat_time_threshold,
+            config.remove_duplicate_staffid, config.remove_duplicate_location,
+            adm_status_raw, obs_quality, diagnostics_quality,
+            config.excluded_event_names, config.locations_to_drop,
+            config.natural_order_for_processes,
+            config.include_spawn_end_events, config.locations_pathway_map,
+            config.keep_last_location, config.use_categorical_vocabulary,
+            config.partition_path)
+    else:
+        events_raw = load_data("FN_Events.csv", ["EventTime"],
+                               config.cache_raw_data,
+                               config.hash_raw_data_for_cache)
+        if config.use_categorical_vocabulary:
+            events_raw = encode_columns(events_raw)
+        events_quality = cleaning.drop_duplicates_and_anomaly_times_events_data(
+            events_raw, config.repeat_time_threshold,
+            config.remove_duplicate_staffid, config.remove_duplicate_location)
+
+        # Clense the visits across a pool of workers.
+        events_quality = cleanse_and_transform_data_in_shards(
+            events_quality, adm_status_raw, obs_quality, diagnostics_quality,
+            config.excluded_event_names, config.locations_to_drop,
+            config.natural_order_for_processes,
+            config.include_spawn_end_events, config.locations_pathway_map,
+            config.keep_last_location, config.number_of_cleansing_workers)
 
     # ---------------------- Calculate the number of patients making each
     #                        transition.
-    transitions = pathways.add_reset_transitions(events_quality)
+    if not config.incremental_update:
+        transitions = pathways.add_reset_transitions(events_quality)
 
-    # ----------------------- Definition Pathways generation for all data
-    # Define the directory_path name for outputs
-    analysis_name = "Split by Pathway - All"
-    filepath = output_path / "Pathways" / analysis_name
 
-    pathways.generate_and_output_dfg_and_pathway_definition(analysis_name,
-             transitions, filepath, config.include_spawn_end_events,
-             config.obs_splits, config.export_event_log_csv,
-             config.export_log_to_csv_after_using_log_converter,
-             config.location_capacity_data, config.process_location_data,
-             config.event_names_based_process_requirements,
-             config.pathways_wait_in_place, "EventName", "Pathway")
+    # ----------------------- Scenarios
+    # Every scenario writes to its own folder, so they are run across a pool
+    # of worker processes. The transitions and durations data are sent to
+    # each worker once.
+    def pathway_scenario(analysis_name, filterFuncs=None,
+                         post_processing_functions_of_pathway_definitions=None):
+        """
+        Args:
+            analysis_name (str): name of the scenario and its output folder.
+            filterFuncs (list, optional): filter functions to apply to the
+            events. Defaults to None.
+            post_processing_functions_of_pathway_definitions (optional):
+            function to post process the pathway definitions. Defaults to None.
+
+        Returns:
+            tuple[str, partial, str]: the scenario to pass to run_scenarios.
+        """
+        return (analysis_name,
+                partial(pathways.generate_and_output_dfg_and_pathway_definition,
+                        analysis_name,
+                        filepath=output_path / "Pathways" / analysis_name,
+                        include_spawn_end_events=config.include_spawn_end_events,
+                        obs_splits=config.obs_splits,
+                        export_event_log_csv=config.export_event_log_csv,
+                        export_log_to_csv_after_using_log_converter=
+                        config.export_log_to_csv_after_using_log_converter,
+                        location_capacity_data=config.location_capacity_data,
+                        process_location_data=config.process_location_data,
+                        event_names_based_process_requirements=
+                        config.event_names_based_process_requirements,
+                        pathways_wait_in_place=config.pathways_wait_in_place,
+                        process_column="EventName", split_column="Pathway",
+                        filterFuncs=filterFuncs,
+                        post_processing_functions_of_pathway_definitions=
+                        post_processing_functions_of_pathway_definitions,
+                        output_format=config.output_format,
+                        output_partition_column=config.output_partition_column,
+                        number_of_csv_writer_workers=
+                        config.number_of_csv_writer_workers),
+                "events_data")
+
+    def durations_scenario(analysis_name, filterFuncs):
+        """
+        Args:
+            analysis_name (str): name of the scenario and its output folder.
+            filterFuncs (list): filter functions to apply to the durations.
+
+        Returns:
+            tuple[str, partial, str]: the scenario to pass to run_scenarios.
+        """
+        return (analysis_name,
+                partial(durations.generate_and_output_histogram_and_process_durations,
+                        analysis_name, groupby_column="Event (Pathway)",
+                        output_path=output_path, plots=config.plots,
+                        filterFuncs=filterFuncs),
+                "processed_events")
+
+    # ----------------------- Definition Pathways generation for all data, and
+    #                         with transitions under a certain threshold
+    #                         removed, and the transitions kept at a sweep of
+    #                         thresholds. These all use the same events data, so
+    #                         they are run in the same worker to share the
+    #                         events data, dfgs and recurrence outputs.
+    scenarios = [pathway_scenario("Split by Pathway - All")]
+    for threshold in range(1, 4):
+        scenarios.append(pathway_scenario(
+            f"Removed transitions below {threshold}%", [],
+            pathways.remove_transitions_below_percentage_in_pathway_definitions(threshold)))
+    scenarios.append(("Pathway Pruning Sweep",
+                      partial(pathways.generate_and_output_pathway_pruning_sweep,
+                              filepath=output_path / "Pathways" / "Pathway Pruning Sweep",
+                              include_spawn_end_events=config.include_spawn_end_events,
+                              obs_splits=config.obs_splits,
+                              thresholds=config.pathway_pruning_sweep_thresholds,
+                              export_pruned_pathway_definitions=
+                              config.export_pruned_pathway_definitions),
+                      "events_data"))
+    scenarios = [("Split by Pathway - All and Removed transitions",
+                  [function for _, function, _ in scenarios], "events_data")]
 
     # ------------------------ Definition pathways generation with exclusion
     #                          under a certain threshold
-
     for threshold in range(2, 4):
-        analysis_name = f"Visits Exclusion {threshold}%"
-        filepath = output_path / "Pathways" / analysis_name
-
-        pathways.generate_and_output_dfg_and_pathway_definition(analysis_name,
-                 transitions, filepath, config.include_spawn_end_events,
-                 config.obs_splits, config.export_event_log_csv,
-                 config.export_log_to_csv_after_using_log_converter,
-                 config.location_capacity_data, config.process_location_data,
-                 config.event_names_based_process_requirements,
-                 config.pathways_wait_in_place, "EventName", "Pathway",
-                 [exclude_patients_with_uncommon_transitions_below_threshold(threshold)])
+        scenarios.append(pathway_scenario(
+            f"Visits Exclusion {threshold}%",
+            [exclude_patients_with_uncommon_transitions_below_threshold(threshold)]))
+    # Visits, events and transitions kept at a sweep of exclusion thresholds,
+    # from the lowest transition percentage of each visit worked out once.
+    (output_path / "Pathways").mkdir(exist_ok=True, parents=True)
+    sweep_visit_exclusion_thresholds(
+        transitions, config.visit_exclusion_sweep_thresholds).to_csv(
+        output_path / "Pathways" / "Visits Exclusion Sweep.csv", index=False)
 
-    for threshold in range(1, 4):
-        directory_path = f"Removed transitions below {threshold}%"
-        filepath = output_path / "Pathways" / directory_path
+    # ------------------------------------- Process Durations
+    event_diffs = durations.add_difference_in_minutes_to_durations(
+        events_quality, config.number_of_duration_workers)
 
-        pathways.generate_and_output_dfg_and_pathway_definition(directory_path,
-                 transitions, filepath, config.include_spawn_end_events,
-                 config.obs_splits, config.export_event_log_csv,
-                 config.export_log_to_csv_after_using_log_converter,
-                 config.location_capacity_data, config.process_location_data,
-                 config.event_names_based_process_requirements,
-                 config.pathways_wait_in_place, "EventName", "Pathway",
-                 [],
-                 pathways.remove_transitions_below_percentage_in_pathway_definitions(threshold))   
+    daytime_events = within_time_of_day(config.daytime_start_time,
+                                        config.daytime_end_time,
+                                        config.weekend_daytime_start_time,
+                                        config.weekend_daytime_end_time)
 
+    scenarios.append(durations_scenario(
+        "Max threshold 2 hours and including 100 percentile",
+        [within_threshold_diff(120)]))
 
-    # ------------------------------------- Process Durations
-    event_diffs = durations.add_difference_in_minutes_to_durations(events_quality)
+    scenarios.append(durations_scenario(
+        "Max threshold 14 hours, and 97 percentile",
+        [within_threshold_diff(840), within_diff_quantile(0.97)]))
+
+    scenarios.append(durations_scenario(
+        "Max threshold 14 hours, 97 perc, between 8am and 10pm",
+        [within_threshold_diff(840), within_diff_quantile(0.97),
+         daytime_events]))
+
+    scenarios.append(durations_scenario(
+        "Max threshold 2 hours, 100 perc, between 8am and 10pm",
+        [within_threshold_diff(120), daytime_events]))
 
-    analysis_name = "Max threshold 2 hours and including 100 percentile"
-    durations.generate_and_output_histogram_and_process_durations(analysis_name,
-              event_diffs, "Event (Pathway)", output_path, config.plots,
-              [within_threshold_diff(120)])
+    _, figures = run_scenarios(scenarios, {"events_data": transitions,
+                                           "processed_events": event_diffs},
+                               config.number_of_scenario_workers,
+                               output_path / "Scenario Timings.csv")
 
-    analysis_name = "Max threshold 14 hours, and 97 percentile"
-    durations.generate_and_output_histogram_and_process_durations(analysis_name,
-              event_diffs, "Event (Pathway)", output_path, config.plots,
-              [within_threshold_diff(840), within_diff_quantile(0.97)])
+    # ------------------------------------- Render the figures
+    # Render every scenario's figures together across a pool of workers,
+    # skipping any already rendered from the same inputs.
+    render_figures(figures, config.number_of_render_workers,
+                   output_path / "Render Manifest.json")
 
-    analysis_name = "Max threshold 14 hours, 97 perc, between 8am and 10pm"
-    durations.generate_and_output_histogram_and_process_durations(analysis_name,
-              event_diffs, "Event (Pathway)", output_path, config.plots,
-              [within_threshold_diff(840), within_diff_quantile(0.97),
-               only_daytime_events])
+    # Wait for the last outputs, reporting any that failed to write.
+    flush_writes()
 
-    analysis_name = "Max threshold 2 hours, 100 perc, between 8am and 10pm"
-    durations.generate_and_output_histogram_and_process_durations(analysis_name,
-              event_diffs, "Event (Pathway)", output_path, config.plots,
-              [within_threshold_diff(120), only_daytime_events])
+    # Keep the vocabulary so the encoded columns have the same codes next run.
+    if config.use_categorical_vocabulary:
+        save_vocabulary()
 
+    if config.profile_pipeline:
+        write_profile(output_path / "Profile")
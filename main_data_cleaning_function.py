@@ -1,9 +1,18 @@
-from utils import sort_events
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from pathlib import Path
+import os
+from utils import (sort_events, insert_events_in_order,
+                   partition_data_by_visit, parse_datetime_columns)
+from vocabulary import encode_columns, update_encoding
+from profiling import profiled
 from config import event_names_to_exclude_for_repetition
 import data_cleaning_and_transformation as cleaning
-#import pandas as pd
+import numpy as np
+import pandas as pd
 
 
+@profiled
 def cleanse_and_transform_data(events_quality, adm_status_raw, obs_quality,
                                diagnostics_quality, excluded_event_names,
                                locations_to_drop, natural_order_for_processes,
@@ -31,36 +40,61 @@ def cleanse_and_transform_data(events_quality, adm_status_raw, obs_quality,
         clensing steps.
     """
 
+    #Move any encoded columns onto the same vocabulary so they can be merged.
+    events_quality, adm_status_raw, obs_quality, diagnostics_quality = [
+        None if data is None else update_encoding(data)
+        for data in (events_quality, adm_status_raw, obs_quality,
+                     diagnostics_quality)]
+
+    #Sort the events once. Every step after this keeps the events in order,
+    #and any events added are inserted in place.
+    events_quality = cleaning.mapping_of_natural_order(events_quality,
+                                                    natural_order_for_processes)
+
+    events_quality = sort_events(events_quality)
+
     events_quality = cleaning.remove_repeats_of_events_that_should_not_be_repeated(
                      events_quality, event_names_to_exclude_for_repetition)
     
     events_quality = cleaning.remove_events_after_discharged(events_quality)
 
+    #Locations are forward filled with events in the same minute in name
+    #order, before any are renamed, rather than in natural order.
+    fill_order = cleaning.get_location_fill_order(events_quality)
+
     if adm_status_raw is not None:
         events_quality = cleaning.augmenting_admittance_data(adm_status_raw,
                                                              events_quality)
 
+    #The obs and diagnostics data are added to the end, so they take the last
+    #location of the patient when locations are forward filled. Move them into
+    #place afterwards.
+    number_of_sorted_events = len(events_quality)
+
     events_quality = cleaning.merge_data(events_quality, diagnostics_quality,
                                          obs_quality)
 
     events_quality = cleaning.set_location_for_ambulance_arrival(events_quality)
 
-    events_quality = cleaning.forward_fill_on_locations(events_quality)
-
-    events_quality = cleaning.remove_excluded_events_and_locations(
-                     events_quality, excluded_event_names, locations_to_drop)
+    events_quality = cleaning.forward_fill_on_locations(
+                     events_quality, np.concatenate([fill_order, np.arange(
+                     number_of_sorted_events, len(events_quality))]))
 
     events_quality = cleaning.mapping_of_natural_order(events_quality,
                                                     natural_order_for_processes)
 
-    events_quality = sort_events(events_quality)
+    events_quality = insert_events_in_order(
+                     events_quality.iloc[:number_of_sorted_events],
+                     events_quality.iloc[number_of_sorted_events:])
 
-    events_quality = cleaning.add_walk_in_for_non_ambulance_arrivals(events_quality)
+    events_quality = cleaning.remove_excluded_events_and_locations(
+                     events_quality, excluded_event_names, locations_to_drop)
 
-    events_quality = cleaning.add_wait_for_beds_for_admitted_patients(events_quality)
+    events_quality = cleaning.add_walk_in_for_non_ambulance_arrivals(
+                     events_quality, natural_order_for_processes)
 
-    events_quality = cleaning.mapping_of_natural_order(events_quality,
-                                                       natural_order_for_processes)
+    events_quality = cleaning.add_wait_for_beds_for_admitted_patients(
+                     events_quality, natural_order_for_processes)
 
     if include_spawn_end_events:
         events_quality = cleaning.add_spawn_end_events(events_quality,
@@ -74,3 +108,203 @@ def cleanse_and_transform_data(events_quality, adm_status_raw, obs_quality,
                     events_quality, locations_pathway_map))
 
     return events_quality
+
+
+def get_visit_shards(visit_ids, number_of_shards):
+    """
+    Args:
+        visit_ids (pd.Series): visit id of each row.
+        number_of_shards (int): number of shards to split the visits into.
+
+    Returns:
+        np.ndarray: shard of each row. Rows of the same visit are always in
+        the same shard, in every dataframe.
+    """
+    #The same id hashes differently as an int and a float, and a missing id
+    #makes an integer column float, so numeric ids are all hashed as floats.
+    if pd.api.types.is_numeric_dtype(visit_ids.dtype):
+        visit_ids = visit_ids.astype("float64")
+    return (pd.util.hash_array(visit_ids.to_numpy())
+            % np.uint64(number_of_shards)).astype(np.intp)
+
+
+def cleanse_and_transform_shard(shard, cleansing_arguments):
+    """
+    Args:
+        shard (tuple[Optional[pd.DataFrame], ...]): the events, admission
+        status, obs and diagnostics data of the shard's visits.
+        cleansing_arguments (tuple): the rest of the arguments of
+        cleanse_and_transform_data.
+
+    Returns:
+        pd.DataFrame: the clensed events of the shard.
+    """
+    return cleanse_and_transform_data(*shard, *cleansing_arguments)
+
+
+@profiled
+def cleanse_and_transform_data_in_shards(events_quality, adm_status_raw,
+                               obs_quality, diagnostics_quality,
+                               excluded_event_names, locations_to_drop,
+                               natural_order_for_processes,
+                               include_spawn_end_events, locations_pathway_map,
+                               keep_last_location, number_of_workers):
+    """
+    Parallel version of cleanse_and_transform_data. The visits are split into
+    one shard per worker by a hash of their VisitId, and each shard is clensed
+    in its own process. Every step works within a visit and keeps the events
+    of each visit in the same order, so once the shards are sorted back
+    together the events are the same, in the same order, as clensing them all
+    at once.
+
+    Args:
+        events_quality (pd.DataFrame): clensed events data frame.
+        adm_status_raw (Optional[pd.DataFrame]): raw admission status data frame.
+        obs_quality (Optional[pd.DataFrame]): clensed obs dataframe.
+        diagnostics_quality (Optional[pd.DataFrame]): clensed diagnostics
+        dataframe.
+        excluded_event_names (list[str]): list of event names to exclude.
+        locations_to_drop (list[str]): list of locations to exclude
+        natural_order_for_processes (dict[str, int]): dictionary of order of
+        processes.
+        include_spawn_end_events (bool): flag to include or exclude spawn end
+        events.
+        locations_pathway_map (dict[str, str]): dictionary to map locations to
+        their pathway.
+        keep_last_location (bool): flag to include last location.
+        number_of_workers (int): number of processes to clense the shards
+        across, up to the number of CPUs. 1 or less clenses all of the events
+        in this process.
+
+    Returns:
+        pd.DataFrame: a clensed events dataframe after applying all of the
+        clensing steps.
+    """
+    cleansing_arguments = (excluded_event_names, locations_to_drop,
+                           natural_order_for_processes,
+                           include_spawn_end_events, locations_pathway_map,
+                           keep_last_location)
+    number_of_workers = min(number_of_workers, os.cpu_count() or 1)
+    if number_of_workers <= 1:
+        return cleanse_and_transform_data(events_quality, adm_status_raw,
+                                          obs_quality, diagnostics_quality,
+                                          *cleansing_arguments)
+
+    #Split every dataframe by the shard of its visits. Boolean masks keep the
+    #rows of each shard in their original order.
+    datasets = [(events_quality, "VisitId"), (adm_status_raw, "AttendanceID"),
+                (obs_quality, "VisitId"), (diagnostics_quality, "VisitId")]
+    shard_of_rows = [None if data is None
+                     else get_visit_shards(data[visit_column], number_of_workers)
+                     for data, visit_column in datasets]
+    shards = [tuple(None if data is None else data.loc[rows == shard]
+                    for (data, _), rows in zip(datasets, shard_of_rows))
+              for shard in range(number_of_workers)]
+
+    with ProcessPoolExecutor(number_of_workers) as executor:
+        clensed_shards = list(executor.map(cleanse_and_transform_shard, shards,
+                                           [cleansing_arguments] * len(shards)))
+
+    #Shards can add to the vocabulary, so bring them all up to date before
+    #putting them back together.
+    return sort_events(pd.concat([update_encoding(events_quality)
+                                  for events_quality in clensed_shards]))
+
+
+@profiled
+def cleanse_and_transform_data_in_partitions(events_filename,
+                               number_of_partitions, chunksize,
+                               repeat_time_threshold, remove_duplicate_staffid,
+                               remove_duplicate_location, adm_status_raw,
+                               obs_quality, diagnostics_quality,
+                               excluded_event_names, locations_to_drop,
+                               natural_order_for_processes,
+                               include_spawn_end_events, locations_pathway_map,
+                               keep_last_location,
+                               use_categorical_vocabulary=False,
+                               partition_path=None):
+    """
+    Streaming version of drop_duplicates_and_anomaly_times_events_data followed
+    by cleanse_and_transform_data for events files too large to fit in memory.
+    The raw events file is read in chunks and split by VisitId into partition
+    files on disk, then each partition is clensed on its own. Every step works
+    within a visit, so the result is the same as clensing the whole file.
+
+    Args:
+        events_filename (str): filename of the raw events data.
+        number_of_partitions (int): number of visit partitions to clense
+        separately.
+        chunksize (int): number of rows to read from the raw file at a time.
+        repeat_time_threshold (int): the number of minutes that should be used
+        to filter out repeated events.
+        remove_duplicate_staffid (bool): Flag to consider if duplicate events
+        should be removed if done by the same staff member.
+        remove_duplicate_location (bool): Flag to consider if duplicate events
+        should be removed if done in the same location.
+        adm_status_raw (Optional[pd.DataFrame]): raw admission status data frame.
+        obs_quality (Optional[pd.DataFrame]): clensed obs dataframe.
+        diagnostics_quality (Optional[pd.DataFrame]): clensed diagnostics
+        dataframe.
+        excluded_event_names (list[str]): list of event names to exclude.
+        locations_to_drop (list[str]): list of locations to exclude
+        natural_order_for_processes (dict[str, int]): dictionary of order of
+        processes.
+        include_spawn_end_events (bool): flag to include or exclude spawn end
+        events.
+        locations_pathway_map (dict[str, str]): dictionary to map locations to
+        their pathway.
+        keep_last_location (bool): flag to include last location.
+        use_categorical_vocabulary (bool, optional): flag to encode the string
+        columns of each partition with the shared vocabulary. Defaults to False.
+        partition_path (Optional[Path], optional): folder to write the
+        partition files under, created if missing. Defaults to None, the
+        system temporary folder.
+
+    Returns:
+        pd.DataFrame: a clensed events dataframe after applying all of the
+        clensing steps.
+    """
+    def rows_for_visits(data, visit_column, visit_ids):
+        """
+        Args:
+            data (Optional[pd.DataFrame]): data to filter.
+            visit_column (str): column name of the visit ids in data.
+            visit_ids (np.ndarray): visit ids to keep.
+
+        Returns:
+            Optional[pd.DataFrame]: data for only those visits.
+        """
+        if data is None:
+            return None
+        return data.loc[data[visit_column].isin(visit_ids)]
+
+    if partition_path is not None:
+        Path(partition_path).mkdir(exist_ok=True, parents=True)
+    clensed_partitions = []
+    with TemporaryDirectory(dir=partition_path) as temporary_path:
+        for partition_file in partition_data_by_visit(events_filename,
+                                                      temporary_path,
+                                                      number_of_partitions,
+                                                      chunksize):
+            events_raw = parse_datetime_columns(pd.read_csv(partition_file),
+                                                ["EventTime"])
+            if use_categorical_vocabulary:
+                events_raw = encode_columns(events_raw)
+            events_quality = cleaning.drop_duplicates_and_anomaly_times_events_data(
+                             events_raw, repeat_time_threshold,
+                             remove_duplicate_staffid, remove_duplicate_location)
+            #Only pass on the other data for the visits in this partition.
+            visit_ids = events_quality["VisitId"].unique()
+            clensed_partitions.append(cleanse_and_transform_data(
+                events_quality,
+                rows_for_visits(adm_status_raw, "AttendanceID", visit_ids),
+                rows_for_visits(obs_quality, "VisitId", visit_ids),
+                rows_for_visits(diagnostics_quality, "VisitId", visit_ids),
+                excluded_event_names, locations_to_drop,
+                natural_order_for_processes, include_spawn_end_events,
+                locations_pathway_map, keep_last_location))
+
+    #Later partitions can add to the vocabulary, so bring the earlier ones up
+    #to date before putting them back together.
+    return sort_events(pd.concat([update_encoding(events_quality)
+                                  for events_quality in clensed_partitions]))
@@ -0,0 +1,194 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import math
+import os
+from utils import remove_output
+from profiling import profiled
+
+#Formats tables can be written in, and the suffix of each.
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet"}
+#Threads that write the outputs queued by this process in the background, the
+#most memory the tables of queued writes can hold, and the writes that may not
+#have finished yet (oldest first) with the bytes each holds. Until
+#start_background_writes is called, writes are made straight away.
+background_writer = None
+number_of_writer_threads = 0
+max_pending_write_bytes = 0
+pending_writes = {}
+#Files whose write failed, and the error, since the last flush.
+failed_writes = []
+
+
+def get_table_path(filepath, output_format="csv"):
+    """
+    Args:
+        filepath (Path): file to output, with any suffix.
+        output_format (str, optional): format of the file, one of
+        OUTPUT_FORMATS. Defaults to "csv".
+
+    Returns:
+        Path: the file with the suffix of the format.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format {output_format!r}, expected "
+                         f"one of {list(OUTPUT_FORMATS)}")
+    return filepath.with_suffix(OUTPUT_FORMATS[output_format])
+
+
+def format_csv_rows(data, header):
+    """
+    Args:
+        data (pd.DataFrame): rows to format.
+        header (bool): flag to start with the column names.
+
+    Returns:
+        str: the rows as they would be written by to_csv.
+    """
+    return data.to_csv(index=False, header=header)
+
+
+def write_csv(data, filepath, number_of_workers=1):
+    """
+    Args:
+        data (pd.DataFrame): table to write.
+        filepath (Path): csv file to write to.
+        number_of_workers (int, optional): number of processes to format the
+        rows across, up to the number of CPUs. 1 or less writes the file with
+        to_csv in this process. Defaults to 1.
+    """
+    number_of_workers = min(number_of_workers, os.cpu_count() or 1)
+    if number_of_workers <= 1 or len(data) < number_of_workers:
+        data.to_csv(str(filepath), index=False)
+        return
+
+    #Format a block of rows in each process, then write the blocks in order
+    #so the file is the same as to_csv's.
+    block_size = math.ceil(len(data) / number_of_workers)
+    blocks = [data.iloc[start:start + block_size]
+              for start in range(0, len(data), block_size)]
+    with ProcessPoolExecutor(number_of_workers) as executor:
+        with open(filepath, "w", encoding="utf-8", newline="") as f:
+            for text in executor.map(format_csv_rows, blocks,
+                                     [True] + [False] * (len(blocks) - 1)):
+                f.write(text)
+
+
+@profiled
+def write_table(data, filepath, output_format="csv", partition_column=None,
+                number_of_workers=1):
+    """
+    Args:
+        data (pd.DataFrame): table to write.
+        filepath (Path): file to write to. Its suffix is replaced with that of
+        the format.
+        output_format (str, optional): "csv", or "parquet" to write a zstd
+        compressed, dictionary encoded parquet file. Parquet needs pyarrow.
+        Defaults to "csv".
+        partition_column (Optional[str], optional): column to split parquet
+        files into a folder per value by, if the table has it. Defaults to
+        None.
+        number_of_workers (int, optional): number of processes to format csv
+        files across (see write_csv). Defaults to 1.
+
+    Returns:
+        Path: the file, or folder if partitioned, written.
+    """
+    filepath = get_table_path(filepath, output_format)
+    #Remove any existing output first so it is never written through a link
+    #to another output, and no old partitions are left behind.
+    remove_output(filepath)
+    if output_format == "csv":
+        write_csv(data, filepath, number_of_workers)
+    else:
+        partition_cols = ([partition_column]
+                          if partition_column in data.columns else None)
+        data.to_parquet(filepath, index=False, compression="zstd",
+                        use_dictionary=True, partition_cols=partition_cols)
+    return filepath
+
+
+def start_background_writes(number_of_threads, max_pending_write_mb):
+    """
+    Args:
+        number_of_threads (int): number of threads to write outputs with while
+        the pipeline carries on. 0 or less writes them straight away.
+        max_pending_write_mb (float): most MB the tables of queued writes can
+        hold. Queueing another write waits for the oldest ones to finish
+        first.
+    """
+    global background_writer, number_of_writer_threads, max_pending_write_bytes
+    flush_writes()
+    if background_writer is not None:
+        background_writer.shutdown()
+    background_writer = (ThreadPoolExecutor(number_of_threads)
+                         if number_of_threads > 0 else None)
+    number_of_writer_threads = max(number_of_threads, 0)
+    max_pending_write_bytes = max_pending_write_mb * 2**20
+
+
+def get_background_write_settings():
+    """
+    Returns:
+        tuple[int, float]: the number of threads and MB to pass to
+        start_background_writes to write in the background the same way in
+        another process.
+    """
+    return number_of_writer_threads, max_pending_write_bytes / 2**20
+
+
+def finish_write(filepath):
+    """
+    Args:
+        filepath (Path): file of a queued write to wait for. Any error is kept
+        to be reported by flush_writes.
+    """
+    future, _ = pending_writes.pop(filepath)
+    error = future.exception()
+    if error is not None:
+        failed_writes.append((filepath, error))
+
+
+def wait_for_write(filepath):
+    """
+    Args:
+        filepath (Path): file to wait for any queued write of.
+    """
+    if filepath in pending_writes:
+        finish_write(filepath)
+
+
+def queue_write(filepath, write, data=None):
+    """
+    Args:
+        filepath (Path): file to output.
+        write (Callable[[Path], None]): function to write the file, with
+        everything it writes already bound (e.g. a functools.partial).
+        data (Optional[pd.DataFrame], optional): the table being written,
+        counted towards the memory held by queued writes. It mustn't be
+        changed until it is written. Defaults to None.
+    """
+    if background_writer is None:
+        write(filepath)
+        return
+    #Writes of the same file are made in the order they were queued.
+    wait_for_write(filepath)
+    size = 0 if data is None else int(data.memory_usage(index=False).sum())
+    while (pending_writes and size + sum(pending_size for _, pending_size
+                                         in pending_writes.values())
+           > max_pending_write_bytes):
+        finish_write(next(iter(pending_writes)))
+    pending_writes[filepath] = (background_writer.submit(write, filepath),
+                                size)
+
+
+def flush_writes():
+    """
+    Waits for every queued write to finish. If any writes failed since the
+    last flush, a RuntimeError listing each file and its error is raised.
+    """
+    for filepath in list(pending_writes):
+        finish_write(filepath)
+    if failed_writes:
+        message = "\n".join(f"{filepath}: {error!r}"
+                            for filepath, error in failed_writes)
+        failed_writes.clear()
+        raise RuntimeError(f"Failed to write outputs:\n{message}")
@@ -1,7 +1,12 @@
-from utils import sort_events
+from functools import partial
+import hashlib
+from utils import sort_events, link_or_copy, remove_output
+from outputs import get_table_path, write_table, queue_write, wait_for_write
+from event_filtering_functions import apply_filters
+from rendering import queue_figure
+from profiling import profiled
+from vocabulary import decode_columns
 from pathlib import Path
-from pm4py.objects.conversion.log import converter as log_converter  # type: ignore
-from pm4py.algo.discovery.dfg import algorithm as dfg_discovery  # type: ignore
 from pm4py.visualization.dfg import visualizer as dfg_visualizer  # type: ignore
 from config import SPAWN, REMOVED
 from graphviz import Digraph
@@ -9,14 +14,60 @@ import pandas as pd
 import numpy as np
 
 
-def add_reset_transitions(events_data):
+#Outputs and intermediates already made by this process, keyed by what they
+#were made from, so scenarios with the same inputs can share them.
+shared_artefacts = {}
+
+
+def get_data_fingerprint(data):
+    """
+    Args:
+        data (pd.DataFrame): dataframe to fingerprint.
+
+    Returns:
+        str: a hash of the columns and rows of the dataframe, in order.
+    """
+    fingerprint = hashlib.sha1(str(list(data.columns)).encode())
+    fingerprint.update(pd.util.hash_pandas_object(data, index=False)
+                       .to_numpy().tobytes())
+    return fingerprint.hexdigest()
+
+
+def output_shared_artefact(filepath, key, write, data=None):
+    """
+    Args:
+        filepath (Path): file to output.
+        key (tuple): what the file is made from. Files with the same key are
+        byte identical.
+        write (Callable[[Path], None]): function to write the file, with
+        everything it writes already bound, as it is queued to be written in
+        the background (see outputs.queue_write).
+        data (Optional[pd.DataFrame], optional): the table being written.
+        Defaults to None.
+    """
+    original = shared_artefacts.get(key)
+    if original is not None and original != filepath:
+        wait_for_write(original)
+        if original.exists():
+            wait_for_write(filepath)
+            link_or_copy(original, filepath)
+            return
+    #Remove any existing file first so it is never written through a link
+    #to another output.
+    wait_for_write(filepath)
+    remove_output(filepath)
+    queue_write(filepath, write, data)
+    shared_artefacts[key] = filepath
+
+
+def add_next_events(events_data):
     """
     Args:
         events_data (pd.DataFrame): clensed events dataframe.
 
     Returns:
-        pd.DataFrame: clensed events dataframe with the count and perctage of
-        each transition.
+        pd.DataFrame: clensed events dataframe with the next event of each
+        patient and any previous transition counts removed.
     """
     transitions = events_data.copy()
     transitions = transitions.drop(["Count", "Total", "Percentage"], axis=1,
@@ -25,11 +76,25 @@ def add_reset_transitions(events_data):
     # Calculate Next Event for each Patient
     transitions["Next Event (Pathway)"] = (transitions.groupby("VisitId")
                                            ["Event (Pathway)"].shift(-1))
+    return transitions
+
+
+@profiled
+def count_transitions(transitions):
+    """
+    Args:
+        transitions (pd.DataFrame): clensed events dataframe with next events.
 
+    Returns:
+        count_event_pairs (pd.DataFrame): the count of patients making each
+        transition.
+        count_events (pd.DataFrame): the total number of patients making a
+        transition from each event.
+    """
     # Calculate the count of patients that make each transition
     count_event_pairs = (transitions.groupby(["Event (Pathway)",
                                               "Next Event (Pathway)"],
-                                              as_index=False)
+                                              as_index=False, observed=True)
                                               .agg({"VisitId": "count"})
                                               .rename(columns=
                                                       {"VisitId": "Count"})
@@ -37,10 +102,27 @@ def add_reset_transitions(events_data):
     #calculate the total number of patients that have each event
     count_events = (transitions.loc[~transitions["Next Event (Pathway)"]
                                     .isnull()].groupby(["Event (Pathway)"],
-                                                       as_index=False)
+                                                       as_index=False,
+                                                       observed=True)
                                     .agg({"VisitId": "count"})
                                     .rename(columns={"VisitId": "Total"})
                                     .drop_duplicates())
+    return count_event_pairs, count_events
+
+
+def merge_transition_counts(transitions, count_event_pairs, count_events):
+    """
+    Args:
+        transitions (pd.DataFrame): clensed events dataframe with next events.
+        count_event_pairs (pd.DataFrame): the count of patients making each
+        transition.
+        count_events (pd.DataFrame): the total number of patients making a
+        transition from each event.
+
+    Returns:
+        pd.DataFrame: clensed events dataframe with the count and perctage of
+        each transition.
+    """
     #merge counts onto events data
     transitions = (transitions.merge(count_event_pairs,
                                      on=["Event (Pathway)",
@@ -55,32 +137,120 @@ def add_reset_transitions(events_data):
     return transitions
 
 
-def remove_transitions_below_percentage_in_pathway_definitions(threshold):
+@profiled
+def add_reset_transitions(events_data):
     """
     Args:
+        events_data (pd.DataFrame): clensed events dataframe.
+
+    Returns:
+        pd.DataFrame: clensed events dataframe with the count and perctage of
+        each transition.
+    """
+    transitions = add_next_events(events_data)
+    count_event_pairs, count_events = count_transitions(transitions)
+    return merge_transition_counts(transitions, count_event_pairs, count_events)
+
+
+def remove_lines_from_pathway_definition(pathway_definitions, threshold):
+    """
+    Args:
+        pathway_definitions (pd.DataFrame): Dataframe of pathway definitions.
         threshold (int): percentage threshold to remove transitions.
+
+    Returns:
+        pd.DataFrame: Dataframe with transitions below threshold removed.
     """
-    def remove_lines_from_pathway_definition(pathway_definitions):
-        """
-        Args:
-            pathway_definitions (pd.DataFrame): Dataframe of pathway definitions.
+    filtered_pathway_definitions = (pathway_definitions
+                                    .loc[pathway_definitions["Percentage"]
+                                         > threshold].copy())
+    event_pathway_groupby_new_sums = (filtered_pathway_definitions
+                                      .groupby("From Process",
+                                               observed=True)["Percentage"]
+                                      .transform("sum"))
+    filtered_pathway_definitions["Percentage"] = (filtered_pathway_definitions["Percentage"]
+                                                  * (100 / event_pathway_groupby_new_sums))
+    return filtered_pathway_definitions
 
-        Returns:
-            pd.DataFrame: Dataframe with transitions below threshold removed.
-        """
-        filtered_pathway_definitions = (pathway_definitions
-                                        .loc[pathway_definitions["Percentage"]
-                                             > threshold].copy())
-        event_pathway_groupby_new_sums = (filtered_pathway_definitions
-                                          .groupby("From Process")["Percentage"]
-                                          .transform("sum"))
-        filtered_pathway_definitions["Percentage"] = (filtered_pathway_definitions["Percentage"]
-                                                      * (100 / event_pathway_groupby_new_sums))
-        return filtered_pathway_definitions
 
-    return remove_lines_from_pathway_definition
+def remove_transitions_below_percentage_in_pathway_definitions(threshold):
+    """
+    Args:
+        threshold (int): percentage threshold to remove transitions.
+    """
+    return partial(remove_lines_from_pathway_definition, threshold=threshold)
 
 
+def prune_pathway_definition(pathway_definitions, thresholds):
+    """
+    Args:
+        pathway_definitions (pd.DataFrame): Dataframe of pathway definitions.
+        thresholds (list[float]): percentage thresholds to remove transitions
+        below.
+
+    Returns:
+        pruned_definitions (dict[float, pd.DataFrame]): the pathway definitions
+        with the transitions at or below each threshold removed and the rest
+        renormalised, as remove_lines_from_pathway_definition does.
+        sweep (pd.DataFrame): the transitions kept and percentage lost from
+        each From Process at each threshold.
+    """
+    thresholds = np.asarray(thresholds, dtype=float)
+    codes, processes = pd.factorize(pathway_definitions["From Process"])
+    percentages = pathway_definitions["Percentage"].to_numpy(dtype=float)
+
+    #Sort each From Process's transitions by percentage once, so the
+    #transitions removed at a threshold are the first of its block and their
+    #percentage is a difference of prefix sums. Transitions without a From
+    #Process or percentage aren't counted.
+    counted = np.flatnonzero((codes >= 0) & ~np.isnan(percentages))
+    counted = counted[np.lexsort((percentages[counted], codes[counted]))]
+    sorted_codes, sorted_percentages = codes[counted], percentages[counted]
+    prefix = np.concatenate([[0], np.cumsum(sorted_percentages)])
+    starts = np.searchsorted(sorted_codes, np.arange(len(processes)))
+    ends = np.searchsorted(sorted_codes, np.arange(len(processes)),
+                           side="right")
+
+    #Where every threshold falls in each From Process's block of
+    #percentages, which are the transitions at or below it.
+    removed = np.stack([start + np.searchsorted(sorted_percentages[start:end],
+                                                thresholds, side="right")
+                        for start, end in zip(starts, ends)], axis=1
+                       ) if len(processes) else np.zeros((len(thresholds), 0),
+                                                          dtype=np.intp)
+    lost = prefix[removed] - prefix[starts]
+    kept = prefix[ends] - prefix[removed]
+
+    #The transitions kept are those after each threshold's place in their
+    #block, and are renormalised by the percentage kept of their block.
+    #Transitions without a From Process are kept if above the threshold and
+    #renormalised to NaN, as the grouped sum skips them.
+    positions = np.arange(len(counted))
+    no_process = codes < 0
+    pruned_definitions = {}
+    for threshold, removed_before, kept_percentages in zip(thresholds.tolist(),
+                                                           removed, kept):
+        keep = no_process & (percentages > threshold)
+        keep[counted[positions >= removed_before[sorted_codes]]] = True
+        kept_percentages = np.append(kept_percentages, np.nan)
+        pruned_definition = pathway_definitions.loc[keep].copy()
+        pruned_definition["Percentage"] = (percentages[keep]
+                                           * (100 / kept_percentages
+                                              [codes[keep]]))
+        pruned_definitions[threshold] = pruned_definition
+
+    sweep = pd.DataFrame({"Threshold": np.repeat(thresholds, len(processes)),
+                          "From Process": np.tile(np.asarray(processes,
+                                                             dtype=object),
+                                                  len(thresholds)),
+                          "Transitions": np.tile(ends - starts,
+                                                 len(thresholds)),
+                          "Transitions Kept": (ends - removed).ravel(),
+                          "Percentage Lost": lost.ravel()})
+    return pruned_definitions, sweep
+
+
+@profiled
 def generate_and_output_pathway_definitions(events_data,
                                             include_spawn_end_events):
     """
@@ -164,6 +334,7 @@ def add_obs_repeat_splits(pathway_definition, obs_splits):
 
 
 
+@profiled
 def create_process_recurrence(obs_splits):
     """
     Args:
@@ -207,42 +378,136 @@ def create_process_recurrence(obs_splits):
     return process_recurrence_triggers, process_recurrence
 
 
-def get_dfg(event_data, export_event_log_csv,
-            export_log_to_csv_after_using_log_converter,
-            concept="Event (Pathway)", resource="EventLocation",
-            filepath=Path(".")):
+def get_event_log(event_data, concept="Event (Pathway)",
+                  resource="EventLocation"):
     """
     Args:
         event_data (pd.DataFrame): clensed events dataframe.
-        export_event_log_csv (bool): flag to import event log csv.
-        export_log_to_csv_after_using_log_converter (bool): ?????????????
-        concept (str, optional): ????????. Defaults to "Event (Pathway)".
+        concept (str, optional): column of the activities. Defaults to
+        "Event (Pathway)".
         resource (str, optional): string of the column to use.
         Defaults to "EventLocation".
-        filepath (Path, optional):filepath to save results. Defaults to Path(".").
 
     Returns:
-        dfg: Directly Follows Graph is returned.
+        pd.DataFrame: the events in order with the pm4py event log column names.
     """
     #tidy data
     event_data = event_data.dropna(subset=["EventTime"])
-    event_data = sort_events(event_data)
+    event_data = decode_columns(sort_events(event_data))
     event_data.rename(columns={"EventTime": "time:timestamp",
                                "VisitId": "case:concept:name",
                                concept: "concept:name",
                                resource: "org:resource"},inplace=True)
-    #write events log to csv
-    if export_event_log_csv:
-        event_data.to_csv(str(filepath / "Events Log.csv"), index=False)
+    return event_data
+
+
+def write_event_log(event_data, concept, filepath, convert=False,
+                    **table_options):
+    """
+    Args:
+        event_data (pd.DataFrame): clensed events dataframe.
+        concept (str): column of the activities.
+        filepath (Path): file to save the event log to.
+        convert (bool, optional): flag to convert the log with the pm4py log
+        converter first. Defaults to False.
+        **table_options: output format options of outputs.write_table.
+    """
+    event_log = get_event_log(event_data, concept)
+    if convert:
+        write_converted_event_log(event_log, filepath, **table_options)
+    else:
+        write_table(event_log, filepath, **table_options)
+
+
+def write_converted_event_log(event_log, filepath, output_format="csv",
+                              partition_column=None, number_of_workers=1):
+    """
+    Args:
+        event_log (pd.DataFrame): event log from get_event_log.
+        filepath (Path): file to save the log to after converting it with
+        the pm4py log converter.
+        output_format (str, optional): format of the file (see
+        outputs.write_table). Defaults to "csv".
+        partition_column (Optional[str], optional): column to partition
+        parquet files by. Defaults to None.
+        number_of_workers (int, optional): number of processes to write csv
+        files with. Defaults to 1.
+    """
+    from pm4py.objects.conversion.log import converter as log_converter  # type: ignore
+    write_table(pd.DataFrame(log_converter.apply(event_log)), filepath,
+                output_format, partition_column, number_of_workers)
+
+
+@profiled
+def get_directly_follows_graphs(event_data, concept="Event (Pathway)",
+                                split_column=None):
+    """
+    Args:
+        event_data (pd.DataFrame): clensed events dataframe.
+        concept (str, optional): column of the activities. Defaults to
+        "Event (Pathway)".
+        split_column (Optional[str], optional): column to split the events by,
+        with a graph for each value. Defaults to None.
+
+    Returns:
+        dict[str, dict[tuple[str, str], int]]: the directly follows graph of
+        each split ("All" if there is no split column), in the same format as
+        pm4py's dfg discovery: the number of times each activity directly
+        follows another within a patient's events.
+    """
+    event_data = sort_events(event_data.dropna(subset=["EventTime"]))
+    if split_column is None:
+        splits = pd.Series("All", index=event_data.index)
+    else:
+        splits = event_data[split_column]
+
+    #The next activity of each patient within the same split, all splits at
+    #once.
+    next_activities = (event_data.groupby([splits, event_data["VisitId"]],
+                                          observed=True, sort=False)
+                       [concept].shift(-1))
+    counts = (pd.DataFrame({"Split": splits, "From": event_data[concept],
+                            "To": next_activities})
+              .groupby(["Split", "From", "To"], observed=True, sort=False)
+              .size())
+
+    dfgs = {f"{i}": {} for i in splits.dropna().unique()}
+    for (split, from_activity, to_activity), count in counts.items():
+        dfgs[f"{split}"][(from_activity, to_activity)] = int(count)
+    return dfgs
 
-    # Convert to log format and save
-    log = log_converter.apply(event_data)
-    if export_log_to_csv_after_using_log_converter:
-        pd.DataFrame(log).to_csv(str(filepath / "Log.csv"), index=False)
 
-    dfg = dfg_discovery.apply(log)
-    return dfg
+@profiled
+def get_dfg(event_data, export_event_log_csv,
+            export_log_to_csv_after_using_log_converter,
+            concept="Event (Pathway)", resource="EventLocation",
+            filepath=Path(".")):
+    """
+    Args:
+        event_data (pd.DataFrame): clensed events dataframe.
+        export_event_log_csv (bool): flag to export the event log csv.
+        export_log_to_csv_after_using_log_converter (bool): flag to export the
+        event log csv after converting it with the pm4py log converter.
+        concept (str, optional): column of the activities. Defaults to
+        "Event (Pathway)".
+        resource (str, optional): string of the column to use.
+        Defaults to "EventLocation".
+        filepath (Path, optional):filepath to save results. Defaults to Path(".").
+
+    Returns:
+        dfg: Directly Follows Graph is returned.
+    """
+    if export_event_log_csv or export_log_to_csv_after_using_log_converter:
+        event_log = get_event_log(event_data, concept, resource)
+        #write events log to csv
+        if export_event_log_csv:
+            event_log.to_csv(str(filepath / "Events Log.csv"), index=False)
+        if export_log_to_csv_after_using_log_converter:
+            write_converted_event_log(event_log, filepath / "Log.csv")
 
+    return get_directly_follows_graphs(event_data, concept)["All"]
+
+@profiled
 def pathway_wait_in_place(pathway_definitions, pathways_wait_in_place,
                           recurrent_processes):
     """
@@ -353,13 +618,102 @@ def output_transition_viz(pathway_definition, filepath, name):
     graph.render(name, filepath)
 
 
+def render_transition_viz(source_file, svg_file, pathway_definition, name):
+    """
+    Args:
+        source_file (Path): graphviz source file output_transition_viz saves.
+        svg_file (Path): svg file output_transition_viz saves.
+        pathway_definition (pd.DataFrame): pathway definitions dataframe.
+        name (str): name of the folder being saved to.
+    """
+    output_transition_viz(pathway_definition, svg_file.parent, name)
+
+
+def queue_transition_viz(pathway_definition, filepath, name):
+    """
+    Args:
+        pathway_definition (pd.DataFrame): pathway definitions dataframe.
+        filepath (Path): filepath to save the visualisation to.
+        name (str): name of the folder being saved to.
+    """
+    queue_figure(render_transition_viz,
+                 [filepath / name, filepath / f"{name}.svg"],
+                 pathway_definition, name)
+
+
+def render_dfg(png_file, dfg):
+    """
+    Args:
+        png_file (Path): file to save the directly follows graph to.
+        dfg (dict[tuple[str, str], int]): directly follows graph.
+    """
+    dfg_visualizer.save(dfg_visualizer.apply(dfg), png_file)
+
+
+def get_shared_pathway_definitions(events_data, fingerprint,
+                                   include_spawn_end_events, obs_splits):
+    """
+    Args:
+        events_data (pd.DataFrame): clensed events dataframe.
+        fingerprint (str): fingerprint of the events data.
+        include_spawn_end_events (bool): flag to include spawn events.
+        obs_splits(list(tuple(str, str, int))): list of the new events to add
+        after triage to kick off repeated obs and their probabilities.
+
+    Returns:
+        pd.DataFrame: the pathway definitions of the events data with the
+        triage obs events added, made once per process for the same inputs.
+    """
+    definitions_key = ("Pathway Definitions", fingerprint,
+                       include_spawn_end_events, repr(obs_splits))
+    if definitions_key not in shared_artefacts:
+        pathway_definitions_unfiltered = generate_and_output_pathway_definitions(
+                                         events_data, include_spawn_end_events)
+        shared_artefacts[definitions_key] = add_obs_repeat_splits(
+                                            pathway_definitions_unfiltered,
+                                            obs_splits)
+    return shared_artefacts[definitions_key]
+
+
+@profiled
+def generate_and_output_pathway_pruning_sweep(events_data, filepath,
+    include_spawn_end_events, obs_splits, thresholds,
+    export_pruned_pathway_definitions=False):
+    """
+    Args:
+        events_data (pd.DataFrame): clensed events dataframe.
+        filepath (Path): full filepath to folder to populate.
+        include_spawn_end_events (bool): flag to include spawn events.
+        obs_splits(list(tuple(str, str, int))): list of the new events to add
+        after triage to kick off repeated obs and their probabilities.
+        thresholds (list[float]): percentage thresholds to remove transitions
+        below.
+        export_pruned_pathway_definitions (bool, optional): flag to also save
+        the pathway definition pruned at each threshold. Defaults to False.
+    """
+    filepath.mkdir(exist_ok=True, parents=True)
+    pathway_definitions = get_shared_pathway_definitions(
+                          events_data, get_data_fingerprint(events_data),
+                          include_spawn_end_events, obs_splits)
+    pruned_definitions, sweep = prune_pathway_definition(pathway_definitions,
+                                                         thresholds)
+    sweep.to_csv(filepath / "Pathway Pruning Sweep.csv", index=False)
+    if export_pruned_pathway_definitions:
+        for threshold, pruned_definition in pruned_definitions.items():
+            pruned_definition.to_csv(filepath / f"Pathway Definition {threshold}%.csv",
+                                     index=False)
+
+
+@profiled
 def generate_and_output_dfg_and_pathway_definition(directory_path, events_data,
     filepath, include_spawn_end_events, obs_splits, export_event_log_csv,
     export_log_to_csv_after_using_log_converter, location_capacity_data,
     process_location_data, event_names_based_process_requirements,
     pathways_wait_in_place, process_column="Event (Pathway)",
     split_column=" ", filterFuncs=None,
-    post_processing_functions_of_pathway_definitions=None):
+    post_processing_functions_of_pathway_definitions=None,
+    output_format="csv", output_partition_column=None,
+    number_of_csv_writer_workers=1):
     """
     Args:
         directory_path (str): name of folder to create or populate.
@@ -385,27 +739,52 @@ def generate_and_output_dfg_and_pathway_definition(directory_path, events_data,
         filterFuncs (): list of filter functions if required default=None
         post_processing_functions_of_pathway_definitions (): list of functions
         for postprocessing of process definitions if required. default=None
+        output_format (str): format of the events data and event logs, "csv"
+        or "parquet" (see outputs.write_table). default="csv"
+        output_partition_column (str): column to partition parquet events data
+        and event logs by if required. default=None
+        number_of_csv_writer_workers (int): number of processes to write csv
+        events data and event logs with. default=1
     """
     #create file directory if it doesn't exist
     filepath.mkdir(exist_ok=True, parents=True)
 
+    #The transitions are counted again after each filter, as the next filter
+    #can depend on them.
     if filterFuncs is not None:
         for filter in filterFuncs:
-            events_data = filter(events_data)
+            events_data = apply_filters(events_data, [filter])
             events_data = add_reset_transitions(events_data)
 
-    #save the events data to csv
-    events_data.to_csv(str(filepath / "Events Data.csv"), index=False)
+    #Scenarios whose filtered events data are the same share the events data,
+    #unfiltered pathway definitions and dfgs made from them.
+    fingerprint = get_data_fingerprint(events_data)
+
+    #save the events data in the output format. The outputs are written in
+    #the background while the scenario carries on.
+    table_options = {"output_format": output_format,
+                     "partition_column": output_partition_column,
+                     "number_of_workers": number_of_csv_writer_workers}
+    output_shared_artefact(get_table_path(filepath / "Events Data.csv",
+                                          output_format),
+                           ("Events Data", fingerprint, output_format,
+                            output_partition_column),
+                           partial(write_table, events_data, **table_options),
+                           events_data)
 
     #get pathway definitions and add in the triage obs events.
-    pathway_definitions_unfiltered = generate_and_output_pathway_definitions(
-                                     events_data, include_spawn_end_events)
-    pathway_definitions_unfiltered = add_obs_repeat_splits(pathway_definitions_unfiltered,
-                                                           obs_splits)
+    pathway_definitions_unfiltered = get_shared_pathway_definitions(
+                                     events_data, fingerprint,
+                                     include_spawn_end_events, obs_splits)
     #Create process recurrence outputs
     process_recurrence_triggers, process_recurrence = create_process_recurrence(obs_splits)
-    process_recurrence_triggers.to_csv(str(filepath / "Process Recurrence Triggers.csv"), index=False)
-    process_recurrence.to_csv(str(filepath / "Process Recurrence.csv"), index=False)
+    output_shared_artefact(filepath / "Process Recurrence Triggers.csv",
+                           ("Process Recurrence Triggers", repr(obs_splits)),
+                           partial(process_recurrence_triggers.to_csv,
+                                   index=False))
+    output_shared_artefact(filepath / "Process Recurrence.csv",
+                           ("Process Recurrence", repr(obs_splits)),
+                           partial(process_recurrence.to_csv, index=False))
 
     #if post processing functions, apply these, then save the pathway
     # definitions to csv and output the transitions plot.
@@ -413,39 +792,63 @@ def generate_and_output_dfg_and_pathway_definition(directory_path, events_data,
         #Filter the pathway definition
         pathway_definitions = post_processing_functions_of_pathway_definitions(
                                        pathway_definitions_unfiltered)
-        pathway_definitions.to_csv(str(filepath / "Pathway Definition.csv"),
-                                            index=None)
-        output_transition_viz(pathway_definitions, filepath, directory_path)
+        queue_write(filepath / "Pathway Definition.csv",
+                    partial(pathway_definitions.to_csv, index=None),
+                    pathway_definitions)
+        queue_transition_viz(pathway_definitions, filepath, directory_path)
 
     else:
         pathway_definitions = pathway_definitions_unfiltered.copy()
-        pathway_definitions.to_csv(filepath/"Pathway Definition.csv",
-                                   index=False)
-        output_transition_viz(pathway_definitions, filepath, directory_path)
+        queue_write(filepath / "Pathway Definition.csv",
+                    partial(pathway_definitions.to_csv, index=False),
+                    pathway_definitions)
+        queue_transition_viz(pathway_definitions, filepath, directory_path)
 
     #Create and save process wait in place.
     wait_in_place = pathway_wait_in_place(pathway_definitions,
                                           pathways_wait_in_place,
                                           [lst[3] for lst in obs_splits])
-    wait_in_place.to_csv(filepath/"Process Wait in Place.csv", index=False)
+    queue_write(filepath / "Process Wait in Place.csv",
+                partial(wait_in_place.to_csv, index=False), wait_in_place)
+
+    #Create log files and dfgs. The dfgs of every split are counted in one
+    #pass.
+    dfgs_key = ("DFGs", fingerprint, process_column, split_column)
+    if dfgs_key not in shared_artefacts:
+        shared_artefacts[dfgs_key] = get_directly_follows_graphs(
+                                     events_data, process_column, split_column)
+    logs = shared_artefacts[dfgs_key]
+
+    if export_event_log_csv or export_log_to_csv_after_using_log_converter:
+        for key in logs:
+            if split_column is None:
+                split_data, split_filepath = events_data, filepath
+            else:
+                split_data = events_data.loc[events_data[split_column] == key]
+                split_filepath = filepath / key
+                split_filepath.mkdir(exist_ok=True, parents=True)
+            log_key = (fingerprint, process_column, split_column, key,
+                       output_format, output_partition_column)
+            if export_event_log_csv:
+                output_shared_artefact(get_table_path(
+                                       split_filepath / "Events Log.csv",
+                                       output_format),
+                                       ("Events Log", *log_key),
+                                       partial(write_event_log, split_data,
+                                               process_column,
+                                               **table_options),
+                                       split_data)
+            if export_log_to_csv_after_using_log_converter:
+                output_shared_artefact(get_table_path(
+                                       split_filepath / "Log.csv",
+                                       output_format),
+                                       ("Log", *log_key),
+                                       partial(write_event_log, split_data,
+                                               process_column, convert=True,
+                                               **table_options),
+                                       split_data)
 
-    #Create log files and dfgs
-    if split_column is None:
-        logs = {}
-        logs["All"] = get_dfg(events_data, export_event_log_csv,
-                              export_log_to_csv_after_using_log_converter,
-                              process_column, filepath=filepath)
-    else:
-        logs = {}
-        for i in events_data[split_column].unique():
-            split_filepath = filepath / i
-            logs[f"{i}"] = get_dfg(events_data.loc[events_data[split_column]
-                                                   == i].copy(),
-                                   export_event_log_csv,
-                                   export_log_to_csv_after_using_log_converter,
-                                   process_column, filepath=split_filepath)
     #save the direct follows graphs.
     for key, dfg in logs.items():
-        gviz = dfg_visualizer.apply(dfg)
-        dfg_visualizer.save(gviz, filepath / f"{key}.png")
+        queue_figure(render_dfg, [filepath / f"{key}.png"], dfg)
 
@@ -1,40 +1,115 @@
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import math
 import pandas as pd
 import scipy as sp  # type: ignore
 import matplotlib.pyplot as plt
 import numpy as np
-from event_filtering_functions import exclude_unknown_staff
+from event_filtering_functions import apply_filters
+from rendering import queue_figure
+from outputs import queue_write
+from profiling import profiled
 from config import where_duration_should_be_0
 
 
+#Columns of the events the durations scenarios use.
+DURATION_COLUMNS = ["VisitId", "EventName", "EventTime", "EventStaffId",
+                    "EventLocation", "Pathway", "Event (Pathway)"]
+#Location the log normal distributions are fitted with, so durations of 0 can
+#be fitted.
+LOG_NORMAL_LOCATION = -0.00001
+
+
+@profiled
+def fit_log_normals(processed_events):
+    """
+    Args:
+        processed_events (pd.DataFrame): dataframe of processed events.
+
+    Returns:
+        pd.DataFrame: the mu and sigma of the log normal distribution fitted to
+        the durations of each process, and their min and max, indexed by
+        process. With the location fixed the maximum likelihood fit is the
+        mean and standard deviation of log(duration - location), so every
+        process is fitted at once rather than with an optimiser each.
+    """
+    durations = processed_events[["Event (Pathway)", "diffMinutes"]].dropna()
+    codes, processes = pd.factorize(durations["Event (Pathway)"])
+    values = durations["diffMinutes"].to_numpy(dtype=float)
+    if len(values) == 0:
+        return pd.DataFrame(columns=["mu", "sigma", "Min", "Max"])
+
+    #Sort the durations by process so each process is one contiguous block.
+    order = np.argsort(codes, kind="stable")
+    codes, values = codes[order], values[order]
+    counts = np.bincount(codes, minlength=len(processes))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    log_values = np.log(values - LOG_NORMAL_LOCATION)
+    mu = np.bincount(codes, log_values, len(processes)) / counts
+    sigma = np.sqrt(np.bincount(codes, (log_values - mu[codes])**2,
+                                len(processes)) / counts)
+    return pd.DataFrame({"mu": mu, "sigma": sigma,
+                         "Min": np.minimum.reduceat(values, starts),
+                         "Max": np.maximum.reduceat(values, starts)},
+                        index=pd.Index(processes).astype(str))
+
+
+@profiled
+def fit_log_normals_with_scipy(processed_events):
+    """
+    Args:
+        processed_events (pd.DataFrame): dataframe of processed events.
+
+    Returns:
+        pd.DataFrame: the same as fit_log_normals, but fitting each process
+        with scipy. Slower, kept to check fit_log_normals against.
+    """
+    fits = {}
+    for process, data in (processed_events.dropna(subset=["diffMinutes"])
+                          .groupby("Event (Pathway)", observed=True)
+                          ["diffMinutes"]):
+        data = data.astype(float)
+        shape, loc, scale = sp.stats.lognorm.fit(data.values,
+                                                 floc=LOG_NORMAL_LOCATION)
+        fits[str(process)] = {"mu": np.log(scale), "sigma": shape,
+                              "Min": min(data.values), "Max": max(data.values)}
+    return pd.DataFrame.from_dict(fits, orient="index",
+                                  columns=["mu", "sigma", "Min", "Max"])
+
+
+@profiled
 def generate_and_output_process_durations_log_normal(directory_path,
-                                                    processed_events, processes):
+                                                    processed_events, processes,
+                                                    fit_with_scipy=False):
     """
     Args:
         directory_path (Path): path to output directory.
         processed_events (pd.DataFrame): dataframe of processed events.
         processes (list[str]): list of processes.
+        fit_with_scipy (bool, optional): flag to fit each process with scipy
+        instead of all at once. Defaults to False.
     """
     #fit a log normal to each process data
+    if fit_with_scipy:
+        fits = fit_log_normals_with_scipy(processed_events)
+    else:
+        fits = fit_log_normals(processed_events)
+
     new_entries = []
     for process in processes:
-        #get the data for that process
-        data = (processed_events.loc[processed_events["Event (Pathway)"]
-                                    == str(process), "diffMinutes"].copy().dropna()
-                                    .astype(float))
-        if process != "" and len(data) > 0:
-            #if data for that process, fit a log normal and record parameters
-            shape, loc, scale = sp.stats.lognorm.fit(data.values, floc=-0.00001)
-            mu = np.log(scale)
-            sigma = shape
+        if process != "" and str(process) in fits.index:
+            #if data for that process, record parameters
+            mu, sigma, minimum, maximum = fits.loc[str(process),
+                                                   ["mu", "sigma", "Min", "Max"]]
             mean = math.exp(mu + (0.5 * sigma**2))
             variance = (math.exp(sigma**2) - 1) * math.exp((2 * mu) + (sigma**2))
             new_entries.append({"Event (Pathway)": str(process),
                                           "Mean": mean,
                                           "StdDev": math.sqrt(variance),
-                                          "Min": min(data.values),
-                                          "Max": max(data.values)})
+                                          "Min": minimum,
+                                          "Max": maximum})
         elif process != "":
             #if no data, record empty parameters
             new_entries.append({"Event (Pathway)": process, "Mean": 0,
@@ -46,10 +121,12 @@ def generate_and_output_process_durations_log_normal(directory_path,
     process_durations = process_durations.rename(columns={
         "Mean": "Duration Mean",
         "Event (Pathway)": "Process (Pathway and Recurrent)"})
-    process_durations.to_csv(directory_path / "Process Durations.csv",
-                             index=False)
+    queue_write(directory_path / "Process Durations.csv",
+                partial(process_durations.to_csv, index=False),
+                process_durations)
 
 
+@profiled
 def generate_and_output_histogram_and_process_durations(directory_path,
     processed_events, groupby_column, output_path, plots, filterFuncs=None):
     """
@@ -58,6 +135,8 @@ def generate_and_output_histogram_and_process_durations(directory_path,
         processed_events (pd.DataFrame): dataframe of processed events.
         groupby_column (str): column name to group by.
         output_path (Path): path to output folder.
+        plots (bool): flag to queue a histogram of each group for rendering
+        (see rendering.render_figures).
         filterFuncs (_type_, optional): Functions to apply to data if required.
         Defaults to None.
     """
@@ -68,51 +147,124 @@ def generate_and_output_histogram_and_process_durations(directory_path,
     #Get a list of unique events.
     processes = processed_events["Event (Pathway)"].unique().tolist()
 
-    #Appply functions if these have been passed in.
-    if filterFuncs is not None:
-        for filter in filterFuncs:
-            processed_events = filter(processed_events)
+    #Appply functions if these have been passed in, selecting the rows they
+    #keep together.
+    processed_events = apply_filters(processed_events, filterFuncs)
 
     #Log normal distributions.
     generate_and_output_process_durations_log_normal(plot_folder_directory_path,
                                                     processed_events, processes)
     if plots:
-        for group, data in processed_events.groupby(groupby_column)["diffMinutes"]:
-            #create a histogram for the data in each event.
+        for group, data in (processed_events.groupby(groupby_column,
+                                                     observed=True)
+                            ["diffMinutes"]):
+            #queue a histogram for the data in each event.
             title = str(group).replace("_", "")
-            ax = data.plot.hist(bins=100, figsize=(12, 8))
-            ax.grid(True, which="both", linestyle="--", linewidth=0.5)
-            ax.set_xlabel("time (minutes)")
-            ax.set_title(f"{title} {directory_path}")
-            fig = ax.get_figure()
-            if fig is not None:
-                slash_replacement = {"\\": "-", "//": "-", "/": "-"}
-                for key, value in slash_replacement.items():
-                    label = f"{(str(title)).replace(key, value)}.png"
-                fig.savefig(plot_folder_directory_path / f"{label}")
-                plt.close(fig)
-
-
-def add_difference_in_minutes_to_durations(events_quality):
+            slash_replacement = {"\\": "-", "//": "-", "/": "-"}
+            for key, value in slash_replacement.items():
+                label = f"{(str(title)).replace(key, value)}.png"
+            queue_figure(render_histogram,
+                         [plot_folder_directory_path / f"{label}"],
+                         data.to_numpy(), f"{title} {directory_path}")
+
+
+def render_histogram(png_file, durations, title):
+    """
+    Args:
+        png_file (Path): file to save the histogram to.
+        durations (np.ndarray): durations in minutes.
+        title (str): title of the histogram.
+    """
+    ax = pd.Series(durations).plot.hist(bins=100, figsize=(12, 8))
+    ax.grid(True, which="both", linestyle="--", linewidth=0.5)
+    ax.set_xlabel("time (minutes)")
+    ax.set_title(title)
+    fig = ax.get_figure()
+    if fig is not None:
+        fig.savefig(png_file)
+        plt.close(fig)
+
+
+def get_staff_partition_durations(rows, staff_codes, times, missing_staff):
+    """
+    Args:
+        rows (np.ndarray): positions of the events of the staff partition.
+        staff_codes (np.ndarray): staff code of every event.
+        times (np.ndarray): int64 nanosecond time of every event, with
+        missing times as the largest int64.
+        missing_staff (int): staff code of events with no staff, after every
+        other code.
+
+    Returns:
+        order (np.ndarray): the rows sorted by staff and time.
+        durations (np.ndarray): nanoseconds from each sorted event to the
+        next event by the same staff member, NaN for their last event.
+    """
+    order = rows[np.lexsort((times[rows], staff_codes[rows]))]
+    staff_codes, times = staff_codes[order], times[order]
+    missing_time = times == np.iinfo(np.int64).max
+    has_next = ((staff_codes[1:] == staff_codes[:-1])
+                & (staff_codes[1:] != missing_staff)
+                & ~missing_time[1:] & ~missing_time[:-1])
+    durations = np.full(len(order), np.nan)
+    durations[:-1][has_next] = (times[1:] - times[:-1])[has_next]
+    return order, durations
+
+
+@profiled
+def add_difference_in_minutes_to_durations(events_quality, number_of_workers=1):
     """
     Args:
         events_quality (pd.DataFrame): clensed events dataframe.
+        number_of_workers (int, optional): number of threads to sort and diff
+        the staff partitions across. Defaults to 1.
 
     Returns:
-        pd.DataFrame: events dataframe with durations added.
+        pd.DataFrame: the events of known staff, sorted by staff and time, with
+        the minutes until the staff member's next event as diffMinutes. Only
+        the columns the durations use are kept.
     """
-    # Take a copy before processing and exclude unknown staff.
-    event_diffs = events_quality.copy()
-    event_diffs = exclude_unknown_staff(event_diffs)
-
-    # Re-sort to ensure in DateTime order
-    event_diffs = event_diffs.sort_values(by=["EventStaffId", "EventTime"])
-
-    # get time diff column
-    event_diffs["time_diff"] = (event_diffs.groupby("EventStaffId")
-                                ["EventTime"].diff().shift(-1))
-    event_diffs["diffMinutes"] = (pd.to_timedelta(event_diffs["time_diff"])
-                                  .dt.total_seconds() / 60)
+    #Work on integer staff codes and nanosecond times of only the events of
+    #known staff, rather than on a sorted copy of the whole dataframe.
+    staff = events_quality["EventStaffId"].to_numpy()
+    known_staff = np.flatnonzero(staff != 1)
+    staff_codes, staff_ids = pd.factorize(staff[known_staff], sort=True)
+    #Missing staff and times sort last, and are never diffed.
+    missing_staff = len(staff_ids)
+    staff_codes[staff_codes < 0] = missing_staff
+    times = (events_quality["EventTime"].to_numpy(dtype="datetime64[ns]")
+             [known_staff].view(np.int64).copy())
+    times[times == np.iinfo(np.int64).min] = np.iinfo(np.int64).max
+
+    #Split the staff into partitions of about the same number of events, and
+    #sort and diff each one separately.
+    number_of_partitions = max(1, min(number_of_workers, missing_staff + 1))
+    events_per_staff = np.bincount(staff_codes, minlength=missing_staff + 1)
+    boundaries = np.searchsorted(np.cumsum(events_per_staff),
+                                 np.linspace(0, len(staff_codes),
+                                             number_of_partitions + 1)[1:-1])
+    partition_of_events = np.searchsorted(boundaries, staff_codes, side="right")
+    partition_order = np.argsort(partition_of_events, kind="stable")
+    partitions = np.split(partition_order, np.cumsum(
+                 np.bincount(partition_of_events,
+                             minlength=number_of_partitions))[:-1])
+    if number_of_partitions == 1:
+        results = [get_staff_partition_durations(partitions[0], staff_codes,
+                                                 times, missing_staff)]
+    else:
+        with ThreadPoolExecutor(number_of_partitions) as executor:
+            results = list(executor.map(get_staff_partition_durations,
+                                        partitions,
+                                        [staff_codes] * number_of_partitions,
+                                        [times] * number_of_partitions,
+                                        [missing_staff] * number_of_partitions))
+    order = np.concatenate([partition_order for partition_order, _ in results])
+    durations = np.concatenate([durations for _, durations in results])
+
+    columns = [column for column in DURATION_COLUMNS
+               if column in events_quality.columns]
+    event_diffs = events_quality[columns].iloc[known_staff[order]]
+    event_diffs["diffMinutes"] = durations / 10**9 / 60
 
     event_diffs.loc[event_diffs["EventName"].isin(where_duration_should_be_0)
                     & event_diffs["diffMinutes"].isna(), "diffMinutes"] = 0
@@ -0,0 +1,179 @@
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+import json
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    #Not available on Windows, where peak memory isn't recorded.
+    resource = None
+
+#Profiling is off unless enable_profiling is called, and profiled functions
+#then just call through.
+enabled = False
+#Records of each stage profiled by this process, and the names of the stages
+#each thread is currently running, outermost first.
+profile_records = []
+thread_stages = threading.local()
+
+
+def enable_profiling(profile=True):
+    """
+    Args:
+        profile (bool, optional): flag to profile stages. Defaults to True.
+    """
+    global enabled
+    enabled = profile
+
+
+def is_profiling_enabled():
+    """
+    Returns:
+        bool: whether stages are being profiled.
+    """
+    return enabled
+
+
+def get_open_stages():
+    """
+    Returns:
+        list[str]: the names of the stages this thread is running, outermost
+        first. Stages run by background threads aren't nested in the stages
+        of the thread that started them.
+    """
+    if not hasattr(thread_stages, "open_stages"):
+        thread_stages.open_stages = []
+    return thread_stages.open_stages
+
+
+def get_peak_rss_mb():
+    """
+    Returns:
+        Optional[float]: the peak resident memory of this process so far in
+        MB, or None if it can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports kilobytes and macOS bytes.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def count_rows(value):
+    """
+    Args:
+        value: argument or result of a profiled function.
+
+    Returns:
+        Optional[int]: rows of the value if it is a dataframe, or of the first
+        dataframe in it if it is a tuple or list.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        for item in value:
+            if isinstance(item, (pd.DataFrame, pd.Series)):
+                return len(item)
+    return None
+
+
+@contextmanager
+def profile_stage(name, rows_in=None):
+    """
+    Args:
+        name (str): name of the stage. Stages inside another are recorded as
+        "outer stage/name".
+        rows_in (Optional[int], optional): rows of the stage's input data.
+        Defaults to None.
+
+    Yields:
+        dict: the stage's record, whose "Rows Out" can be set by the caller.
+    """
+    open_stages = get_open_stages()
+    record = {"Stage": "/".join(open_stages + [name]),
+              "Depth": len(open_stages), "Process": os.getpid(),
+              "Rows In": rows_in, "Rows Out": None}
+    if not enabled:
+        yield record
+        return
+
+    open_stages.append(name)
+    start_rss = get_peak_rss_mb()
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["Wall Seconds"] = time.perf_counter() - start
+        record["CPU Seconds"] = time.process_time() - start_cpu
+        end_rss = get_peak_rss_mb()
+        record["Peak RSS Delta MB"] = (None if start_rss is None
+                                       else end_rss - start_rss)
+        open_stages.pop()
+        profile_records.append(record)
+
+
+def profiled(function):
+    """
+    Args:
+        function (Callable): pipeline step to profile when profiling is
+        enabled. The rows of its first dataframe argument and of its result
+        are recorded.
+
+    Returns:
+        Callable: the profiled function.
+    """
+    @wraps(function)
+    def profiled_function(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        rows_in = next((rows for rows in map(count_rows,
+                                             (*args, *kwargs.values()))
+                        if rows is not None), None)
+        with profile_stage(function.__name__, rows_in) as record:
+            result = function(*args, **kwargs)
+            record["Rows Out"] = count_rows(result)
+        return result
+    return profiled_function
+
+
+def take_profile_records():
+    """
+    Returns:
+        list[dict]: the records profiled by this process, which are removed
+        so they are only returned once.
+    """
+    records = profile_records.copy()
+    profile_records.clear()
+    return records
+
+
+def write_profile(output_path, records=None):
+    """
+    Args:
+        output_path (Path): folder to save Profile.csv and Profile.json to.
+        records (Optional[list[dict]], optional): records to save. Defaults to
+        those profiled by this process.
+
+    Returns:
+        pd.DataFrame: the profile, one row per stage in the order they
+        finished.
+    """
+    records = profile_records if records is None else records
+    profile = pd.DataFrame(records, columns=["Stage", "Depth", "Process",
+                                             "Wall Seconds", "CPU Seconds",
+                                             "Peak RSS Delta MB", "Rows In",
+                                             "Rows Out"])
+    profile = profile.astype({"Rows In": "Int64", "Rows Out": "Int64"})
+    output_path = Path(output_path)
+    output_path.mkdir(exist_ok=True, parents=True)
+    profile.to_csv(output_path / "Profile.csv", index=False)
+    with open(output_path / "Profile.json", "w", encoding="utf-8") as f:
+        json.dump(json.loads(profile.to_json(orient="records")), f, indent=4)
+    return profile
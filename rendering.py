@@ -0,0 +1,151 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from utils import link_or_copy
+from profiling import profiled
+
+#Figures queued by this process that haven't been rendered yet. Each is a
+#dictionary of the render function, its arguments, the files it outputs and
+#a hash of its inputs.
+queued_figures = []
+
+
+def get_content_hash(function, args):
+    """
+    Args:
+        function (Callable): function that renders the figure.
+        args (tuple): arguments of the function, other than the output files.
+
+    Returns:
+        str: a hash of the function and its arguments. Figures with the same
+        hash render to the same files.
+    """
+    content_hash = hashlib.sha1(f"{function.__module__}.{function.__qualname__}"
+                                .encode())
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            content_hash.update(str(list(arg.columns)).encode())
+            content_hash.update(pd.util.hash_pandas_object(arg, index=False)
+                                .to_numpy().tobytes())
+        elif isinstance(arg, np.ndarray):
+            content_hash.update(str(arg.dtype).encode())
+            content_hash.update(np.ascontiguousarray(arg).tobytes())
+        elif isinstance(arg, dict):
+            content_hash.update(repr(sorted(arg.items())).encode())
+        else:
+            content_hash.update(repr(arg).encode())
+    return content_hash.hexdigest()
+
+
+def queue_figure(function, outputs, *args):
+    """
+    Args:
+        function (Callable): module level function that renders the figure,
+        called as function(*outputs, *args).
+        outputs (list[Path]): the files the function outputs.
+        *args: the other arguments of the function.
+    """
+    queued_figures.append({"function": function, "outputs": list(outputs),
+                           "args": args,
+                           "hash": get_content_hash(function, args)})
+
+
+def take_queued_figures():
+    """
+    Returns:
+        list[dict]: the figures queued by this process, which are removed from
+        the queue.
+    """
+    figures = queued_figures.copy()
+    queued_figures.clear()
+    return figures
+
+
+def render_figure(figure):
+    """
+    Args:
+        figure (dict): queued figure.
+    """
+    #Remove the old files first so they are never written through a link to
+    #another figure.
+    for output in figure["outputs"]:
+        output.unlink(missing_ok=True)
+    figure["function"](*figure["outputs"], *figure["args"])
+
+
+@profiled
+def render_figures(figures, number_of_workers, manifest_path=None):
+    """
+    Args:
+        figures (list[dict]): queued figures to render.
+        number_of_workers (int): number of processes to render the figures
+        across, up to the number of CPUs. 1 or less renders them one after
+        another in this process.
+        manifest_path (Optional[Path], optional): json file of the hash of
+        each file rendered by previous runs. Figures whose files already exist
+        with the same hash are not rendered again. Defaults to None.
+
+    Returns:
+        int: number of figures rendered.
+    """
+    manifest = {}
+    if manifest_path is not None and Path(manifest_path).exists():
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    def is_up_to_date(figure):
+        """
+        Args:
+            figure (dict): queued figure.
+
+        Returns:
+            bool: whether the figure's files were already rendered from the
+            same inputs.
+        """
+        return all(output.exists()
+                   and manifest.get(str(output)) == figure["hash"]
+                   for output in figure["outputs"])
+
+    #Render the first figure of each hash that isn't up to date, and link the
+    #rest to it afterwards.
+    to_render = {}
+    duplicates = []
+    for figure in figures:
+        if is_up_to_date(figure):
+            continue
+        if figure["hash"] in to_render:
+            duplicates.append(figure)
+        else:
+            to_render[figure["hash"]] = figure
+
+    number_of_workers = min(number_of_workers, len(to_render),
+                            os.cpu_count() or 1)
+    if number_of_workers <= 1:
+        for figure in to_render.values():
+            render_figure(figure)
+    else:
+        with ProcessPoolExecutor(number_of_workers) as executor:
+            list(executor.map(render_figure, to_render.values()))
+
+    for figure in duplicates:
+        original = to_render[figure["hash"]]
+        if all(output.exists() for output in original["outputs"]):
+            for output, original_output in zip(figure["outputs"],
+                                               original["outputs"]):
+                if output != original_output:
+                    link_or_copy(original_output, output)
+        else:
+            render_figure(figure)
+
+    if manifest_path is not None:
+        for figure in figures:
+            for output in figure["outputs"]:
+                manifest[str(output)] = figure["hash"]
+        Path(manifest_path).parent.mkdir(exist_ok=True, parents=True)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4, sort_keys=True)
+    return len(to_render)
@@ -0,0 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import time
+import pandas as pd
+from rendering import take_queued_figures
+from outputs import (flush_writes, get_background_write_settings,
+                     start_background_writes)
+from profiling import (enable_profiling, is_profiling_enabled,
+                       profile_records, profile_stage, take_profile_records)
+
+#Data shared by every scenario. Each worker process receives it once, when it
+#starts, rather than with every scenario.
+shared_data = {}
+
+
+def initialise_worker(data, profile=False, background_writes=(0, 0)):
+    """
+    Args:
+        data (dict[str, pd.DataFrame]): the data shared by every scenario,
+        keyed by the argument name the scenario functions take it as.
+        profile (bool, optional): flag to profile the scenarios. Defaults to
+        False.
+        background_writes (tuple[int, float], optional): number of threads
+        and MB to write the scenarios' outputs in the background with (see
+        outputs.start_background_writes). Defaults to (0, 0), writing them
+        straight away.
+    """
+    shared_data.update(data)
+    enable_profiling(profile)
+    #Forked workers start with a copy of the records of the process that
+    #started them, which already has them, so only this process's are kept.
+    profile_records[:] = [record for record in profile_records
+                          if record["Process"] == os.getpid()]
+    start_background_writes(*background_writes)
+
+
+def run_scenario(name, function, data_argument):
+    """
+    Args:
+        name (str): name of the scenario.
+        function (Callable | list[Callable]): scenario function with every
+        argument except the shared data already given (e.g. a
+        functools.partial). A list of functions are run one after another in
+        the same process, so they can share any intermediates they have in
+        common.
+        data_argument (str): the argument name of the shared data the
+        scenario runs on.
+
+    Returns:
+        name (str): name of the scenario.
+        seconds (float): the seconds the scenario took.
+        figures (list[dict]): the figures the scenario queued, to be rendered
+        together with those of the other scenarios.
+        records (list[dict]): the profile records of the scenario, if
+        profiling is enabled.
+    """
+    start = time.perf_counter()
+    functions = function if isinstance(function, list) else [function]
+    with profile_stage(name):
+        for function in functions:
+            function(**{data_argument: shared_data[data_argument]})
+        #The scenario is only done once its outputs are written.
+        flush_writes()
+    return (name, time.perf_counter() - start, take_queued_figures(),
+            take_profile_records())
+
+
+def run_scenarios(scenarios, data, number_of_workers, timings_path=None):
+    """
+    Args:
+        scenarios (list[tuple[str, Callable, str]]): the name, function and
+        shared data argument name of each scenario (see run_scenario). Each
+        scenario must write to its own outputs.
+        data (dict[str, pd.DataFrame]): the data shared by every scenario,
+        keyed by the argument name the scenario functions take it as.
+        number_of_workers (int): number of processes to run the scenarios
+        across, up to the number of CPUs. 1 or less runs them one after another
+        in this process.
+        timings_path (Optional[Path], optional): csv file to save the time
+        each scenario took to. Defaults to None.
+
+    Returns:
+        timings (pd.DataFrame): the time each scenario took, in the order given.
+        figures (list[dict]): the figures queued by all of the scenarios.
+        Their profile records, if profiling is enabled, are added to this
+        process's.
+    """
+    timings = {}
+    figures = []
+    records = []
+    number_of_workers = min(number_of_workers, len(scenarios),
+                            os.cpu_count() or 1)
+    if number_of_workers <= 1:
+        initialise_worker(data, is_profiling_enabled(),
+                          get_background_write_settings())
+        for scenario in scenarios:
+            name, seconds, scenario_figures, scenario_records = run_scenario(
+                *scenario)
+            timings[name] = seconds
+            figures += scenario_figures
+            records += scenario_records
+            print(f"{name}: {seconds:.1f}s")
+    else:
+        with ProcessPoolExecutor(number_of_workers, initializer=initialise_worker,
+                                 initargs=(data, is_profiling_enabled(),
+                                           get_background_write_settings())
+                                 ) as executor:
+            futures = [executor.submit(run_scenario, *scenario)
+                       for scenario in scenarios]
+            for future in as_completed(futures):
+                name, seconds, scenario_figures, scenario_records = (
+                    future.result())
+                timings[name] = seconds
+                figures += scenario_figures
+                records += scenario_records
+                print(f"{name}: {seconds:.1f}s")
+
+    profile_records.extend(records)
+
+    timings = pd.DataFrame({"Scenario": [i[0] for i in scenarios],
+                            "Seconds": [timings[i[0]] for i in scenarios]})
+    if timings_path is not None:
+        timings_path.parent.mkdir(exist_ok=True, parents=True)
+        timings.to_csv(timings_path, index=False)
+    return timings, figures
@@ -0,0 +1,138 @@
+"""
+Generates synthetic raw data in the schemas of FN_Events, FN_AdmissionStatus,
+FN_Obs and FN_Diagnostics, for benchmarking the pipeline at any volume without
+patient data.
+"""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from utils import TIMESTAMP_FORMAT
+
+LOCATIONS = ["Ambulance", "Ambulatory Cubicles", "Ambulatory Waiting Area",
+             "Majors Corridor", "Majors Cubicles", "Minors", "Resus"]
+ADMISSION_STATUSES = ["Non-Admitted", "Admitted - MAU", "Admitted - SDEC",
+                      "Admitted - Other Derriford Ward"]
+#The events of a visit in order, with the probability each one happens.
+VISIT_EVENTS = [("Triaged", 1), ("Nursing Assessment", 1),
+                ("Seen By Clinician/Treated", 1), ("Clerked", 0.5),
+                ("Senior Reviewed", 0.3), ("Specialty Reviewed", 0.3),
+                ("Decision to Admit", 0.4), ("Discharged", 1),
+                ("Triaged", 0.1)]
+EVENTS_PER_VISIT = 1 + sum(probability for _, probability in VISIT_EVENTS)
+
+
+def format_times(times):
+    """
+    Args:
+        times (np.ndarray): datetime64 times.
+
+    Returns:
+        np.ndarray: the times as strings in the raw data format.
+    """
+    #Only format each distinct minute once.
+    codes, uniques = pd.factorize(times)
+    return pd.DatetimeIndex(uniques).strftime(TIMESTAMP_FORMAT).to_numpy()[codes]
+
+
+def generate_synthetic_data(number_of_events, seed=0):
+    """
+    Args:
+        number_of_events (int): number of rows of events data to generate.
+        seed (int, optional): seed of the random numbers. Defaults to 0.
+
+    Returns:
+        dict[str, pd.DataFrame]: the raw events, admission status, obs and
+        diagnostics data, keyed by file name.
+    """
+    rng = np.random.default_rng(seed)
+    #The duplicates added later take the events over the number needed, and
+    #the extra events are cut off.
+    number_of_visits = int(number_of_events / EVENTS_PER_VISIT) + 1
+    visit_ids = 100000 + np.arange(number_of_visits)
+    arrivals = (np.datetime64("2019-01-01T00:00")
+                + rng.integers(0, 60 * 24 * 365 * 3, number_of_visits)
+                .astype("timedelta64[m]"))
+    visit_locations = rng.integers(len(LOCATIONS), size=number_of_visits)
+
+    #Every visit starts with an arrival, then has each of the visit events
+    #with its probability, each some minutes after the last.
+    names = [np.where(rng.random(number_of_visits) < 0.4, "Ambulance Arrival",
+                      "Booked In")]
+    happens = [np.ones(number_of_visits, dtype=bool)]
+    for name, probability in VISIT_EVENTS:
+        names.append(np.full(number_of_visits, name))
+        happens.append(rng.random(number_of_visits) < probability)
+    names, happens = np.stack(names, axis=1), np.stack(happens, axis=1)
+    minutes = np.cumsum(rng.integers(0, 90, happens.shape), axis=1)
+    times = arrivals[:, None] + minutes.astype("timedelta64[m]")
+
+    events = pd.DataFrame({
+        "VisitId": np.repeat(visit_ids, happens.sum(axis=1)),
+        "EventName": names[happens],
+        "EventTime": times[happens],
+        "EventStaffId": rng.integers(1, 60, happens.sum()),
+        "EventLocation": np.array(LOCATIONS, dtype=object)[
+                         np.repeat(visit_locations, happens.sum(axis=1))]})
+
+    #Some locations are missing or elsewhere, and a few are dropped later.
+    other_location = rng.random(len(events))
+    events.loc[other_location < 0.21, "EventLocation"] = np.nan
+    moved = (other_location >= 0.21) & (other_location < 0.3)
+    events.loc[moved, "EventLocation"] = rng.choice(LOCATIONS, moved.sum())
+    events.loc[rng.random(len(events)) < 0.003, "EventLocation"] = "Plym"
+
+    #Add repeats of events within a few minutes, and exact duplicates.
+    repeats = events.loc[rng.random(len(events)) < 0.05].copy()
+    repeats["EventTime"] += rng.integers(0, 15, len(repeats)).astype(
+                            "timedelta64[m]")
+    repeats["EventStaffId"] = rng.integers(1, 60, len(repeats))
+    events = pd.concat([events, repeats,
+                        events.loc[rng.random(len(events)) < 0.02]])
+    events = (events.sample(frac=1, random_state=seed)
+              .iloc[:number_of_events].reset_index(drop=True))
+    first_times = events.groupby("VisitId")["EventTime"].min()
+    events["EventTime"] = format_times(events["EventTime"].to_numpy())
+
+    visit_ids = first_times.index.to_numpy()
+    admission_status = pd.DataFrame({
+        "AttendanceID": visit_ids,
+        "Adm": rng.choice(ADMISSION_STATUSES, len(visit_ids),
+                          p=[0.6, 0.2, 0.1, 0.1])})
+
+    obs_visits = rng.random(len(visit_ids)) < 0.5
+    obs = pd.DataFrame({
+        "VisitID": visit_ids[obs_visits],
+        "ChartType": "NEWS",
+        "ChartDateTime": format_times(first_times.to_numpy()[obs_visits]
+                         + rng.integers(0, 200, obs_visits.sum())
+                         .astype("timedelta64[m]"))})
+
+    diagnostics_visits = np.repeat(visit_ids[rng.random(len(visit_ids)) < 0.5],
+                                   2)
+    diagnostics = pd.DataFrame({
+        "VisitID": diagnostics_visits,
+        "Request DateTime": format_times(first_times.loc[diagnostics_visits]
+                            .to_numpy()
+                            + rng.integers(0, 30, len(diagnostics_visits))
+                            .astype("timedelta64[m]")),
+        "ItemMasterCategory": rng.choice(["Imaging", "Laboratory"],
+                                         len(diagnostics_visits))})
+
+    return {"FN_Events.csv": events,
+            "FN_AdmissionStatus.csv": admission_status,
+            "FN_Obs.csv": obs,
+            "FN_Diagnostics.csv": diagnostics}
+
+
+def write_synthetic_data(path, number_of_events, seed=0):
+    """
+    Args:
+        path (Path): folder to write the raw data csvs to.
+        number_of_events (int): number of rows of events data to generate.
+        seed (int, optional): seed of the random numbers. Defaults to 0.
+    """
+    path = Path(path)
+    path.mkdir(exist_ok=True, parents=True)
+    for filename, data in generate_synthetic_data(number_of_events,
+                                                  seed).items():
+        data.to_csv(path / filename, index=False)
@@ -1,8 +1,71 @@
 from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
 import pandas as pd
+from profiling import profiled
 
 path_to_read_data = Path(r"./Events Data")
+path_to_cache_data = path_to_read_data / ".cache"
+TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M"
 
+
+def get_packed_sort_keys(*frames):
+    """
+    Args:
+        *frames (pd.DataFrame): events dataframes with VisitId, EventTime and
+        natural_order columns.
+
+    Returns:
+        Optional[list[np.ndarray]]: for each dataframe, one int64 key per row
+        that sorts the same way as sorting on VisitId, EventTime then
+        natural_order (with missing orders last). The keys are comparable
+        across all of the dataframes. None if the columns can't be packed
+        into one int64 (e.g. missing visit ids or times).
+    """
+    visit_codes, visits = pd.factorize(np.concatenate(
+                          [frame["VisitId"].to_numpy() for frame in frames]),
+                          sort=True)
+    times = np.concatenate([frame["EventTime"].to_numpy()
+                            .astype("datetime64[ns]").view("int64")
+                            for frame in frames])
+    orders = np.concatenate([frame["natural_order"].to_numpy(dtype=float)
+                             for frame in frames])
+    if len(times) == 0:
+        return [np.zeros(0, dtype="int64") for _ in frames]
+    if (visit_codes < 0).any() or (times == np.iinfo("int64").min).any():
+        return None
+
+    #Use the coarsest time unit all of the times are a whole number of, as
+    #the times are usually to the minute.
+    times = times - times.min()
+    for unit in (60_000_000_000, 1_000_000_000, 1_000_000, 1_000, 1):
+        if not (times % unit).any():
+            times = times // unit
+            break
+
+    #Missing orders sort after all of the others.
+    missing_orders = np.isnan(orders)
+    if missing_orders.all():
+        orders = np.zeros(len(orders), dtype="int64")
+    else:
+        present_orders = orders[~missing_orders]
+        if (present_orders != np.floor(present_orders)).any():
+            return None
+        orders = np.where(missing_orders, present_orders.max() + 1, orders)
+        orders = (orders - present_orders.min()).astype("int64")
+
+    time_span = int(times.max()) + 1
+    order_span = int(orders.max()) + 1
+    if len(visits) * time_span * order_span >= np.iinfo("int64").max:
+        return None
+    keys = (visit_codes * time_span + times) * order_span + orders
+    return np.split(keys, np.cumsum([len(frame) for frame in frames])[:-1])
+
+
+@profiled
 def sort_events(events):
     """
     Args:
@@ -11,16 +74,358 @@ def sort_events(events):
     Returns:
         pd.DataFrame: sorted clensed events dataframe.
     """
-    events = events.sort_values(by=["VisitId", "EventTime", "natural_order"])
-    return events
+    keys = get_packed_sort_keys(events)
+    if keys is None:
+        return events.sort_values(by=["VisitId", "EventTime", "natural_order"])
+    return events.iloc[np.argsort(keys[0], kind="stable")]
+
+
+@profiled
+def insert_events_in_order(events, new_events):
+    """
+    Args:
+        events (pd.DataFrame): clensed events dataframe, sorted by sort_events.
+        new_events (pd.DataFrame): events to add to the dataframe.
+
+    Returns:
+        pd.DataFrame: sorted clensed events dataframe with the new events
+        added. This is the same as concatenating the dataframes and sorting
+        them with sort_events, but only the new events need sorting.
+    """
+    if len(new_events) == 0:
+        return events
+    keys = get_packed_sort_keys(events, new_events)
+    if keys is None or (np.diff(keys[0]) < 0).any():
+        return sort_events(pd.concat([events, new_events]))
+    keys, new_keys = keys
+
+    #Find where each new event goes, after any events with the same key as
+    #a stable sort would put them.
+    new_order = np.argsort(new_keys, kind="stable")
+    new_positions = (np.searchsorted(keys, new_keys[new_order], side="right")
+                     + np.arange(len(new_keys)))
+    take = np.empty(len(keys) + len(new_keys), dtype=np.intp)
+    is_new = np.zeros(len(take), dtype=bool)
+    is_new[new_positions] = True
+    take[new_positions] = len(keys) + new_order
+    take[~is_new] = np.arange(len(keys))
+    return pd.concat([events, new_events]).iloc[take]
+
+
+def get_sort_codes(values):
+    """
+    Args:
+        values (pd.Series): column to sort on.
+
+    Returns:
+        codes (np.ndarray): int64 code of each value, in the order sort_values
+        sorts the values, with missing values coded last.
+        missing (np.ndarray): mask of the missing values.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy().astype("int64")
+        number_of_values = len(values.cat.categories)
+    else:
+        codes, uniques = pd.factorize(values, sort=True)
+        codes = codes.astype("int64")
+        number_of_values = len(uniques)
+    missing = codes < 0
+    codes[missing] = number_of_values
+    return codes, missing
+
+
+@profiled
+def find_duplicates_within_window(data, key_columns, window, match_columns=(),
+                                  exact_columns=None):
+    """
+    Args:
+        data (pd.DataFrame): dataframe with an EventTime column.
+        key_columns (list[str]): columns of the groups whose rows are compared.
+        Rows missing any of them are never duplicates within the window.
+        window (pd.Timedelta): rows less than this after the previous row of
+        their group are duplicates.
+        match_columns (list[str], optional): columns a row must also share
+        with the previous row to be a duplicate. Defaults to ().
+        exact_columns (Optional[list[str]], optional): columns that, with the
+        key columns and EventTime, make a row a duplicate of any earlier row
+        equal in all of them, missing values included, as drop_duplicates
+        does. Defaults to None.
+
+    Returns:
+        order (np.ndarray): positions of the rows sorted by the key columns
+        then EventTime, with ties in their original order.
+        duplicated (np.ndarray): mask of the sorted rows that are duplicates.
+    """
+    exact_columns = [] if exact_columns is None else exact_columns
+    codes = {column: get_sort_codes(data[column])
+             for column in dict.fromkeys([*key_columns, *match_columns,
+                                          *exact_columns])}
+    times = data["EventTime"].to_numpy(dtype="datetime64[ns]").view("int64")
+    missing_times = times == np.iinfo("int64").min
+
+    #One sort puts each group's rows next to each other in time order, then
+    #every row is only compared with the row before it.
+    order = np.lexsort([np.where(missing_times, np.iinfo("int64").max, times)]
+                       + [codes[column][0] for column in key_columns[::-1]])
+    times, missing_times = times[order], missing_times[order]
+    codes = {column: (column_codes[order], missing[order])
+             for column, (column_codes, missing) in codes.items()}
+
+    def same_as_previous(columns):
+        """
+        Args:
+            columns (list[str]): columns to compare.
+
+        Returns:
+            np.ndarray: mask of the sorted rows, after the first, equal to the
+            previous row in every column, missing values included.
+        """
+        same = np.ones(len(order) - 1 if len(order) else 0, dtype=bool)
+        for column in columns:
+            column_codes = codes[column][0]
+            same &= column_codes[1:] == column_codes[:-1]
+        return same
+
+    within_window = (same_as_previous([*key_columns, *match_columns])
+                     & ~missing_times[1:] & ~missing_times[:-1]
+                     & (times[1:] - times[:-1] < pd.Timedelta(window).value))
+    for column in [*key_columns, *match_columns]:
+        within_window &= ~codes[column][1][1:]
+    duplicated = np.zeros(len(order), dtype=bool)
+    duplicated[1:] = within_window
+    if exact_columns:
+        #Exact duplicates are in the same run of rows tied on the keys and
+        #time, so only rows in runs of more than one are checked.
+        tied = (same_as_previous(key_columns) & (times[1:] == times[:-1])
+                & (missing_times[1:] == missing_times[:-1]))
+        in_run = np.zeros(len(order), dtype=bool)
+        in_run[1:] |= tied
+        in_run[:-1] |= tied
+        run_rows = np.flatnonzero(in_run)
+        run_codes = pd.DataFrame({column: codes[column][0][run_rows]
+                                  for column in [*key_columns,
+                                                 *exact_columns]})
+        run_codes["EventTime"] = times[run_rows]
+        duplicated[run_rows[run_codes.duplicated().to_numpy()]] = True
+    return order, duplicated
+
+
+def get_source_fingerprint(source, hash_source=False):
+    """
+    Args:
+        source (Path): path of the raw data file.
+        hash_source (bool): flag to include a hash of the file contents, which
+        catches edits that keep the size and modification time unchanged.
+
+    Returns:
+        dict: size, modification time and (optionally) content hash of the
+        file.
+    """
+    stat = source.stat()
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if hash_source:
+        digest = hashlib.sha1()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        fingerprint["sha1"] = digest.hexdigest()
+    return fingerprint
+
+
+def parse_fixed_width_timestamps(strings):
+    """
+    Args:
+        strings (np.ndarray): strings to parse.
+
+    Returns:
+        Optional[np.ndarray]: the strings as datetime64[ns], or None if any of
+        them aren't a valid dd/mm/YYYY HH:MM timestamp.
+    """
+    if (pd.api.types.infer_dtype(strings, skipna=False) != "string"
+            or (np.char.str_len(strings.astype(str)) != 16).any()):
+        return None
+    #Read the digits straight from the characters of each string.
+    characters = strings.astype("U16").view(np.uint32).reshape(-1, 16)
+    separators = characters[:, [2, 5, 10, 13]]
+    digits = characters[:, [0, 1, 3, 4, 6, 7, 8, 9, 11, 12, 14, 15]].astype(
+             np.int64) - ord("0")
+    if ((separators != np.array([ord("/"), ord("/"), ord(" "), ord(":")],
+                                dtype=np.uint32)).any()
+            or (digits < 0).any() or (digits > 9).any()):
+        return None
+    day, month = digits[:, 0] * 10 + digits[:, 1], digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4:8] @ np.array([1000, 100, 10, 1])
+    hour, minute = digits[:, 8] * 10 + digits[:, 9], digits[:, 10] * 10 + digits[:, 11]
+
+    months = ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+    days = months.astype("datetime64[D]") + (day - 1)
+    #Days past the end of the month would roll into the next one.
+    if not ((month >= 1) & (month <= 12) & (day >= 1) & (hour < 24)
+            & (minute < 60) & (days.astype("datetime64[M]") == months)).all():
+        return None
+    return (days.astype("datetime64[m]") + (hour * 60 + minute)).astype(
+           "datetime64[ns]")
+
+
+def parse_timestamps(values, timestamp_format=TIMESTAMP_FORMAT):
+    """
+    Args:
+        values (pd.Series): timestamps as strings, or already parsed.
+        timestamp_format (str, optional): format of the timestamps. Defaults to
+        TIMESTAMP_FORMAT.
+
+    Returns:
+        pd.Series: the timestamps as datetime64. Already parsed values are
+        returned unchanged.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    #Timestamps are to the minute, so parse each distinct string only once.
+    codes, uniques = pd.factorize(values)
+    uniques = np.asarray(uniques, dtype=object)
+    parsed = None
+    if timestamp_format == TIMESTAMP_FORMAT:
+        parsed = parse_fixed_width_timestamps(uniques)
+    if parsed is None:
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=object),
+                                format=timestamp_format).to_numpy()
+    parsed = np.append(parsed, np.datetime64("NaT", "ns"))
+    return pd.Series(parsed[codes], index=values.index, name=values.name)
 
 
-def load_data(filename):
+def parse_datetime_columns(data, datetime_columns):
+    """
+    Args:
+        data (pd.DataFrame): raw data frame.
+        datetime_columns (list[str]): columns holding dd/mm/YYYY HH:MM
+        timestamps.
+
+    Returns:
+        pd.DataFrame: data frame with the timestamp columns as datetime64.
+    """
+    for column in datetime_columns:
+        if column in data.columns:
+            data[column] = parse_timestamps(data[column])
+    return data
+
+
+@profiled
+def load_data(filename, datetime_columns=None, use_cache=False,
+              hash_source=False):
     """
     Args:
         filename (str): filename of the data to read in.
+        datetime_columns (Optional[list[str]]): timestamp columns to parse to
+        datetime64 on read. Defaults to None.
+        use_cache (bool): flag to keep a typed parquet copy of the file in
+        the cache folder, so later runs skip parsing the csv. The cache is
+        rebuilt whenever the source file changes. Defaults to False.
+        hash_source (bool): flag to also key the cache on a hash of the file
+        contents rather than just its size and modification time. Defaults
+        to False.
 
     Returns:
         pd.DataFrame: a dataframe of that read in data.
     """
-    return pd.read_csv(f"{path_to_read_data}/{filename}")
+    source = path_to_read_data / filename
+    datetime_columns = list(datetime_columns or [])
+    if not use_cache:
+        return parse_datetime_columns(pd.read_csv(source), datetime_columns)
+
+    #The cache is valid if it was built from this exact version of the source
+    #file with the same timestamp columns parsed.
+    key = {"source": get_source_fingerprint(source, hash_source),
+           "datetime_columns": datetime_columns,
+           "format": TIMESTAMP_FORMAT}
+    cache_file = path_to_cache_data / f"{source.stem}.parquet"
+    key_file = path_to_cache_data / f"{source.stem}.json"
+    if cache_file.exists() and key_file.exists():
+        with open(key_file, encoding="utf-8") as f:
+            if json.load(f) == key:
+                try:
+                    return pd.read_parquet(cache_file)
+                except (ImportError, OSError, ValueError):
+                    pass
+
+    data = parse_datetime_columns(pd.read_csv(source), datetime_columns)
+
+    #Write the cache. Strings are dictionary encoded in the parquet file and
+    #timestamps are stored already typed. If pyarrow isn't installed or the
+    #data can't be stored (e.g. mixed type columns), just return the data.
+    path_to_cache_data.mkdir(exist_ok=True, parents=True)
+    temp_file = cache_file.with_suffix(".tmp")
+    try:
+        data.to_parquet(temp_file, index=False, use_dictionary=True,
+                        compression="zstd")
+    except (ImportError, TypeError, ValueError):
+        temp_file.unlink(missing_ok=True)
+        return data
+    os.replace(temp_file, cache_file)
+    with open(key_file, "w", encoding="utf-8") as f:
+        json.dump(key, f)
+    return data
+
+
+@profiled
+def partition_data_by_visit(filename, partition_path, number_of_partitions,
+                            chunksize, visit_column="VisitId"):
+    """
+    Args:
+        filename (str): filename of the data to partition.
+        partition_path (Path): folder to write the partition files to.
+        number_of_partitions (int): number of partitions to split visits into.
+        chunksize (int): number of rows to read from the file at a time.
+        visit_column (str): column of visit ids to partition on.
+        Defaults to "VisitId".
+
+    Returns:
+        list[Path]: filepaths of the partitions that have data. Every row of a
+        visit is in the same partition.
+    """
+    partition_path = Path(partition_path)
+    partition_path.mkdir(exist_ok=True, parents=True)
+    partition_files = [partition_path / f"partition_{i}.csv"
+                       for i in range(number_of_partitions)]
+    written = set()
+    #Read the rows as text, so the same visit id always hashes to the same
+    #partition regardless of which chunk it is in, and the partition files
+    #are written back exactly as they were read.
+    for chunk in pd.read_csv(path_to_read_data / filename, chunksize=chunksize,
+                             dtype=str, keep_default_na=False):
+        partitions = (pd.util.hash_pandas_object(chunk[visit_column],
+                                                 index=False).to_numpy()
+                      % number_of_partitions)
+        for partition, rows in chunk.groupby(partitions):
+            rows.to_csv(partition_files[partition], mode="a", index=False,
+                        header=partition not in written)
+            written.add(partition)
+    return [partition_files[i] for i in sorted(written)]
+
+
+def remove_output(filepath):
+    """
+    Args:
+        filepath (Path): file or partitioned folder to remove if it exists.
+    """
+    if filepath.is_dir():
+        shutil.rmtree(filepath)
+    else:
+        filepath.unlink(missing_ok=True)
+
+
+def link_or_copy(original, filepath):
+    """
+    Args:
+        original (Path): existing file, or folder of files.
+        filepath (Path): file or folder to make with the same contents.
+    """
+    remove_output(filepath)
+    if original.is_dir():
+        filepath.mkdir(parents=True)
+        for child in original.iterdir():
+            link_or_copy(child, filepath / child.name)
+        return
+    try:
+        os.link(original, filepath)
+    except OSError:
+        shutil.copyfile(original, filepath)
@@ -1,286 +1,475 @@
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import hashlib
 import os
+import pandas as pd
 
-def print_and_add_str(output_str, added_str):
-    print(added_str)
+#Default scenario to validate when no folders are given.
+scenario_filepath = 'G:/PerfInfo/Performance Management/PIT Adhocs/2024-2025/HannahP 2425/UEC Adhocs/Frazer Nash UEC/Baseline with resources'
+
+#The simulation input files of a scenario, keyed by the name they are passed
+#to validate_scenario as, with the suffix added to their column names.
+VALIDATION_FILES = {
+    'Simulation Settings': ('Simulation Settings.csv', ''),
+    'Process Resource Requirement': ('Process Resource Requirement.csv', ' Res Req'),
+    'Resource Rota': ('Resource Rota.csv', ' Res Rota'),
+    'Process Locations': ('Process Locations.csv', ' Proc Loc'),
+    'Location Capacities': ('Location Capacities.csv', ' Loc Cap'),
+    'Location Opening Hours': ('Location Opening Hours.csv', ' Loc Open'),
+    'Process Recurrence Triggers': ('Process Recurrence Triggers.csv', ' Rec Trig'),
+    'Process Recurrence': ('Process Recurrence.csv', ' Pro Rec'),
+    'Process Durations': ('Process Durations.csv', ' Proc Dur'),
+    'Process Wait in Place': ('Process Wait in Place.csv', ' Proc Wait'),
+    'Arrival Rates': ('Arrival Rates.csv', ' Arr Rat'),
+    'Pathway Definition': ('Pathway Definition.csv', ' Path Def')}
+
+def add_str(output_str, added_str):
     return output_str + added_str + '\n'
 
-def print_missing(def_str, list, output_str):
+def add_missing(def_str, list, output_str):
     if list:
-        output_str = print_and_add_str(output_str, def_str)
+        output_str = add_str(output_str, def_str)
         for i in list:
-            output_str = print_and_add_str(output_str, i)
+            output_str = add_str(output_str, i)
     return output_str
 
-output_text = ''
-scenario_filepath = 'G:/PerfInfo/Performance Management/PIT Adhocs/2024-2025/HannahP 2425/UEC Adhocs/Frazer Nash UEC/Baseline with resources'
-outputs_filepath = 'G:/PerfInfo/Performance Management/PIT Adhocs/2024-2025/HannahP 2425/UEC Adhocs/Frazer Nash UEC/Baseline with resources'
-os.chdir(scenario_filepath)
-
-arrival_rates = pd.read_csv('Arrival Rates.csv')
-simulation_settings = pd.read_csv('Simulation Settings.csv')
-output_text = print_and_add_str(output_text, simulation_settings.to_string())
-
-##################################RESOURCES#####################################
-#read in resource csvs
-resource_requirement = pd.read_csv('Process Resource Requirement.csv').add_suffix(' Res Req')
-resource_rota = pd.read_csv('Resource Rota.csv').add_suffix(' Res Rota')
-
-#Split up resource requirement column to break up the different staff members
-#being used for each task.  Explode this so one row per staff member, and split
-#up the staff memeber name and the number of that staff required.
-resource_requirement['Requirement Res Req'] = (resource_requirement['Requirement Res Req']
-                                       .str.split(', '))
-resource_requirement = resource_requirement.explode(column='Requirement Res Req')
-resource_requirement[['Number of Resource Res Req',
-                      'Requirement Res Req']] = (resource_requirement['Requirement Res Req']
-                                         .str.split(r'(?<=\d)\s', regex=True,
-                                                    expand=True))
-
-#merge this onto the resource rota
-resources = (resource_requirement.merge(resource_rota,
-                                        left_on='Requirement Res Req', 
-                                        right_on='Resource Type Res Rota',
-                                        how='outer'))
-
-output_text = print_and_add_str(output_text, '-----------------RESOURCES-----------------')
-#print the staff that aren't in use
-unused_staff = resources.loc[resources['Requirement Res Req'].isna(),
-                        'Resource Type Res Rota'].drop_duplicates().dropna().to_list()
-output_text = print_missing('--Unused staff in Resource Rota are:', unused_staff, output_text)
-
-#print the staff that aren't scheduled
-unscheduled_staff = resources.loc[resources['Resource Type Res Rota'].isna(),
-                            'Requirement Res Req'].drop_duplicates().dropna().to_list()
-output_text = print_missing("--Staff required to complete processess that aren't in the rota:",
-              unscheduled_staff, output_text)
-
-##################################LOCATIONS#####################################
-#read in location csvs
-process_locations = pd.read_csv('Process Locations.csv').add_suffix(' Proc Loc')
-location_capacities = pd.read_csv('Location Capacities.csv').add_suffix(' Loc Cap')
-location_opening_hours = pd.read_csv('Location Opening Hours.csv').add_suffix(' Loc Open')
-
-#merge into one locations df
-locations = (process_locations.merge(location_capacities,
-                                     left_on='Location Proc Loc',
-                                     right_on='Location Loc Cap',
-                                     how='outer')
-                              .merge(location_opening_hours,
-                                       left_on='Location Loc Cap',
-                                       right_on='Location Loc Open',
-                                       how='outer'))
-
-output_text = print_and_add_str(output_text, '-----------------LOCATIONS-----------------')
-#Print the process locations with capacities missing
-proc_loc_no_cap = (locations.loc[locations['Location Loc Cap'].isna(),
-                                 'Location Proc Loc'].drop_duplicates()
-                                 .dropna().to_list())
-output_text = print_missing('--Process locations with missing location capacities:',
-              proc_loc_no_cap, output_text)
-#Print location capacities that don't match process locations
-cap_no_proc_loc = (locations.loc[locations['Location Proc Loc'].isna(),
-                                 'Location Loc Cap'].drop_duplicates()
-                                 .dropna().to_list())
-output_text = print_missing("--Locations with capacities that don't match to a process location:",
-              cap_no_proc_loc, output_text)
-
-#Print the locations that don't have opening hours
-no_open_hours = locations.loc[locations['Location Loc Open'].isna(),
-                    'Location Proc Loc'].drop_duplicates().dropna().to_list()
-output_text = print_missing("--Locations that don't have opening hours set:", no_open_hours, output_text)
-
-#print the locations that have opening hours but no capacity
-no_capacity = locations.loc[locations['Location Proc Loc'].isna(),
-                    'Location Loc Open'].drop_duplicates().dropna().to_list()
-output_text = print_missing("--Locations that don't have capacity data:", no_capacity, output_text)
-
-
-
-#############################RECURRENT PROCESSES################################
-#read in csvs
-process_recurrence_triggers = pd.read_csv('Process Recurrence Triggers.csv').add_suffix(' Rec Trig')
-process_recurrence = pd.read_csv('Process Recurrence.csv').add_suffix(' Pro Rec')
-#merge into one df
-recurrence = (process_recurrence_triggers.merge(process_recurrence,
-              left_on='Recurrent Process (Not In Pathway) Rec Trig', 
-              right_on='Recurrent Process Pro Rec', how='outer'))
-
-output_text = print_and_add_str(output_text, '---------------RECURRENT PROCESSES---------------')
-output_text = print_and_add_str(output_text, 'NOTE: This only checks matches between the two recurrent process files.')
-output_text = print_and_add_str(output_text, '      Comparison to pathway file done later.')
-#Print the process in pathway that doesn't match to a recurrent process
-no_rec_proc = (recurrence.loc[recurrence['Recurrent Process Pro Rec'].isna(),
-                              'Recurrent Process (Not In Pathway) Rec Trig']
-                              .drop_duplicates().dropna().to_list())
-output_text = print_missing('--Process in pathway trigger without matching recurrent processes:',
-              no_rec_proc, output_text)
-
-#Print recurrent processes that don't match to the pathway process
-no_path_proc = (recurrence.loc[
-                recurrence['Recurrent Process (Not In Pathway) Rec Trig'].isna(),
-                'Recurrent Process Pro Rec'].drop_duplicates().dropna().to_list())
-output_text = print_missing('--Process in processes recurrence but not in trigger file:',
-              no_path_proc, output_text)
-
-##################################PROCESSES#####################################
-#read in csvs
-process_durations = pd.read_csv('Process Durations.csv').add_suffix(' Proc Dur')
-process_wait_in_place = pd.read_csv('Process Wait in Place.csv').add_suffix(' Proc Wait')
-arrival_rates = pd.read_csv('Arrival Rates.csv').add_suffix(' Arr Rat')
-
-#merge into one df
-processes = (process_durations.merge(process_wait_in_place,
-                                      left_on='Process (Pathway and Recurrent) Proc Dur',
-                                      right_on='Processes which Wait in Place (Pathway or Recurrent) Proc Wait',
+def get_names(column):
+    #Set of the distinct names in a column, so each check is a set lookup
+    #rather than a merge.
+    return set(column.dropna())
+
+def missing_from(names, other_names):
+    #Names that aren't in the other set (an anti join), in sorted order.
+    return sorted(names - other_names, key=str)
+
+def get_file_hash(filepath):
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_scenario_inputs(folder, file_cache=None):
+    """
+    Args:
+        folder (Path): scenario folder with the simulation input csvs.
+        file_cache (Optional[dict[str, pd.DataFrame]], optional): dataframes
+        already read, keyed by a hash of the file contents. Files with the
+        same contents as one already read aren't read again. Defaults to None.
+
+    Returns:
+        dict[str, pd.DataFrame]: the input dataframes, keyed as in
+        VALIDATION_FILES.
+    """
+    file_cache = {} if file_cache is None else file_cache
+    inputs = {}
+    for name, (filename, _) in VALIDATION_FILES.items():
+        file_hash = get_file_hash(Path(folder) / filename)
+        if file_hash not in file_cache:
+            file_cache[file_hash] = pd.read_csv(Path(folder) / filename)
+        inputs[name] = file_cache[file_hash]
+    return inputs
+
+def read_shared_inputs(folders, number_of_workers=4):
+    """
+    Args:
+        folders (list[Path]): scenario folders with the simulation input csvs.
+        number_of_workers (int, optional): number of threads to read the
+        files across. Defaults to 4.
+
+    Returns:
+        list[dict[str, pd.DataFrame]]: the input dataframes of each folder.
+        Each distinct file is read once, and shared by every folder it is in.
+    """
+    file_hashes = [{name: get_file_hash(Path(folder) / filename)
+                    for name, (filename, _) in VALIDATION_FILES.items()}
+                   for folder in folders]
+    to_read = {}
+    for folder, hashes in zip(folders, file_hashes):
+        for name, file_hash in hashes.items():
+            to_read.setdefault(file_hash,
+                               Path(folder) / VALIDATION_FILES[name][0])
+    with ThreadPoolExecutor(max(1, number_of_workers)) as executor:
+        file_cache = dict(zip(to_read, executor.map(pd.read_csv,
+                                                    to_read.values())))
+    return [{name: file_cache[file_hash] for name, file_hash in hashes.items()}
+            for hashes in file_hashes]
+
+def validate_scenario(inputs, export_combined_pathway_validation=False):
+    """
+    Args:
+        inputs (Path | dict[str, pd.DataFrame]): scenario folder with the
+        simulation input csvs, or the input dataframes keyed as in
+        VALIDATION_FILES.
+        export_combined_pathway_validation (bool, optional): flag to also
+        return the full merge of the pathway definition with every other
+        table. This multiplies out each process's staff and locations, so is
+        slow and large on big input sets, and isn't needed for the checks.
+        Defaults to False.
+
+    Returns:
+        output_text (str): the validation report.
+        tables (dict[str, pd.DataFrame]): the merged tables to export, keyed
+        by file name.
+        issues (dict[str, list]): the names found by each check, keyed by the
+        check.
+    """
+    if not isinstance(inputs, dict):
+        inputs = read_scenario_inputs(inputs)
+    inputs = {name: data.add_suffix(VALIDATION_FILES[name][1])
+              for name, data in inputs.items()}
+    output_text = ''
+    issues = {}
+
+    def add_check(def_str, names, output_text, section=''):
+        issues[f'{section}{def_str.strip("-:")}'] = names
+        return add_missing(def_str, names, output_text)
+
+    output_text = add_str(output_text, inputs['Simulation Settings'].to_string())
+
+    ##################################RESOURCES#####################################
+    resource_requirement = inputs['Process Resource Requirement']
+    resource_rota = inputs['Resource Rota']
+
+    #Split up resource requirement column to break up the different staff members
+    #being used for each task.  Explode this so one row per staff member, and split
+    #up the staff memeber name and the number of that staff required.
+    resource_requirement['Requirement Res Req'] = (resource_requirement['Requirement Res Req']
+                                           .str.split(', '))
+    resource_requirement = resource_requirement.explode(column='Requirement Res Req')
+    resource_requirement[['Number of Resource Res Req',
+                          'Requirement Res Req']] = (resource_requirement['Requirement Res Req']
+                                             .str.split(r'(?<=\d)\s', regex=True,
+                                                        expand=True))
+
+    #merge this onto the resource rota
+    resources = (resource_requirement.merge(resource_rota,
+                                            left_on='Requirement Res Req',
+                                            right_on='Resource Type Res Rota',
+                                            how='outer'))
+
+    output_text = add_str(output_text, '-----------------RESOURCES-----------------')
+    required_staff = get_names(resource_requirement['Requirement Res Req'])
+    rota_staff = get_names(resource_rota['Resource Type Res Rota'])
+    #print the staff that aren't in use
+    unused_staff = missing_from(rota_staff, required_staff)
+    output_text = add_check('--Unused staff in Resource Rota are:', unused_staff, output_text)
+
+    #print the staff that aren't scheduled
+    unscheduled_staff = missing_from(required_staff, rota_staff)
+    output_text = add_check("--Staff required to complete processess that aren't in the rota:",
+                  unscheduled_staff, output_text)
+
+    ##################################LOCATIONS#####################################
+    process_locations = inputs['Process Locations']
+    location_capacities = inputs['Location Capacities']
+    location_opening_hours = inputs['Location Opening Hours']
+
+    #merge into one locations df
+    locations = (process_locations.merge(location_capacities,
+                                         left_on='Location Proc Loc',
+                                         right_on='Location Loc Cap',
+                                         how='outer')
+                                  .merge(location_opening_hours,
+                                           left_on='Location Loc Cap',
+                                           right_on='Location Loc Open',
+                                           how='outer'))
+
+    output_text = add_str(output_text, '-----------------LOCATIONS-----------------')
+    process_location_names = get_names(process_locations['Location Proc Loc'])
+    capacity_locations = get_names(location_capacities['Location Loc Cap'])
+    opening_locations = get_names(location_opening_hours['Location Loc Open'])
+    #Print the process locations with capacities missing
+    proc_loc_no_cap = missing_from(process_location_names, capacity_locations)
+    output_text = add_check('--Process locations with missing location capacities:',
+                  proc_loc_no_cap, output_text)
+    #Print location capacities that don't match process locations
+    cap_no_proc_loc = missing_from(capacity_locations, process_location_names)
+    output_text = add_check("--Locations with capacities that don't match to a process location:",
+                  cap_no_proc_loc, output_text)
+
+    #Print the locations that don't have opening hours. Opening hours are matched
+    #through the location capacities, so locations without a capacity are
+    #included.
+    no_open_hours = missing_from(process_location_names,
+                                 capacity_locations & opening_locations)
+    output_text = add_check("--Locations that don't have opening hours set:", no_open_hours, output_text)
+
+    #print the locations that have opening hours but no capacity, or whose
+    #capacity doesn't match a process location.
+    no_capacity = sorted((opening_locations - capacity_locations)
+                         | ((capacity_locations - process_location_names)
+                            & opening_locations), key=str)
+    output_text = add_check("--Locations that don't have capacity data:", no_capacity, output_text)
+
+
+
+    #############################RECURRENT PROCESSES################################
+    process_recurrence_triggers = inputs['Process Recurrence Triggers']
+    process_recurrence = inputs['Process Recurrence']
+    #merge into one df
+    recurrence = (process_recurrence_triggers.merge(process_recurrence,
+                  left_on='Recurrent Process (Not In Pathway) Rec Trig',
+                  right_on='Recurrent Process Pro Rec', how='outer'))
+
+    output_text = add_str(output_text, '---------------RECURRENT PROCESSES---------------')
+    output_text = add_str(output_text, 'NOTE: This only checks matches between the two recurrent process files.')
+    output_text = add_str(output_text, '      Comparison to pathway file done later.')
+    triggered_processes = get_names(
+        process_recurrence_triggers['Recurrent Process (Not In Pathway) Rec Trig'])
+    recurrent_processes = get_names(process_recurrence['Recurrent Process Pro Rec'])
+    #Print the process in pathway that doesn't match to a recurrent process
+    no_rec_proc = missing_from(triggered_processes, recurrent_processes)
+    output_text = add_check('--Process in pathway trigger without matching recurrent processes:',
+                  no_rec_proc, output_text)
+
+    #Print recurrent processes that don't match to the pathway process
+    no_path_proc = missing_from(recurrent_processes, triggered_processes)
+    output_text = add_check('--Process in processes recurrence but not in trigger file:',
+                  no_path_proc, output_text)
+
+    ##################################PROCESSES#####################################
+    process_durations = inputs['Process Durations']
+    process_wait_in_place = inputs['Process Wait in Place']
+    arrival_rates = inputs['Arrival Rates']
+
+    #merge into one df
+    processes = (process_durations.merge(process_wait_in_place,
+                                          left_on='Process (Pathway and Recurrent) Proc Dur',
+                                          right_on='Processes which Wait in Place (Pathway or Recurrent) Proc Wait',
+                                          how='outer')
+                                  .merge(arrival_rates, left_on='Process (Pathway and Recurrent) Proc Dur',
+                                         right_on='InitialProcess Arr Rat', how='outer'))
+
+    duration_processes = get_names(
+        process_durations['Process (Pathway and Recurrent) Proc Dur'])
+    wait_in_place_processes = get_names(
+        process_wait_in_place['Processes which Wait in Place (Pathway or Recurrent) Proc Wait'])
+    arrival_processes = get_names(arrival_rates['InitialProcess Arr Rat'])
+    #Print the processess in the durations file that aren't in the locations file
+    output_text = add_str(output_text, '---------------PROCESSES DURATIONS AND WIP---------------')
+    #Print the processess in the durations file that don't match wait in place
+    no_wip = missing_from(duration_processes, wait_in_place_processes)
+    output_text = add_check("--Process Durations that aren't Wait in Place (No Issue):", no_wip, output_text)
+
+    #Print the processes in the Wait in Place file which don't match the durations
+    #file
+    wip_no_dur = missing_from(wait_in_place_processes, duration_processes)
+    output_text = add_check("--Wait in Place processes that don't match the Process Durations:",
+                  wip_no_dur, output_text)
+
+    #Print the arrival processes that don't map to a duration process
+    arr_proc_no_dur = missing_from(arrival_processes, duration_processes)
+    output_text = add_check("--Arrival processes that don't match the Process Durations:",
+                  arr_proc_no_dur, output_text)
+
+
+
+    ##############################PATHWAY DEFINITION################################
+    output_text = add_str(output_text, '------------------------------------------------------')
+    output_text = add_str(output_text, '------------MERGING ON PATHWAY DEFINITIONS------------')
+    output_text = add_str(output_text, '------------------------------------------------------')
+    output_text = add_str(output_text, ' ')
+    pathway_definition = inputs['Pathway Definition']
+
+    #Names of the processes in each table the pathway processes are checked
+    #against.
+    recurrence_trigger_processes = get_names(
+        process_recurrence_triggers['Trigger Process (In Pathway) Rec Trig'])
+    resource_processes = get_names(
+        resource_requirement['Process (Pathway or Recurrent) Res Req'])
+    location_processes = get_names(process_locations['Process Proc Loc'])
+
+    def pathway_def_check(pathway_def, from_or_to, output_text):
+        output_text = add_str(output_text, f'------------{from_or_to} PROCESSES------------')
+        output_text = add_str(output_text, ' ')
+        pathway_processes = get_names(pathway_def[f'{from_or_to} Process Path Def'])
+        section = f'{from_or_to} '
+
+        output_text = add_str(output_text, '---------------PROCESSES DURATIONS---------------')
+        #print processess in the pathway that are missing durations
+        proc_no_dur = missing_from(pathway_processes, duration_processes)
+        output_text = add_check('--Pathway Processes with missing durations:', proc_no_dur, output_text, section)
+        #Print durations that aren't in pathway processes
+        dur_no_proc = missing_from(duration_processes, pathway_processes)
+        output_text = add_check('--Process durations not in pathway definition:', dur_no_proc, output_text, section)
+
+
+        output_text = add_str(output_text, '---------------RECURRENT PROCESSES---------------')
+        #print recurrent processes that aren't in the pathway definitions.
+        missing_rec = missing_from(recurrence_trigger_processes, pathway_processes)
+        output_text = add_check('--Recurrent Processes missing from pathway:', missing_rec, output_text, section)
+
+        output_text = add_str(output_text, '---------------RESOURCES---------------')
+        #Print processes in the pathway that don't have resources
+        path_no_res = missing_from(pathway_processes, resource_processes)
+        output_text = add_check("--Pathway processes with no staff requirements:", path_no_res, output_text, section)
+        #Print resource processes which aren't in the pathway definition
+        res_no_path = missing_from(resource_processes, pathway_processes)
+        output_text = add_check("--Resource processes that are missing from the pathway definition:",
+                      res_no_path, output_text, section)
+
+        output_text = add_str(output_text, '---------------LOCATIONS---------------')
+        #Get the pathway definitions that are missing process locations
+        path_no_proc_loc = missing_from(pathway_processes, location_processes)
+        output_text = add_check("--Pathway processes that don't match with a process location:",
+                      path_no_proc_loc, output_text, section)
+        #print the processes locations that aren't in pathway definition
+        proc_loc_no_path = missing_from(location_processes, pathway_processes)
+        output_text = add_check('--Process Locations that are missing from the pathway definition:',
+                      proc_loc_no_path, output_text, section)
+
+        return output_text
+
+    def pathway_def_merge(pathway_def, from_or_to):
+        ####Merge onto other dataframes, for the combined validation export
+        pathway_proc_col = f'{from_or_to} Process Path Def'
+        pathway_def = (pathway_def.merge(processes, left_on=pathway_proc_col,
+                                      right_on='Process (Pathway and Recurrent) Proc Dur',
                                       how='outer')
-                              .merge(arrival_rates, left_on='Process (Pathway and Recurrent) Proc Dur',
-                                     right_on='InitialProcess Arr Rat', how='outer'))
-
-#Print the processess in the durations file that aren't in the locations file
-output_text = print_and_add_str(output_text, '---------------PROCESSES DURATIONS AND WIP---------------')
-#Print the processess in the durations file that don't match wait in place
-no_wip = (processes
-          .loc[processes['Processes which Wait in Place (Pathway or Recurrent) Proc Wait'].isna(),
-               'Process (Pathway and Recurrent) Proc Dur']
-               .drop_duplicates().dropna().to_list())
-output_text = print_missing("--Process Durations that aren't Wait in Place (No Issue):", no_wip, output_text)
-
-#Print the processes in the Wait in Place file which don't match the durations
-#file
-wip_no_dur = (processes.loc[processes['Process (Pathway and Recurrent) Proc Dur'].isna(),
-                            'Processes which Wait in Place (Pathway or Recurrent) Proc Wait']
-                            .drop_duplicates().dropna().to_list())
-output_text = print_missing("--Wait in Place processes that don't match the Process Durations:",
-              wip_no_dur, output_text)
-
-#Print the arrival processes that don't map to a duration process
-arr_proc_no_dur = (processes.loc[(processes['Process (Pathway and Recurrent) Proc Dur'].isna())
-                                 & ~(processes['InitialProcess Arr Rat'].isna()),
-                                 'InitialProcess Arr Rat']
-                                 .drop_duplicates().dropna().to_list())
-output_text = print_missing("--Arrival processes that don't match the Process Durations:",
-              arr_proc_no_dur, output_text)
-
-
-
-##############################PATHWAY DEFINITION################################
-#read in csv
-output_text = print_and_add_str(output_text, '------------------------------------------------------')
-output_text = print_and_add_str(output_text, '------------MERGING ON PATHWAY DEFINITIONS------------')
-output_text = print_and_add_str(output_text, '------------------------------------------------------')
-output_text = print_and_add_str(output_text, ' ')
-pathway_definition = pd.read_csv('Pathway Definition.csv').add_suffix(' Path Def')
-
-def pathway_def_merge(pathway_def, from_or_to, output_text):
-    ####Merge onto other dataframes
-    output_text = print_and_add_str(output_text, f'------------{from_or_to} PROCESSES------------')
-    output_text = print_and_add_str(output_text, ' ')
-    pathway_proc_col = f'{from_or_to} Process Path Def'
-    pathway_def = (pathway_def.merge(processes, left_on=pathway_proc_col,
-                                  right_on='Process (Pathway and Recurrent) Proc Dur',
-                                  how='outer')
-                              .merge(recurrence, left_on=pathway_proc_col,
-                                     right_on='Trigger Process (In Pathway) Rec Trig',
-                                     how='outer')
-                              .merge(resources, left_on=pathway_proc_col,
-                                     right_on='Process (Pathway or Recurrent) Res Req',
-                                     how='outer')
-                              .merge(locations, left_on=pathway_proc_col,
-                                     right_on='Process Proc Loc', how='outer'))
-
-    pathway_def_simp = pathway_def[[pathway_proc_col,
-                                  'Process (Pathway and Recurrent) Proc Dur',
-                                  'Trigger Process (In Pathway) Rec Trig',
-                                  'Recurrent Process (Not In Pathway) Rec Trig',
-                                  'Recurrent Process Pro Rec',
-                                  'InitialProcess Arr Rat',
-                                  'Process (Pathway or Recurrent) Res Req',
-                                  'Requirement Res Req',
-                                  'Resource Type Res Rota', 'Process Proc Loc',
-                                  'Location Proc Loc', 'Location Loc Cap',
-                                  'Location Loc Open']]
-
-    #get rows where pathway column is nan
-    pathway_nas = pathway_def[pathway_proc_col].isna()
-
-    output_text = print_and_add_str(output_text, '---------------PROCESSES DURATIONS---------------')
-    #get rows where process durations is nan
-    proc_dur_nas = pathway_def['Process (Pathway and Recurrent) Proc Dur'].isna()
-    #print processess in the pathway that are missing durations
-    proc_no_dur = (pathway_def.loc[(proc_dur_nas) & ~(pathway_nas),
-                                   pathway_proc_col]
-                                   .drop_duplicates().dropna().to_list())
-    output_text = print_missing('--Pathway Processes with missing durations:', proc_no_dur, output_text)
-    #Print durations that aren't in pathway processes
-    dur_no_proc = (pathway_def.loc[(pathway_nas) & ~(proc_dur_nas), 
-                                   'Process (Pathway and Recurrent) Proc Dur']
-                                   .drop_duplicates().dropna().to_list())
-    output_text = print_missing('--Process durations not in pathway definition:', dur_no_proc, output_text)
-
-
-    output_text = print_and_add_str(output_text, '---------------RECURRENT PROCESSES---------------')
-    #get rows where recurrent triggers are nan
-    rec_trig_nas = pathway_def['Trigger Process (In Pathway) Rec Trig'].isna()
-    #print recurrent processes that aren't in the pathway definitions.
-    missing_rec = (pathway_def.loc[(pathway_nas) & ~(rec_trig_nas),
-                                   'Trigger Process (In Pathway) Rec Trig']
-                                   .drop_duplicates().dropna().to_list())
-    output_text = print_missing('--Recurrent Processes missing from pathway:', missing_rec, output_text)
-
-    output_text = print_and_add_str(output_text, '---------------RESOURCES---------------')
-    #get rows where resource requirement is na
-    res_req_nas = pathway_def['Process (Pathway or Recurrent) Res Req'].isna()
-    #Print processes in the pathway that don't have resources
-    path_no_res = (pathway_def.loc[(res_req_nas) & ~(pathway_nas),
-                                   pathway_proc_col]
-                                   .drop_duplicates().dropna().to_list())
-    output_text = print_missing("--Pathway processes with no staff requirements:", path_no_res, output_text)
-    #Print resource processes which aren't in the pathway definition
-    res_no_path = (pathway_def.loc[(pathway_nas) & ~(res_req_nas),
-                                   'Process (Pathway or Recurrent) Res Req']
-                                   .drop_duplicates().dropna().to_list())
-    output_text = print_missing("--Resource processes that are missing from the pathway definition:",
-                  res_no_path, output_text)
-    
-    output_text = print_and_add_str(output_text, '---------------LOCATIONS---------------')
-    #get rows where Location is na
-    proc_loc_nas = pathway_def['Process Proc Loc'].isna()
-
-    #Get the pathway definitions that are missing process locations
-    path_no_proc_loc = (pathway_def.loc[(proc_loc_nas) & ~(pathway_nas),
-                                        pathway_proc_col]
-                                        .drop_duplicates().dropna().to_list())
-    output_text = print_missing("--Pathway processes that don't match with a process location:",
-                  path_no_proc_loc, output_text)
-    #print the processes locations that aren't in pathway definition
-    proc_loc_no_path = (pathway_def.loc[(pathway_nas) & ~(proc_loc_nas),
-                                        'Process Proc Loc']
-                                        .drop_duplicates().dropna().to_list())
-    output_text = print_missing('--Process Locations that are missing from the pathway definition:',
-                  proc_loc_no_path, output_text)
-    
-    return pathway_def, pathway_def_simp, output_text
-
-from_pathway_def, from_pathway_simp, output_text = pathway_def_merge(pathway_definition.copy(), 'From', output_text)
-to_pathway_def, to_pathway_simp, output_text = pathway_def_merge(pathway_definition.copy(), 'To', output_text)
-
-#Change to output filepath (create if doens't exist)
-validation_filepath = outputs_filepath + '/validation'
-if not os.path.exists(validation_filepath):
-    os.mkdir(validation_filepath)
-os.chdir(validation_filepath)
-
-#Export smaller combined data frames
-processes.to_csv('processes validaiton.csv', index=False)
-locations.to_csv('locations validation.csv', index=False)
-resources.to_csv('resources validation.csv', index=False)
-recurrence.to_csv('recurrence validation.csv', index=False)
-#export from and to combined data frames
-from_pathway_def.to_csv('combined from pathway validation.csv', index=False)
-from_pathway_simp.to_csv('combined from pathway validaton simple.csv', index=False)
-to_pathway_def.to_csv('combined to pathway validation.csv', index=False)
-to_pathway_simp.to_csv('combined to pathway validation simple.csv', index=False)
-
-with open('Output.txt', 'w', encoding='utf-8') as f:
-    f.write(output_text)
\ No newline at end of file
+                                  .merge(recurrence, left_on=pathway_proc_col,
+                                         right_on='Trigger Process (In Pathway) Rec Trig',
+                                         how='outer')
+                                  .merge(resources, left_on=pathway_proc_col,
+                                         right_on='Process (Pathway or Recurrent) Res Req',
+                                         how='outer')
+                                  .merge(locations, left_on=pathway_proc_col,
+                                         right_on='Process Proc Loc', how='outer'))
+
+        pathway_def_simp = pathway_def[[pathway_proc_col,
+                                      'Process (Pathway and Recurrent) Proc Dur',
+                                      'Trigger Process (In Pathway) Rec Trig',
+                                      'Recurrent Process (Not In Pathway) Rec Trig',
+                                      'Recurrent Process Pro Rec',
+                                      'InitialProcess Arr Rat',
+                                      'Process (Pathway or Recurrent) Res Req',
+                                      'Requirement Res Req',
+                                      'Resource Type Res Rota', 'Process Proc Loc',
+                                      'Location Proc Loc', 'Location Loc Cap',
+                                      'Location Loc Open']]
+        return pathway_def, pathway_def_simp
+
+    output_text = pathway_def_check(pathway_definition, 'From', output_text)
+    output_text = pathway_def_check(pathway_definition, 'To', output_text)
+
+    #Smaller combined data frames to export
+    tables = {'processes validaiton.csv': processes,
+              'locations validation.csv': locations,
+              'resources validation.csv': resources,
+              'recurrence validation.csv': recurrence}
+    #from and to combined data frames
+    if export_combined_pathway_validation:
+        from_pathway_def, from_pathway_simp = pathway_def_merge(pathway_definition.copy(), 'From')
+        to_pathway_def, to_pathway_simp = pathway_def_merge(pathway_definition.copy(), 'To')
+        tables.update({'combined from pathway validation.csv': from_pathway_def,
+                       'combined from pathway validaton simple.csv': from_pathway_simp,
+                       'combined to pathway validation.csv': to_pathway_def,
+                       'combined to pathway validation simple.csv': to_pathway_simp})
+
+    return output_text, tables, issues
+
+def write_validation_outputs(validation_filepath, output_text, tables):
+    """
+    Args:
+        validation_filepath (Path): folder to write the outputs to, created if
+        it doesn't exist.
+        output_text (str): the validation report, written to Output.txt.
+        tables (dict[str, pd.DataFrame]): the merged tables to export, keyed
+        by file name.
+    """
+    validation_filepath = Path(validation_filepath)
+    validation_filepath.mkdir(exist_ok=True, parents=True)
+    for filename, table in tables.items():
+        table.to_csv(validation_filepath / filename, index=False)
+    with open(validation_filepath / 'Output.txt', 'w', encoding='utf-8') as f:
+        f.write(output_text)
+
+def validate_and_write_scenario(folder, inputs, export_combined_pathway_validation):
+    """
+    Args:
+        folder (Path): scenario folder, whose outputs are written to its
+        validation folder.
+        inputs (dict[str, pd.DataFrame]): the input dataframes of the
+        scenario.
+        export_combined_pathway_validation (bool): flag to also export the
+        full merge of the pathway definition with every other table.
+
+    Returns:
+        dict[str, list]: the names found by each check.
+    """
+    output_text, tables, issues = validate_scenario(inputs,
+                                  export_combined_pathway_validation)
+    write_validation_outputs(Path(folder) / 'validation', output_text, tables)
+    return issues
+
+def validate_scenarios(folders, summary_path=None, number_of_workers=4,
+                       export_combined_pathway_validation=False):
+    """
+    Args:
+        folders (list[Path]): scenario folders to validate. Each one's outputs
+        are written to its validation folder.
+        summary_path (Optional[Path], optional): csv file to save the summary
+        to. Defaults to None.
+        number_of_workers (int, optional): number of processes to validate the
+        scenarios across, up to the number of CPUs. 1 or less validates them
+        one after another in this process. Defaults to 4.
+        export_combined_pathway_validation (bool, optional): flag to also
+        export the full merge of the pathway definition with every other
+        table. Defaults to False.
+
+    Returns:
+        pd.DataFrame: summary of the number of names found by each check (the
+        columns) for each scenario (the rows).
+    """
+    #Files with the same contents across scenarios are only read once.
+    scenario_inputs = read_shared_inputs(folders, number_of_workers)
+    number_of_workers = min(number_of_workers, len(folders),
+                            os.cpu_count() or 1)
+    arguments = (folders, scenario_inputs,
+                 [export_combined_pathway_validation] * len(folders))
+    if number_of_workers <= 1:
+        scenario_issues = list(map(validate_and_write_scenario, *arguments))
+    else:
+        with ProcessPoolExecutor(number_of_workers) as executor:
+            scenario_issues = list(executor.map(validate_and_write_scenario,
+                                                *arguments))
+
+    summary = pd.DataFrame([{check: len(names) for check, names in issues.items()}
+                            for issues in scenario_issues])
+    summary.insert(0, 'Scenario', [str(folder) for folder in folders])
+    summary.insert(1, 'Total Issues',
+                   summary.drop(columns=['Scenario',
+                                         "Process Durations that aren't Wait in Place (No Issue)"])
+                          .sum(axis=1))
+    if summary_path is not None:
+        Path(summary_path).parent.mkdir(exist_ok=True, parents=True)
+        summary.to_csv(summary_path, index=False)
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate simulation input '
+                                     'files. Each scenario\'s report is written '
+                                     'to its validation folder.')
+    parser.add_argument('folders', nargs='*', type=Path,
+                        default=[Path(scenario_filepath)],
+                        help='scenario folders to validate')
+    parser.add_argument('--summary', type=Path, default=None,
+                        help='csv file to save the summary of every scenario to')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of processes to validate across')
+    parser.add_argument('--export-combined', action='store_true',
+                        help='also export the full merge of the pathway '
+                        'definition with every other table')
+    args = parser.parse_args()
+
+    if len(args.folders) == 1 and args.summary is None:
+        output_text, tables, _ = validate_scenario(args.folders[0],
+                                                   args.export_combined)
+        print(output_text)
+        write_validation_outputs(args.folders[0] / 'validation', output_text,
+                                 tables)
+    else:
+        summary = validate_scenarios(args.folders, args.summary, args.workers,
+                                     args.export_combined)
+        print(summary.to_string(index=False))
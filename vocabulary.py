@@ -0,0 +1,216 @@
+from pathlib import Path
+import os
+import numpy as np
+import pandas as pd
+from profiling import profiled
+from config import (SPAWN, REMOVED, WALK_IN, WAITING_FOR_BED, admitted_map,
+                    locations_pathway_map, natural_order_for_processes)
+
+path_to_vocabulary = Path(r"./Outputs/State/Vocabulary.csv")
+CATEGORICAL_COLUMNS = ["EventName", "EventLocation", "ItemMasterCategory", "Adm"]
+
+#Every string the events data can hold, in the order they were first seen.
+#The vocabulary only ever grows, so codes stay the same between runs.
+_vocabulary = None
+
+
+def get_vocabulary():
+    """
+    Returns:
+        pd.CategoricalDtype: the shared dtype of all encoded string columns.
+    """
+    global _vocabulary
+    if _vocabulary is None:
+        if path_to_vocabulary.exists():
+            values = pd.read_csv(path_to_vocabulary, keep_default_na=False,
+                                 dtype=str)["Value"].tolist()
+        else:
+            values = []
+        _vocabulary = pd.CategoricalDtype(values)
+        extend_vocabulary([SPAWN, REMOVED, WALK_IN, "Observations", "Ambulance",
+                           *admitted_map.keys(), *admitted_map.values(),
+                           *natural_order_for_processes.keys(),
+                           *locations_pathway_map.keys(),
+                           *locations_pathway_map.values()])
+    return _vocabulary
+
+
+def extend_vocabulary(values):
+    """
+    Args:
+        values (Iterable[str]): strings to add to the vocabulary. The names the
+        clensing steps derive from them (wait for bed events and each event
+        with its pathway) are added too.
+
+    Returns:
+        pd.CategoricalDtype: the shared dtype of all encoded string columns.
+    """
+    global _vocabulary
+    vocabulary = get_vocabulary() if _vocabulary is None else _vocabulary
+    known = set(vocabulary.categories)
+    new_values = sorted({value for value in values
+                         if isinstance(value, str)} - known)
+    if not new_values:
+        return vocabulary
+
+    pathways = sorted(set(locations_pathway_map.values()))
+    derived_values = []
+    for value in new_values:
+        for name in (value, f"{WAITING_FOR_BED} - {value}"):
+            derived_values += [name] + [f"{name} ({pathway})"
+                                        for pathway in pathways]
+    derived_values = [value for value in dict.fromkeys(derived_values)
+                      if value not in known]
+
+    _vocabulary = pd.CategoricalDtype(list(vocabulary.categories)
+                                      + derived_values)
+    return _vocabulary
+
+
+def save_vocabulary():
+    """
+    Writes the vocabulary to path_to_vocabulary so the codes stay the same
+    next run. Only the main process saves it, as workers may have extended
+    their own copies differently. The file is replaced in one step, so a run
+    that stops part way through leaves the last one whole.
+    """
+    vocabulary = get_vocabulary()
+    path_to_vocabulary.parent.mkdir(exist_ok=True, parents=True)
+    temporary_path = path_to_vocabulary.with_name(
+                     f"{path_to_vocabulary.name}.tmp")
+    pd.DataFrame({"Value": vocabulary.categories}).to_csv(temporary_path,
+                                                          index=False)
+    os.replace(temporary_path, path_to_vocabulary)
+
+
+@profiled
+def encode_columns(data, columns=None):
+    """
+    Args:
+        data (pd.DataFrame): dataframe with string columns.
+        columns (Optional[list[str]]): columns to encode. Defaults to any of
+        CATEGORICAL_COLUMNS in data, plus any columns already encoded.
+
+    Returns:
+        pd.DataFrame: dataframe with the columns as categoricals of the shared
+        vocabulary, so grouping, matching and merging on them compare integer
+        codes rather than strings. Writing the dataframe out decodes them.
+    """
+    if columns is None:
+        columns = [column for column in data.columns
+                   if column in CATEGORICAL_COLUMNS
+                   or is_encoded(data[column])]
+    columns = [column for column in columns if column in data.columns]
+    for column in columns:
+        values = data[column]
+        extend_vocabulary(values.cat.categories if is_encoded(values)
+                          else pd.unique(values))
+    vocabulary = get_vocabulary()
+    return data.assign(**{column: data[column].astype(vocabulary)
+                          for column in columns})
+
+
+def update_encoding(data):
+    """
+    Args:
+        data (pd.DataFrame): dataframe that may have encoded columns.
+
+    Returns:
+        pd.DataFrame: dataframe with any encoded columns moved onto the current
+        vocabulary, so they can be concatenated with newer data without being
+        turned back into strings.
+    """
+    return encode_columns(data, [column for column in data.columns
+                                 if is_encoded(data[column])])
+
+
+def decode_columns(data):
+    """
+    Args:
+        data (pd.DataFrame): dataframe that may have encoded columns.
+
+    Returns:
+        pd.DataFrame: dataframe with any encoded columns as strings again.
+    """
+    return data.astype({column: object for column in data.columns
+                        if is_encoded(data[column])})
+
+
+def is_encoded(values):
+    """
+    Args:
+        values (pd.Series): column of a dataframe.
+
+    Returns:
+        bool: whether the column is encoded with the vocabulary.
+    """
+    return isinstance(values.dtype, pd.CategoricalDtype)
+
+
+def constant_like(value, like, index):
+    """
+    Args:
+        value (str): value to fill the new column with.
+        like (pd.Series): column to take the encoding from.
+        index (pd.Index): index of the new column.
+
+    Returns:
+        pd.Series: column of the value, encoded if like is.
+    """
+    if is_encoded(like):
+        return pd.Series(pd.Categorical([value] * len(index),
+                                        dtype=like.dtype), index=index)
+    return pd.Series(value, index=index, dtype=object)
+
+
+def map_values(values, mapping):
+    """
+    Args:
+        values (pd.Series): string column.
+        mapping (dict): mapping of strings to new values.
+
+    Returns:
+        pd.Series: the mapped values, looked up once per distinct string.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = pd.Series(np.asarray(uniques, dtype=object)).map(mapping)
+    if len(mapped) == 0 or (codes < 0).any():
+        mapped = pd.concat([mapped, pd.Series([np.nan])], ignore_index=True)
+    return pd.Series(mapped.to_numpy()[codes], index=values.index)
+
+
+def map_strings(function, *columns):
+    """
+    Args:
+        function (Callable[..., Optional[str]]): function of one string from
+        each column to the new string (None if missing).
+        *columns (pd.Series): string columns of the same dataframe.
+
+    Returns:
+        pd.Series: the new strings, with the function only called once per
+        distinct combination. Missing in any column gives missing. Encoded
+        if the first column is.
+    """
+    codes, uniques = zip(*[pd.factorize(column) for column in columns])
+    present = np.logical_and.reduce([column_codes >= 0
+                                     for column_codes in codes])
+    shape = [max(len(column_uniques), 1) for column_uniques in uniques]
+    combined_codes, combined_uniques = pd.factorize(np.ravel_multi_index(
+        [column_codes[present] for column_codes in codes], shape))
+    new_uniques = [function(*[column_uniques[i] for column_uniques, i
+                              in zip(uniques, combination)])
+                   for combination in zip(*np.unravel_index(combined_uniques,
+                                                            shape))]
+    new_uniques = np.asarray([np.nan if value is None else value
+                              for value in new_uniques], dtype=object)
+
+    if is_encoded(columns[0]):
+        vocabulary = extend_vocabulary(new_uniques)
+        new_codes = np.full(len(present), -1, dtype=np.int32)
+        new_codes[present] = (vocabulary.categories.get_indexer(new_uniques)
+                              [combined_codes])
+        new_values = pd.Categorical.from_codes(new_codes, dtype=vocabulary)
+    else:
+        new_values = np.full(len(present), np.nan, dtype=object)
+        new_values[present] = new_uniques[combined_codes]
+    return pd.Series(new_values, index=columns[0].index)